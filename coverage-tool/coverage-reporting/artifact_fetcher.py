@@ -0,0 +1,280 @@
+# !/usr/bin/env python
+###############################################################################
+# Copyright (c) 2020, ARM Limited and Contributors. All rights reserved.
+#
+# SPDX-License-Identifier: BSD-3-Clause
+###############################################################################
+
+###############################################################################
+# FILE: artifact_fetcher.py
+#
+# DESCRIPTION: On-disk content-addressed cache of downloaded and copied
+#              files. Urls are revalidated with their ETag/Last-Modified
+#              headers and local files with their size and modification
+#              time, so only files that changed are downloaded or copied
+#              again. Archives are extracted while streamed, once per
+#              content.
+#
+###############################################################################
+
+import os
+import json
+import shutil
+import hashlib
+import tarfile
+import tempfile
+import threading
+import urllib.error
+import urllib.request
+
+CHUNK_SIZE = 1 << 20
+
+
+def link_file(source, destination):
+    """
+    Hard link a file, or copy it if it cannot be linked (e.g. different
+    file systems). An existing destination is replaced.
+    """
+    if os.path.lexists(destination):
+        os.remove(destination)
+    try:
+        os.link(source, destination)
+    except OSError:
+        shutil.copyfile(source, destination)
+
+
+def link_tree(source, destination):
+    """
+    Reproduce a folder tree linking its files, see 'link_file'
+    """
+    for root, folders, files in os.walk(source):
+        target = os.path.join(destination, os.path.relpath(root, source))
+        os.makedirs(target, exist_ok=True)
+        for file_name in files:
+            link_file(os.path.join(root, file_name),
+                      os.path.join(target, file_name))
+
+
+def check_checksum(name, checksum, digest):
+    """
+    Fail if the digest of a content is not the expected one
+
+    :param name: Url or name of the content, for the error message
+    :param checksum: Expected sha256, None to skip the check
+    :param digest: Actual sha256
+    """
+    if checksum and digest != checksum:
+        raise Exception("Checksum mismatch for '{}': expected {}, got "
+                        "{}".format(name, checksum, digest))
+
+
+class HashingReader(object):
+    """Binary file object that hashes the content read from another one,
+    so a stream can be checked while it is extracted or copied
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.digest = hashlib.sha256()
+
+    def read(self, size=-1):
+        data = self.stream.read(size)
+        self.digest.update(data)
+        return data
+
+    def hexdigest(self):
+        """
+        :return: sha256 of the whole stream, including what was not read
+                yet (e.g. the padding after the end of a tar archive)
+        """
+        for _ in iter(lambda: self.read(CHUNK_SIZE), b''):
+            pass
+        return self.digest.hexdigest()
+
+
+def safe_members(archive):
+    """
+    Members of a tar archive, failing on the ones that would be extracted
+    outside the destination folder: absolute names, names with '..', links
+    and device files
+
+    :param archive: tarfile object, possibly opened as a stream
+    :return: Generator of the members
+    """
+    for member in archive:
+        name = member.name.replace('\\', '/')
+        if name.startswith('/') or '..' in name.split('/') or \
+                member.issym() or member.islnk() or member.isdev():
+            raise Exception("Unsafe member '{}' in archive".format(
+                member.name))
+        yield member
+
+
+def extract_all(archive, folder):
+    """
+    Extract all the members of a tar archive into a folder, with the 'data'
+    filter if tarfile supports it and rejecting the unsafe members if not,
+    see 'safe_members'
+
+    :param archive: tarfile object, possibly opened as a stream
+    :param folder: Destination folder
+    """
+    if hasattr(tarfile, 'data_filter'):
+        archive.extractall(folder, filter='data')
+    else:
+        archive.extractall(folder, members=safe_members(archive))
+
+
+class ArtifactCache(object):
+    """Cache of files stored by the sha256 of their content. An index maps
+    the urls and local files already fetched to their content digest, with
+    the information needed to tell if they changed. It can be used from
+    several threads.
+    """
+
+    def __init__(self, cache_dir):
+        self.cache_dir = os.path.abspath(cache_dir)
+        self.blobs_dir = os.path.join(self.cache_dir, "blobs")
+        self.extracted_dir = os.path.join(self.cache_dir, "extracted")
+        os.makedirs(self.blobs_dir, exist_ok=True)
+        os.makedirs(self.extracted_dir, exist_ok=True)
+        self.index_file = os.path.join(self.cache_dir, "index.json")
+        self.lock = threading.Lock()
+        try:
+            with open(self.index_file) as f:
+                self.index = json.load(f)
+        except (IOError, ValueError):
+            self.index = {}
+
+    def blob_path(self, digest):
+        return os.path.join(self.blobs_dir, digest)
+
+    def lookup(self, key):
+        with self.lock:
+            entry = self.index.get(key)
+        if entry and os.path.isfile(self.blob_path(entry['digest'])):
+            return entry
+        return None
+
+    def update(self, key, entry):
+        with self.lock:
+            self.index[key] = entry
+            fd, temp_name = tempfile.mkstemp(dir=self.cache_dir,
+                                             suffix='.tmp')
+            with os.fdopen(fd, 'w') as f:
+                json.dump(self.index, f, indent=1, sort_keys=True)
+            os.replace(temp_name, self.index_file)
+
+    def store(self, stream):
+        """
+        Store the content of a stream, hashing it while it is written
+
+        :param stream: Binary file object
+        :return: Digest of the content
+        """
+        digest = hashlib.sha256()
+        fd, temp_name = tempfile.mkstemp(dir=self.blobs_dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                for chunk in iter(lambda: stream.read(CHUNK_SIZE), b''):
+                    digest.update(chunk)
+                    f.write(chunk)
+            digest = digest.hexdigest()
+            # Blobs are shared through hard links, so keep them read only
+            os.chmod(temp_name, 0o444)
+            os.replace(temp_name, self.blob_path(digest))
+        except BaseException:
+            os.remove(temp_name)
+            raise
+        return digest
+
+    def fetch_url(self, url, checksum=None):
+        """
+        Download a url unless the cached copy is still valid
+
+        :param url: Url of the file
+        :param checksum: Optional expected sha256 of the content. If it is
+                         already cached the url is not even revalidated,
+                         otherwise the url is downloaded again and checked
+                         whatever its cached copy.
+        :return: Digest of the content
+        """
+        if checksum and os.path.isfile(self.blob_path(checksum)):
+            return checksum
+        key = "url:" + url
+        entry = self.lookup(key)
+        request = urllib.request.Request(url)
+        # The cached copy does not have the checksum, so a 304 is no use
+        if entry and not checksum:
+            if entry.get('etag'):
+                request.add_header('If-None-Match', entry['etag'])
+            if entry.get('last_modified'):
+                request.add_header('If-Modified-Since',
+                                   entry['last_modified'])
+        try:
+            with urllib.request.urlopen(request) as response:
+                digest = self.store(response)
+                headers = response.headers
+        except urllib.error.HTTPError as ex:
+            if ex.code == 304 and entry:
+                return entry['digest']
+            raise
+        check_checksum(url, checksum, digest)
+        self.update(key, {'digest': digest,
+                          'etag': headers.get('ETag'),
+                          'last_modified': headers.get('Last-Modified')})
+        return digest
+
+    def fetch_path(self, path):
+        """
+        Copy a local file unless the cached copy is still valid, i.e. the
+        file kept its size and modification time
+
+        :param path: File name
+        :return: Digest of the content
+        """
+        path = os.path.abspath(path)
+        key = "file:" + path
+        stat = os.stat(path)
+        entry = self.lookup(key)
+        if entry and entry['size'] == stat.st_size and \
+                entry['mtime'] == stat.st_mtime_ns:
+            return entry['digest']
+        with open(path, 'rb') as f:
+            digest = self.store(f)
+        self.update(key, {'digest': digest, 'size': stat.st_size,
+                          'mtime': stat.st_mtime_ns})
+        return digest
+
+    def extract(self, digest):
+        """
+        Extract an archive (any compression supported by tarfile) reading
+        it as a stream. Each archive content is extracted only once.
+
+        :param digest: Digest of the archive
+        :return: Folder with the extracted files, not to be modified
+        """
+        folder = os.path.join(self.extracted_dir, digest)
+        if os.path.isdir(folder):
+            return folder
+        temp_folder = tempfile.mkdtemp(dir=self.extracted_dir,
+                                       suffix='.tmp')
+        try:
+            with open(self.blob_path(digest), 'rb') as f, \
+                    tarfile.open(fileobj=f, mode='r|*') as archive:
+                extract_all(archive, temp_folder)
+            # Shared through hard links as the blobs, so keep them read only
+            for root, _, files in os.walk(temp_folder):
+                for file_name in files:
+                    path = os.path.join(root, file_name)
+                    if not os.path.islink(path):
+                        os.chmod(path, os.stat(path).st_mode & ~0o222)
+            os.rename(temp_folder, folder)
+        except OSError:
+            shutil.rmtree(temp_folder, ignore_errors=True)
+            if not os.path.isdir(folder):  # Not extracted by another thread
+                raise
+        except BaseException:
+            shutil.rmtree(temp_folder, ignore_errors=True)
+            raise
+        return folder
@@ -0,0 +1,133 @@
+# !/usr/bin/env python
+###############################################################################
+# Copyright (c) 2020, ARM Limited and Contributors. All rights reserved.
+#
+# SPDX-License-Identifier: BSD-3-Clause
+###############################################################################
+
+###############################################################################
+# FILE: asm_branches.py
+#
+# DESCRIPTION: Branch coverage from the assembly code in the intermediate
+#              json file. Conditional branch instructions are found for
+#              every source line and the execution counts of their target
+#              and fall-through addresses tell if each branch was taken.
+#
+###############################################################################
+
+import re
+
+CONDITIONS = "eq|ne|cs|hs|cc|lo|mi|pl|vs|vc|hi|ls|ge|lt|gt|le"
+# A64: b.<cond>, bc.<cond>. A32/T32: b<cond> with optional width qualifier
+CONDITIONAL_BRANCH = re.compile(
+    r"^(?:bc?\.(?:{0})|b(?:{0})(?:\.[nw])?|cbz|cbnz|tbz|tbnz)$".format(
+        CONDITIONS))
+# Any branch instruction, conditional or not, including calls and returns
+# through registers
+BRANCH = re.compile(
+    r"^(?:b|bl|blx|br|blr|bx|bc?\.(?:{0})|b(?:{0})|cbz|cbnz|tbz|tbnz)"
+    r"(?:\.[nw])?$".format(CONDITIONS))
+TARGET_PATTERN = re.compile(r"([0-9a-fA-F]+)\s*<[^>]*>")
+
+
+def parse_opcode(opcode):
+    """
+    Split an opcode string from the objdump output, i.e.
+    '54000061 \\tb.ne\\t400010 <foo+0x10>'
+
+    :param opcode: Opcode string as stored in the intermediate json file
+    :return: Tuple of (instruction size in bytes, mnemonic, operands)
+    """
+    encoding, _, instruction = opcode.partition('\t')
+    size = len(encoding.replace(' ', '')) // 2
+    parts = instruction.split(None, 1)
+    mnemonic = parts[0] if parts else ""
+    operands = parts[1] if len(parts) > 1 else ""
+    return size, mnemonic, operands
+
+
+def is_branch(opcode):
+    """
+    Check if an instruction is a branch
+
+    :param opcode: Opcode string as stored in the intermediate json file
+    """
+    return BRANCH.match(parse_opcode(opcode)[1]) is not None
+
+
+def conditional_branch_target(opcode):
+    """
+    Get the target of a conditional branch instruction
+
+    :param opcode: Opcode string as stored in the intermediate json file
+    :return: Tuple of (instruction size in bytes, target address) or None
+            if the instruction is not a conditional branch
+    """
+    size, mnemonic, operands = parse_opcode(opcode)
+    if not CONDITIONAL_BRANCH.match(mnemonic):
+        return None
+    match = TARGET_PATTERN.search(operands)
+    if match:
+        return size, int(match.group(1), 16)
+    try:
+        return size, int(operands.split(',')[-1].strip(), 16)
+    except ValueError:
+        return None
+
+
+def address_counts(source_files):
+    """
+    Build the execution count of every address of every elf file
+
+    :param source_files: Dictionary of source files in the intermediate json
+    :return: Dictionary of {elf index}=>{address}=>times executed
+    """
+    counts = {}
+    for source_data in source_files.values():
+        for line_data in source_data['lines'].values():
+            for elf_index, addresses in line_data['elf_index'].items():
+                elf_counts = counts.setdefault(str(elf_index), {})
+                for address, (_, times_executed) in addresses.items():
+                    elf_counts[int(address)] = times_executed
+    return counts
+
+
+def branch_records(lines_dict, counts):
+    """
+    Produce the branch coverage of a source file. Every conditional branch
+    instruction of a line is a block with two branches: 0 (taken) and 1
+    (not taken). A branch is hit as many times as its target (or
+    fall-through address) was executed, up to the times the branch
+    instruction itself was executed.
+
+    :param lines_dict: Dictionary of lines with line number as key
+                       and its data as value
+    :param counts: Execution counts as returned by 'address_counts'
+    :return: List of tuples of (line, block, branch, times hit) sorted by
+            line. Times hit is None if the branch instruction was never
+            executed.
+    """
+    records = []
+    for line in sorted(lines_dict, key=int):
+        if lines_dict[line].get('branch_instructions', 1) == 0:
+            continue  # No branches found at disassembly time
+        block = 0
+        for elf_index, addresses in lines_dict[line]['elf_index'].items():
+            elf_counts = counts.get(str(elf_index), {})
+            for address in sorted(addresses, key=int):
+                opcode, times_executed = addresses[address]
+                branch = conditional_branch_target(opcode)
+                if branch is None:
+                    continue
+                size, target = branch
+                if times_executed == 0:
+                    taken = not_taken = None
+                else:
+                    taken = min(elf_counts.get(target, 0), times_executed)
+                    not_taken = min(
+                        elf_counts.get(int(address) + size, 0),
+                        times_executed)
+                records.append((int(line), block, 0, taken))
+                records.append((int(line), block, 1, not_taken))
+                block += 1
+    return records
@@ -10,7 +10,7 @@
 # FILE: branch_coverage.sh
 #
 # DESCRIPTION: Generates intermediate layer json file and then
-# code coverage HTML reports using LCOV report Open Source tool
+# code coverage HTML reports from the LCOV info file
 #==============================================================================
 
 set +x
@@ -32,10 +32,6 @@ err() {
 }
 
 touch ${ERROR_FILE}
-if ! [ -x "$(command -v lcov)" ]; then
-  err 'Error: lcov is not installed. Install it with:\nsudo apt install lcov\n'
-  exit 1
-fi
 
 ###############################################################################
 # Prints script usage.
@@ -53,7 +49,8 @@ usage()
     printf "\t --workspace Local workspace folder where source codes reside. \
             Required.\n"
     printf "\t --json-path Intermediate json file name. Optional defaults to \
-            'output_file.json'\n"
+            the 'output_file' of the configuration json file\n"
+    printf "\t --no-json Do not write the intermediate json file\n"
     printf "\t --outdir Report folder. Optional defaults to 'out'\n"
     printf "\t -h|--help Display usage\n"
     printf "Example of usage:\n"
@@ -63,7 +60,8 @@ usage()
 }
 
 # default values
-JSON_PATH=output_file.json
+JSON_PATH=""
+NO_JSON=""
 OUTDIR=out
 
 ###############################################################################
@@ -72,6 +70,7 @@ OUTDIR=out
 # CONFIG_JSON
 # LOCAL_WORKSPACE
 # JSON_PATH
+# NO_JSON
 # OUTDIR
 # Arguments:
 #   Command line arguments
@@ -80,10 +79,15 @@ OUTDIR=out
 ###############################################################################
 parse_arguments()
 {
-  while [ $# -gt 1 ]
+  while [ $# -gt 0 ]
   do
     key="$1"
     case $key in
+      --no-json)
+        NO_JSON=1
+        shift
+        continue
+      ;;
       --config)
         CONFIG_JSON="$2"
         shift
@@ -133,11 +137,16 @@ fi
 # TERM enviroment, so ignore this and other possible errors
 clear || true
 
-echo "Generating intermediate layer file '$JSON_PATH'..."
-python3 intermediate_layer.py --config-json "$CONFIG_JSON" --local-workspace $LOCAL_WORKSPACE
-echo "Converting intermediate layer file to info file..."
-python3 generate_info_file.py --workspace $LOCAL_WORKSPACE --json $JSON_PATH
-echo "Generating LCOV report at '$OUTDIR'..."
-genhtml --branch-coverage coverage.info --output-directory $OUTDIR
+json_path_option=""
+if [ -n "$NO_JSON" ]; then
+  json_path_option="--no-json"
+elif [ -n "$JSON_PATH" ]; then
+  json_path_option="--json-path $JSON_PATH"
+fi
+echo "Generating info file from the trace files..."
+python3 coverage_cli.py --config-json "$CONFIG_JSON" \
+    --local-workspace $LOCAL_WORKSPACE $json_path_option
+echo "Generating HTML report at '$OUTDIR'..."
+python3 html_report.py --info coverage.info --output-directory $OUTDIR
 mv coverage.info $OUTDIR/coverage.info
 mv error_log.txt $OUTDIR/error_log.txt
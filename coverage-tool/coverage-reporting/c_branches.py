@@ -0,0 +1,327 @@
+# !/usr/bin/env python
+###############################################################################
+# Copyright (c) 2020, ARM Limited and Contributors. All rights reserved.
+#
+# SPDX-License-Identifier: BSD-3-Clause
+###############################################################################
+
+###############################################################################
+# FILE: c_branches.py
+#
+# DESCRIPTION: Finds the branching statements of a C source file (if, else
+#              if, else, switch and case) and the line spans of their
+#              branches, tokenizing the file once and ignoring comments,
+#              strings and preprocessor directives.
+#
+###############################################################################
+
+import os
+import re
+import json
+import hashlib
+import tempfile
+
+# Part of the cache key, to be increased whenever the layout of the branch
+# sites changes
+CACHE_VERSION = 2
+
+TOKEN_PATTERN = re.compile(r"""
+    (?P<preprocessor>^[ \t]*\#(?:\\\n|[^\n])*)
+   |(?P<comment>//(?:\\\n|[^\n])*|/\*.*?(?:\*/|\Z))
+   |(?P<string>"(?:\\.|[^"\\\n])*"?|'(?:\\.|[^'\\\n])*'?)
+   |(?P<newline>\n)
+   |(?P<space>[ \t\r\f\v]+)
+   |(?P<word>[A-Za-z_][A-Za-z0-9_]*)
+   |(?P<number>\.?[0-9](?:[eEpP][+-]|[A-Za-z0-9_.])*)
+   |(?P<punctuation>.)
+    """, re.DOTALL | re.MULTILINE | re.VERBOSE)
+
+# Keywords that start a statement, an expression statement never goes past
+# them
+STATEMENT_KEYWORDS = {'if', 'else', 'switch', 'case', 'default', 'while',
+                      'for', 'do', 'return', 'break', 'continue', 'goto'}
+# Tokens after which a '{' opens an initializer rather than a block
+INITIALIZER_PREFIXES = {'=', ',', '(', '[', 'return'}
+OPENING = {'(': ')', '[': ']', '{': '}'}
+
+
+def tokenize(text):
+    """
+    Split C source code into tokens
+
+    :param text: C source code
+    :return: List of tuples of (token, line number) without whitespace,
+            comments and preprocessor directives. Strings and numbers are
+            replaced by '"' and '0' respectively.
+    """
+    tokens = []
+    line = 1
+    for match in TOKEN_PATTERN.finditer(text):
+        kind = match.lastgroup
+        value = match.group()
+        if kind == 'word' or kind == 'punctuation':
+            tokens.append((value, line))
+        elif kind == 'string':
+            tokens.append(('"', line))
+        elif kind == 'number':
+            tokens.append(('0', line))
+        if kind != 'word' and kind != 'punctuation':
+            line += value.count('\n')
+    return tokens
+
+
+class BranchSiteParser(object):
+    """Statement level parser of C source code that records the branching
+    statements. Each token is visited once.
+    """
+
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.sites = []
+
+    def token(self, i):
+        return self.tokens[i][0] if i < len(self.tokens) else None
+
+    def line(self, i):
+        return self.tokens[min(i, len(self.tokens) - 1)][1]
+
+    def parse(self):
+        """
+        Parse all the tokens
+
+        :return: List of branch sites, see 'branch_sites'
+        """
+        i = 0
+        while i < len(self.tokens):
+            if self.token(i) == '}':
+                i += 1  # Unbalanced brace, e.g. due to conditional code
+                continue
+            i, _, _ = self.parse_statement(i)
+        return self.sites
+
+    def skip_balanced(self, i):
+        """
+        Skip a parenthesized (or bracketed/braced) group of tokens
+
+        :param i: Index of the opening token
+        :return: Index after the closing token
+        """
+        stack = []
+        while i < len(self.tokens):
+            token = self.token(i)
+            if token in OPENING:
+                stack.append(OPENING[token])
+            elif stack and token == stack[-1]:
+                stack.pop()
+                if not stack:
+                    return i + 1
+            i += 1
+        return i
+
+    def parse_statement(self, i):
+        """
+        Parse a statement
+
+        :param i: Index of the first token of the statement
+        :return: Tuple of (index after the statement, line span of the
+                statement as [first line, last line] or None if it is
+                empty, 'label' for case/default labels or None)
+        """
+        token = self.token(i)
+        if token == '{':
+            return self.parse_block(i)
+        if token == ';':
+            return i + 1, None, None
+        if token == 'if':
+            return self.parse_if(i)
+        if token == 'switch':
+            return self.parse_switch(i)
+        if token in ('while', 'for'):
+            first = self.line(i)
+            i = self.skip_balanced(i + 1)
+            i, span, _ = self.parse_statement(i)
+            return i, [first, span[1] if span else self.line(i - 1)], None
+        if token == 'do':
+            first = self.line(i)
+            i, _, _ = self.parse_statement(i + 1)
+            if self.token(i) == 'while':
+                i = self.skip_balanced(i + 1)
+            if self.token(i) == ';':
+                i += 1
+            return i, [first, self.line(i - 1)], None
+        if token in ('case', 'default'):
+            first = self.line(i)
+            while i < len(self.tokens) and self.token(i) != ':':
+                i += 1
+            return i + 1, [first, first], 'label'
+        if token == 'else':
+            # 'else' without 'if', e.g. due to conditional code
+            return i + 1, None, None
+        return self.parse_expression(i)
+
+    def parse_expression(self, i):
+        """
+        Parse an expression statement or declaration
+
+        :param i: Index of the first token
+        :return: Same as 'parse_statement'
+        """
+        first = self.line(i)
+        start = i
+        previous = None
+        while i < len(self.tokens):
+            token = self.token(i)
+            if token == ';':
+                return i + 1, [first, self.line(i)], None
+            if token in ('}', ')', ']') or \
+                    (token in STATEMENT_KEYWORDS and i > start):
+                break
+            if token == '{' and previous not in INITIALIZER_PREFIXES:
+                # e.g. function body or a macro followed by a block
+                break
+            if token in OPENING:
+                i = self.skip_balanced(i)
+            else:
+                i += 1
+            previous = self.token(i - 1)
+        if i == start:
+            i += 1  # Always make progress
+        return i, [first, self.line(i - 1)], None
+
+    def parse_block(self, i):
+        """
+        Parse a compound statement
+
+        :param i: Index of the '{' token
+        :return: Same as 'parse_statement', with the span of the statements
+                within the braces
+        """
+        i += 1
+        span = None
+        while i < len(self.tokens) and self.token(i) != '}':
+            i, statement, _ = self.parse_statement(i)
+            span = merge_spans(span, statement)
+        return i + 1, span, None
+
+    def parse_if(self, i):
+        """
+        Parse an if statement with all its 'else if' and 'else' branches
+
+        :param i: Index of the 'if' token
+        :return: Same as 'parse_statement'
+        """
+        first = self.line(i)
+        chain = []
+        while True:
+            site = {"type": "if", "line": self.line(i), "then": None,
+                    "else": None}
+            self.sites.append(site)
+            chain.append(site)
+            i = self.skip_balanced(i + 1)
+            condition_end = self.line(i - 1)
+            site["condition"] = [site["line"], condition_end]
+            i, site["then"], _ = self.parse_statement(i)
+            last = site["then"][1] if site["then"] else condition_end
+            if self.token(i) != 'else':
+                break
+            i += 1
+            if self.token(i) == 'if':
+                # 'else if': the else branch spans the rest of the chain
+                site["else"] = [self.line(i), None]
+                continue
+            i, site["else"], _ = self.parse_statement(i)
+            if site["else"]:
+                last = site["else"][1]
+            break
+        for site in chain:
+            if site["else"] and site["else"][1] is None:
+                site["else"][1] = last
+        return i, [first, last], None
+
+    def parse_switch(self, i):
+        """
+        Parse a switch statement and the line spans of its cases
+
+        :param i: Index of the 'switch' token
+        :return: Same as 'parse_statement'
+        """
+        first = self.line(i)
+        site = {"type": "switch", "line": first, "cases": []}
+        self.sites.append(site)
+        i = self.skip_balanced(i + 1)
+        if self.token(i) != '{':
+            return self.parse_statement(i)
+        i += 1
+        case = None
+        while i < len(self.tokens) and self.token(i) != '}':
+            i, span, kind = self.parse_statement(i)
+            if kind == 'label':
+                case = list(span)
+                site["cases"].append(case)
+            elif case is not None and span:
+                case[1] = max(case[1], span[1])
+        return i + 1, [first, self.line(i)], None
+
+
+def merge_spans(span, other):
+    """
+    Get the line span that covers two line spans
+
+    :param span: Line span as [first line, last line] or None
+    :param other: Line span as [first line, last line] or None
+    """
+    if span is None:
+        return other
+    if other is None:
+        return span
+    return [min(span[0], other[0]), max(span[1], other[1])]
+
+
+def branch_sites(text):
+    """
+    Find the branching statements of C source code
+
+    :param text: C source code
+    :return: List of branch sites sorted by line. If statements (also the
+            ones after 'else') are dictionaries {"type": "if", "line": line
+            of the 'if', "condition": span of the condition, "then": span,
+            "else": span or None if there is no else}. A branch span that
+            starts on a line of the condition, e.g. 'if (x) return;', shares
+            that line with the condition. Switch statements are
+            dictionaries {"type": "switch", "line": line of the 'switch',
+            "cases": list of spans}. Spans are [first line, last line] or
+            None for empty branches.
+    """
+    return BranchSiteParser(tokenize(text)).parse()
+
+
+def cached_branch_sites(file_name, cache_dir=None):
+    """
+    Find the branching statements of a C source file. If a cache folder is
+    given the branch sites are stored there keyed by the hash of the file
+    content, so they are only computed once for the same content.
+
+    :param file_name: C source file name
+    :param cache_dir: Optional folder for the persistent cache
+    :return: List of branch sites, see 'branch_sites'
+    """
+    with open(file_name, 'rb') as f:
+        content = f.read()
+    if cache_dir is None:
+        return branch_sites(content.decode('utf8', errors='replace'))
+    digest = hashlib.sha256(content)
+    digest.update(str(CACHE_VERSION).encode())
+    cache_file = os.path.join(cache_dir, digest.hexdigest() + '.json')
+    try:
+        with open(cache_file) as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        pass
+    sites = branch_sites(content.decode('utf8', errors='replace'))
+    os.makedirs(cache_dir, exist_ok=True)
+    # Write and rename so concurrent runs never read a partial file
+    fd, temp_name = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+    with os.fdopen(fd, 'w') as f:
+        json.dump(sites, f)
+    os.replace(temp_name, cache_file)
+    return sites
@@ -9,13 +9,28 @@
 # FILE: clone_sources.py
 #
 # DESCRIPTION: Clone the source files for code coverage
+#              Sources can be cloned in parallel and git sources can be
+#              checked out as worktrees of mirrors shared by all the clones
+#              of the same url, fetching just the needed commit. The
+#              checkout can be limited to the files in the coverage report.
+#              Archives of http sources are extracted while downloaded.
 ###############################################################################
 
 import os
+import re
 import subprocess
 import json
-import time
-from random import random
+import fcntl
+import shutil
+import tarfile
+import hashlib
+import tempfile
+import threading
+import contextlib
+import concurrent.futures
+import urllib.request
+
+import artifact_fetcher
 
 
 def call_cmd(cmd, print_cmd=False):
@@ -82,6 +97,143 @@ def skip_source(output_dir, source, handler=None):
     return False
 
 
+def call_git(args, cwd=None, input=None):
+    """
+    Function that executes a git command and returns its output
+
+    :param args: List of git arguments
+    :param cwd: Optional folder where to run the command
+    :param input: Optional string for the standard input of the command
+    :return: The string output of the command
+    """
+    return subprocess.run(["git"] + args, cwd=cwd, check=True,
+                          input=input.encode() if input is not None else None,
+                          stdout=subprocess.PIPE,
+                          stderr=subprocess.STDOUT).stdout.decode().strip()
+
+
+def sparse_paths(json_data, location):
+    """
+    Get the files of a source that are in the coverage report. Absolute
+    source file names are matched by the location folder within them, as
+    merge.py does to translate them to the local workspace.
+
+    :param json_data: Intermediate (or merged) json data with the
+                      'source_files'
+    :param location: Folder of the source within the workspace
+    :return: Sorted list of file paths relative to the source folder, or
+            None (i.e. full checkout) if none of the source files is in the
+            source folder
+    """
+    prefix = location.strip('/') + '/'
+    paths = set()
+    for source_file in json_data.get('source_files', {}):
+        if source_file.startswith(prefix):
+            paths.add(source_file[len(prefix):])
+        elif os.path.isabs(source_file) and '/' + prefix in source_file:
+            paths.add(source_file.partition('/' + prefix)[2])
+    if not paths:
+        print("WARNING!: No source files found within '{}', checking out "
+              "all its files".format(location))
+        return None
+    return sorted(paths)
+
+
+def set_sparse_checkout(folder, paths):
+    """
+    Limit the checkout of a git repository to a list of files
+
+    :param folder: Folder of the repository (or worktree)
+    :param paths: List of file paths relative to the repository
+    """
+    patterns = ["/" + re.sub(r'([*?\[\\])', r'\\\1', path)
+                for path in paths]
+    call_git(["sparse-checkout", "set", "--no-cone", "--stdin"], folder,
+             input="".join(pattern + "\n" for pattern in patterns))
+
+
+class MirrorCache(object):
+    """Bare repositories, one per url, shared by all the clones of that url,
+    also across processes. Only the commits needed are fetched, shallowly
+    when the server allows it, and every clone is a worktree of the mirror.
+    """
+    def __init__(self, mirror_dir):
+        self.mirror_dir = os.path.abspath(mirror_dir)
+        os.makedirs(self.mirror_dir, exist_ok=True)
+        self.locks = {}
+        self.lock = threading.Lock()
+
+    def mirror_path(self, url):
+        return os.path.join(self.mirror_dir, hashlib.sha256(
+            url.encode()).hexdigest()[:20] + ".git")
+
+    @contextlib.contextmanager
+    def locked(self, url):
+        """
+        Lock the mirror of a url against other threads and processes
+        """
+        with self.lock:
+            lock = self.locks.setdefault(url, threading.Lock())
+        with lock, open(self.mirror_path(url) + ".lock", "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def fetch(self, mirror, url, commit, refspec):
+        """
+        Fetch a commit (or the refspec if no commit) into a mirror
+
+        :return: Commit id to be checked out
+        """
+        if commit:
+            try:
+                call_git(["cat-file", "-e", commit + "^{commit}"], mirror)
+                return commit  # Already fetched
+            except subprocess.CalledProcessError:
+                pass
+            try:
+                call_git(["fetch", "-q", "--depth", "1", url, commit], mirror)
+                return commit
+            except subprocess.CalledProcessError:
+                pass  # The server does not allow fetching commits by id
+            args = ["fetch", "-q"]
+            if call_git(["rev-parse", "--is-shallow-repository"],
+                        mirror) == "true":
+                args.append("--unshallow")
+            call_git(args + [url] + ([refspec] if refspec else
+                                     ["+refs/heads/*:refs/heads/*"]), mirror)
+            return commit
+        call_git(["fetch", "-q", "--depth", "1", url, refspec or "HEAD"],
+                 mirror)
+        return call_git(["rev-parse", "FETCH_HEAD"], mirror)
+
+    def worktree(self, url, commit, refspec, output_loc, paths=None):
+        """
+        Check out a commit of a url as a worktree of its mirror
+
+        :param url: Url of the git repository
+        :param commit: Commit id, empty to check out the refspec
+        :param refspec: Refspec to be fetched if there is no commit
+        :param output_loc: Folder of the worktree
+        :param paths: Optional list of the only files to be checked out
+        """
+        with self.locked(url):
+            mirror = self.mirror_path(url)
+            if not os.path.isdir(mirror):
+                call_git(["init", "-q", "--bare", mirror])
+            revision = self.fetch(mirror, url, commit, refspec)
+            # Forget the worktrees whose folder was removed
+            call_git(["worktree", "prune"], mirror)
+            call_git(["worktree", "add", "-q", "--detach", "--force"] +
+                     (["--no-checkout"] if paths is not None else []) +
+                     [os.path.abspath(output_loc), revision], mirror)
+        if paths is not None:
+            set_sparse_checkout(output_loc, paths)
+            call_git(["read-tree", "-mu", "HEAD"], output_loc)
+
+
 class CloneSources(object):
     """Class used to clone the source code needed to produce code coverage
     reports.
@@ -95,13 +247,21 @@ class CloneSources(object):
         with open(self.json_file, "r") as json_file:
             self.json_data = json.load(json_file)
 
-    def clone_repo(self, output_dir, overwrite_handler=None):
+    def clone_repo(self, output_dir, overwrite_handler=None, jobs=1,
+                   mirror_dir=None, sparse=False, cache_dir=None):
         """
         Clones or reproduces a folder with source code based in the
         configuration in the json file
 
         :param output_dir: Where to put the source files
         :param overwrite_handler: Optional function to handle overwrites
+        :param jobs: Number of sources cloned at the same time
+        :param mirror_dir: Optional folder for the mirrors of the git
+                           sources, see MirrorCache
+        :param sparse: If True only the files of the git sources listed in
+                       the 'source_files' of the json file are checked out
+        :param cache_dir: Optional folder for the artifact cache of the http
+                          sources, see artifact_fetcher.ArtifactCache
         """
         if self.json_data is None:
             self.load_json()
@@ -116,36 +276,92 @@ class CloneSources(object):
         except Exception as ex:
             raise Exception(ex)
 
-        for source in sources:
-            if skip_source(output_dir, source, overwrite_handler):
-                continue
-            if source['type'] == "git":
-                git = source
-                url = git["URL"]
-                commit_id = git["COMMIT"]
-                output_loc = os.path.join(output_dir, git["LOCATION"])
-                cmd = "git clone {} {}".format(url, output_loc)
-                output = call_cmd(cmd)
-                if git['REFSPEC']:
-                    call_cmd("cd {};git fetch -q origin {}".format(
-                        output_loc, git['REFSPEC']))
-                if commit_id:
-                    call_cmd("cd {};git checkout -q {}".format(
-                        output_loc, commit_id))
+        mirrors = MirrorCache(mirror_dir) if mirror_dir else None
+        cache = artifact_fetcher.ArtifactCache(cache_dir) if cache_dir \
+            else None
+        sources = [source for source in sources
+                   if not skip_source(output_dir, source, overwrite_handler)]
+        with concurrent.futures.ThreadPoolExecutor(max(1, jobs)) as executor:
+            # Raise the first error, if any
+            list(executor.map(
+                lambda source: self.clone_source(source, output_dir,
+                                                 mirrors, sparse, cache),
+                sources))
+
+    def clone_source(self, source, output_dir, mirrors=None, sparse=False,
+                     cache=None):
+        """
+        Clones or reproduces the folder of a source
+
+        :param source: Dictionary with the information the source
+        :param output_dir: Where to put the source files
+        :param mirrors: Optional MirrorCache for git sources
+        :param sparse: If True only check out the files in the json file
+        :param cache: Optional ArtifactCache for http sources
+        """
+        if source['type'] == "git":
+            git = source
+            url = git["URL"]
+            commit_id = git["COMMIT"]
+            output_loc = os.path.join(output_dir, git["LOCATION"])
+            paths = sparse_paths(self.json_data, git["LOCATION"]) \
+                if sparse else None
+            if mirrors is not None:
+                mirrors.worktree(url, commit_id, git['REFSPEC'], output_loc,
+                                 paths)
+                return
+            cmd = "git clone {}{} {}".format(
+                "--no-checkout " if paths is not None else "", url,
+                output_loc)
+            output = call_cmd(cmd)
+            if paths is not None:
+                set_sparse_checkout(output_loc, paths)
+            if git['REFSPEC']:
+                call_cmd("cd {};git fetch -q origin {}".format(
+                    output_loc, git['REFSPEC']))
+            if commit_id:
+                call_cmd("cd {};git checkout -q {}".format(
+                    output_loc, commit_id))
+            else:
+                call_cmd("cd {};git checkout -q FETCH_HEAD".format(
+                    output_loc))
+        elif source['type'] == 'http':
+            site = source
+            output_loc = os.path.join(output_dir, site["LOCATION"])
+            os.makedirs(output_loc, exist_ok=True)
+            # Any compression supported by tarfile, i.e. gz, xz or bz2
+            archive = bool(site.get('COMPRESSION'))
+            if cache is not None:
+                digest = cache.fetch_url(site['URL'], site.get('CHECKSUM'))
+                # Copied rather than linked, so editing the sources in the
+                # workspace does not modify the cache
+                if archive:
+                    shutil.copytree(cache.extract(digest), output_loc,
+                                    copy_function=shutil.copyfile,
+                                    dirs_exist_ok=True)
                 else:
-                    call_cmd("cd {};git checkout -q FETCH_HEAD".format(
-                        output_loc))
-            elif source['type'] == 'http':
-                site = source
-                output_loc = os.path.join(output_dir, site["LOCATION"])
-                tmp_folder = os.path.join(output_dir,
-                                          "_tmp_{}_{}".format(time.time(),
-                                                              random()))
-                call_cmd("mkdir -p {}".format(tmp_folder))
-                call_cmd("wget -q {} -P {}".format(
-                    site['URL'], tmp_folder))
-                call_cmd("mkdir -p {}".format(output_loc))
-                if site['COMPRESSION'] == "xz":
-                    call_cmd("cd {};tar -xzf $(basename {}) -C {}".format(
-                        tmp_folder, site['URL'], output_loc))
-                call_cmd("rm -rf {}".format(tmp_folder))
+                    shutil.copyfile(cache.blob_path(digest), os.path.join(
+                        output_loc, os.path.basename(site['URL'])))
+                return
+            # Hashed while extracted or copied, and only moved into the
+            # workspace if it has the checksum
+            temp_folder = tempfile.mkdtemp(dir=os.path.dirname(output_loc),
+                                           suffix='.tmp')
+            try:
+                with urllib.request.urlopen(site['URL']) as response:
+                    reader = artifact_fetcher.HashingReader(response)
+                    if archive:
+                        with tarfile.open(fileobj=reader,
+                                          mode='r|*') as tar_file:
+                            artifact_fetcher.extract_all(tar_file,
+                                                         temp_folder)
+                    else:
+                        with open(os.path.join(temp_folder, os.path.basename(
+                                site['URL'])), 'wb') as f:
+                            shutil.copyfileobj(reader, f)
+                    digest = reader.hexdigest()
+                artifact_fetcher.check_checksum(site['URL'],
+                                                site.get('CHECKSUM'), digest)
+                shutil.copytree(temp_folder, output_loc, dirs_exist_ok=True)
+            finally:
+                shutil.rmtree(temp_folder, ignore_errors=True)
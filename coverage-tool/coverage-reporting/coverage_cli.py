@@ -0,0 +1,99 @@
+# !/usr/bin/env python
+###############################################################################
+# Copyright (c) 2020, ARM Limited and Contributors. All rights reserved.
+#
+# SPDX-License-Identifier: BSD-3-Clause
+###############################################################################
+
+###############################################################################
+# FILE: coverage_cli.py
+#
+# DESCRIPTION: Produces the LCOV info file from the trace files in a single
+#              process: trace files -> intermediate layer -> info file. The
+#              intermediate layer is passed in memory. The intermediate json
+#              file is written to the 'output_file' of the configuration (or
+#              to --json-path) unless --no-json is given. Named
+#              coverage_cli.py so it does not hide the 'coverage' package;
+#              the 'coverage' script is its shell entry point.
+#
+###############################################################################
+
+import json
+import time
+import logging
+import argparse
+from argparse import RawTextHelpFormatter
+
+import intermediate_layer
+import generate_info_file
+
+
+def coverage(config, local_workspace, info_file, error_log,
+             json_path=None, branch_engine='source', jobs=1,
+             branch_cache=None):
+    """
+    Runs the coverage pipeline
+
+    :param config: Json configuration data, see intermediate_layer.py
+    :param local_workspace: Local workspace folder where source code files
+                            reside
+    :param info_file: Handler to for file writing coverage
+    :param error_log: Handler to the file for writing errors
+    :param json_path: Optional intermediate json file to be written
+    :param branch_engine: 'source' or 'asm', see
+                          generate_info_file.generate_info
+    :param jobs: Number of processes building the info file records
+    :param branch_cache: Optional folder to cache the branch sites of the
+                         source files
+    :return: Intermediate layer data
+    """
+    intermediate_layer.setup_tools(config, local_workspace)
+    if json_path:
+        config['parameters']['output_file'] = json_path
+    pp = intermediate_layer.PostProcessCC(config, local_workspace)
+    json_data = pp.process(write_json=bool(json_path))
+    generate_info_file.generate_info(json_data, local_workspace, info_file,
+                                     error_log, branch_engine, jobs,
+                                     branch_cache)
+    return json_data
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Produce the LCOV info file from the trace files",
+        epilog=intermediate_layer.json_conf_help,
+        formatter_class=RawTextHelpFormatter)
+    parser.add_argument('--config-json', metavar='PATH',
+                        dest="config_json", required=True,
+                        help='JSON configuration file')
+    parser.add_argument('--local-workspace', metavar='PATH', required=True,
+                        help='Local workspace folder where source code files'
+                             ' and folders resides')
+    parser.add_argument('--json-path', metavar='PATH',
+                        help='Intermediate json file to be written. Defaults '
+                             'to the output_file of the configuration')
+    parser.add_argument('--no-json', action='store_true',
+                        help='Do not write the intermediate json file')
+    generate_info_file.add_arguments(parser)
+    args = parser.parse_args()
+    with open(args.config_json, 'r') as f:
+        config = json.load(f)
+    json_path = None
+    if not args.no_json:
+        json_path = args.json_path or \
+            config['parameters'].get('output_file')
+    with open(args.info, "w+") as info_file, \
+            open(args.error_log, "w+") as error_log:
+        coverage(config, args.local_workspace, info_file, error_log,
+                 json_path, args.branch_engine, args.jobs,
+                 args.branch_cache)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(filename='intermediate_layer.log', level=logging.DEBUG,
+                        format=('%(asctime)s %(levelname)s %(name)s '
+                                '%(message)s'))
+    start_time = time.time()
+    main()
+    elapsed_time = time.time() - start_time
+    print("Elapsed time: {}s".format(elapsed_time))
@@ -0,0 +1,290 @@
+# !/usr/bin/env python
+###############################################################################
+# Copyright (c) 2020, ARM Limited and Contributors. All rights reserved.
+#
+# SPDX-License-Identifier: BSD-3-Clause
+###############################################################################
+
+###############################################################################
+# FILE: coverage_store.py
+#
+# DESCRIPTION: Persistent SQLite store that accumulates the coverage of info
+#              files and intermediate json files. Adding an input only costs
+#              its own size, inputs already added are recognized by their
+#              content hash, and the accumulated coverage can be exported as
+#              an info file at any time.
+#
+###############################################################################
+
+import os
+import sys
+import json
+import time
+import hashlib
+import sqlite3
+import argparse
+
+import merge
+import lcov_info
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS inputs (
+    digest TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    added REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS functions (
+    source_file TEXT NOT NULL,
+    name TEXT NOT NULL,
+    line INTEGER NOT NULL,
+    hits INTEGER NOT NULL,
+    PRIMARY KEY (source_file, name)
+);
+CREATE TABLE IF NOT EXISTS lines (
+    source_file TEXT NOT NULL,
+    line INTEGER NOT NULL,
+    hits INTEGER NOT NULL,
+    PRIMARY KEY (source_file, line)
+);
+CREATE TABLE IF NOT EXISTS branches (
+    source_file TEXT NOT NULL,
+    line INTEGER NOT NULL,
+    block INTEGER NOT NULL,
+    branch INTEGER NOT NULL,
+    taken INTEGER,
+    PRIMARY KEY (source_file, line, block, branch)
+);
+"""
+
+
+def file_digest(file_name):
+    """
+    Hash of the content of a file
+
+    :param file_name: File name
+    :return: Hexadecimal sha256 digest
+    """
+    digest = hashlib.sha256()
+    with open(file_name, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def source_locations(json_name):
+    """
+    Source locations (folders within the workspace) of an intermediate json
+    file, as used by merge.py to translate to the local workspace
+
+    :param json_name: Intermediate json file name
+    :return: List of locations
+    """
+    with open(json_name) as json_file:
+        json_data = json.load(json_file)
+    return [source["LOCATION"]
+            for source in json_data["configuration"]["sources"]]
+
+
+class CoverageStore(object):
+    """Accumulated coverage of the inputs added to a SQLite database. The
+    branches taken are NULL while the branch was never evaluated, as '-' in
+    the info files.
+    """
+
+    def __init__(self, path):
+        self.connection = sqlite3.connect(path)
+        self.connection.executescript(SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def has_input(self, digest):
+        return self.connection.execute(
+            "SELECT 1 FROM inputs WHERE digest = ?", (digest,)).fetchone() \
+            is not None
+
+    def inputs(self):
+        """
+        :return: List of tuples of (digest, name, time added) of the inputs
+                already added, in the order they were added
+        """
+        return self.connection.execute(
+            "SELECT digest, name, added FROM inputs ORDER BY added").fetchall()
+
+    def add_records(self, records):
+        """
+        Add up the counts of source file records, see lcov_info.new_record
+
+        :param records: Iterable of tuples of (source file name, record)
+        """
+        execute = self.connection.executemany
+        for source_file, record in records:
+            execute("INSERT INTO functions VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT (source_file, name) DO UPDATE SET "
+                    "hits = hits + excluded.hits",
+                    [(source_file, name, number,
+                      record['function_hits'].get(name, 0))
+                     for name, number in record['functions'].items()])
+            execute("INSERT INTO lines VALUES (?, ?, ?) "
+                    "ON CONFLICT (source_file, line) DO UPDATE SET "
+                    "hits = hits + excluded.hits",
+                    [(source_file, number, count)
+                     for number, count in record['lines'].items()])
+            execute("INSERT INTO branches VALUES (?, ?, ?, ?, ?) "
+                    "ON CONFLICT (source_file, line, block, branch) "
+                    "DO UPDATE SET taken = CASE WHEN excluded.taken IS NULL "
+                    "THEN taken ELSE IFNULL(taken, 0) + excluded.taken END",
+                    [(source_file,) + key + (taken,)
+                     for key, taken in record['branches'].items()])
+
+    def add_file(self, file_name, workspace="", branch_engine='source',
+                 local_workspace=None, locations=None):
+        """
+        Add an info file or an intermediate json file (by extension), unless
+        a file with the same content was already added
+
+        :param file_name: Info or intermediate json file name
+        :param workspace: Folder with source files structure, for the
+                          intermediate json file
+        :param branch_engine: Branch engine for the intermediate json file,
+                              see generate_info_file.py
+        :param local_workspace: Optional local workspace the source files
+                                are translated to, as in merge.py
+        :param locations: Source locations used for the translation of an
+                          info file, see source_locations. An intermediate
+                          json file has its own.
+        :return: True if added, False if it was already in the store
+        """
+        digest = file_digest(file_name)
+        if self.has_input(digest):
+            return False
+        if file_name.endswith('.json'):
+            records = lcov_info.load_records(
+                json_path=file_name, workspace=workspace,
+                branch_engine=branch_engine)
+            locations = source_locations(file_name)
+        else:
+            records = lcov_info.load_records(info=file_name)
+        if local_workspace is not None:
+            translated = {}
+            for source_file, record in records.items():
+                source_file = merge.translate_source_file(
+                    source_file, locations or [], local_workspace)
+                if source_file in translated:
+                    lcov_info.merge_record(translated[source_file], record)
+                else:
+                    translated[source_file] = record
+            records = translated
+        # The input is recorded in the same transaction as its counts
+        with self.connection:
+            self.add_records(records.items())
+            self.connection.execute(
+                "INSERT INTO inputs VALUES (?, ?, ?)",
+                (digest, os.path.abspath(file_name), time.time()))
+        return True
+
+    def records(self):
+        """
+        Get the accumulated coverage
+
+        :return: Generator of tuples of (source file name, record) sorted by
+                source file name
+        """
+        source_files = [row[0] for row in self.connection.execute(
+            "SELECT source_file FROM functions UNION "
+            "SELECT source_file FROM lines UNION "
+            "SELECT source_file FROM branches ORDER BY 1")]
+        for source_file in source_files:
+            record = lcov_info.new_record()
+            for name, number, hits in self.connection.execute(
+                    "SELECT name, line, hits FROM functions "
+                    "WHERE source_file = ?", (source_file,)):
+                record['functions'][name] = number
+                record['function_hits'][name] = hits
+            for number, hits in self.connection.execute(
+                    "SELECT line, hits FROM lines WHERE source_file = ?",
+                    (source_file,)):
+                record['lines'][number] = hits
+            for number, block, branch, taken in self.connection.execute(
+                    "SELECT line, block, branch, taken FROM branches "
+                    "WHERE source_file = ?", (source_file,)):
+                record['branches'][(number, block, branch)] = taken
+            yield source_file, record
+
+    def export_info(self, info_name):
+        """
+        Write the accumulated coverage as an info file
+
+        :param info_name: Output info file name
+        """
+        with open(info_name, 'w') as info_file:
+            for source_file, record in self.records():
+                lcov_info.write_record(info_file, source_file, record)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Accumulate the coverage of info files and intermediate "
+                    "json files in a persistent store and export it as an "
+                    "info file")
+    parser.add_argument('--store', metavar='PATH', required=True,
+                        help='SQLite database file, created if needed')
+    parser.add_argument('--add', metavar='PATH', action='append', default=[],
+                        help='Info (.info) or intermediate json (.json) file '
+                             'to be added, skipped if already added')
+    parser.add_argument('--workspace', metavar='PATH', default="",
+                        help='Folder with source files structure, needed '
+                             'to add intermediate json files')
+    parser.add_argument('--branch-engine', choices=['source', 'asm'],
+                        default='source',
+                        help='Branch engine used for intermediate json '
+                             'files, see generate_info_file.py. Defaults to '
+                             'source')
+    parser.add_argument('--local-workspace', metavar='PATH',
+                        help='Local workspace the source files are '
+                             'translated to before they are stored, as in '
+                             'merge.py')
+    parser.add_argument('--locations-json', metavar='PATH',
+                        help='Intermediate json file with the source '
+                             'locations used to translate the info files '
+                             'added. Intermediate json files use their own')
+    parser.add_argument('--export', metavar='PATH',
+                        help='Write the accumulated coverage to this info '
+                             'file')
+    parser.add_argument('--list', action='store_true',
+                        help='List the inputs already added')
+    args = parser.parse_args()
+    locations = None
+    if args.locations_json:
+        locations = source_locations(args.locations_json)
+    elif args.local_workspace and \
+            any(not name.endswith('.json') for name in args.add):
+        parser.error("--locations-json is needed to translate info files "
+                     "to the local workspace")
+    with CoverageStore(args.store) as store:
+        for file_name in args.add:
+            if not os.path.isfile(file_name):
+                print('Error: file "' + file_name + '" not found.\n')
+                sys.exit(1)
+            if store.add_file(file_name, args.workspace, args.branch_engine,
+                              args.local_workspace, locations):
+                print("Added '{}'".format(file_name))
+            else:
+                print("Skipped '{}', already added".format(file_name))
+        if args.list:
+            for digest, name, added in store.inputs():
+                print("{} {} {}".format(
+                    digest[:12], time.strftime('%Y-%m-%d %H:%M:%S',
+                                               time.localtime(added)), name))
+        if args.export:
+            store.export_info(args.export)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,208 @@
+# !/usr/bin/env python
+###############################################################################
+# Copyright (c) 2020, ARM Limited and Contributors. All rights reserved.
+#
+# SPDX-License-Identifier: BSD-3-Clause
+###############################################################################
+
+###############################################################################
+# FILE: coverage_summary.py
+#
+# DESCRIPTION: Computes the line, function and branch coverage totals per
+#              file, per directory or in total from an info file or an
+#              intermediate json file and checks them against thresholds.
+#              Both files are read one source file at a time.
+#
+###############################################################################
+
+import io
+import os
+import sys
+import json
+import argparse
+
+import lcov_info
+import json_stream
+import asm_branches
+import generate_info_file
+
+KINDS = ('lines', 'functions', 'branches')
+
+
+def info_totals(info_name):
+    """
+    Coverage totals of every source file in an info file, read one record
+    at a time. Every source file is expected once in the info file, as
+    written by generate_info_file.py or merge.py.
+
+    :param info_name: Info file name
+    :return: Generator of tuples of (source file name, totals), see
+            lcov_info.record_totals
+    """
+    with open(info_name) as info_file:
+        for source_file, record in lcov_info.read_records(info_file):
+            yield source_file, lcov_info.record_totals(record)
+
+
+def json_totals(json_name, workspace="", branch_engine='source',
+                branch_cache=None):
+    """
+    Coverage totals of every source file in an intermediate json file, read
+    one source file at a time. The totals are the ones of the info file
+    that generate_info_file.py produces with the same options, so the same
+    run has the same totals whichever file is summarized.
+
+    :param json_name: Intermediate json file name
+    :param workspace: Folder with source files structure, needed by the
+                      'source' branch engine
+    :param branch_engine: 'source' or 'asm', see generate_info_file.py. The
+                          'asm' engine reads the json file twice, the first
+                          time to get the execution count of every address.
+    :param branch_cache: Optional folder to cache the branch sites of the
+                         source files, see generate_info_file.py
+    :return: Generator of tuples of (source file name, totals)
+    """
+    counts = None
+    if branch_engine == 'asm':
+        counts = {}
+        with open(json_name) as json_file:
+            for source_file, source_data in json_stream.iter_member_items(
+                    json_file, 'source_files'):
+                for elf_index, elf_counts in asm_branches.address_counts(
+                        {source_file: source_data}).items():
+                    counts.setdefault(elf_index, {}).update(elf_counts)
+    with open(json_name) as json_file:
+        for source_file, source_data in json_stream.iter_member_items(
+                json_file, 'source_files'):
+            info_file = io.StringIO()
+            # Skipped as in the info file if the source file is not found
+            if not generate_info_file.source_file_coverage(
+                    source_file, source_data, workspace, info_file,
+                    io.StringIO(), branch_engine, counts, branch_cache):
+                continue
+            info_file.seek(0)
+            for _, record in lcov_info.read_records(info_file):
+                yield source_file, lcov_info.record_totals(record)
+
+
+def summarize(file_totals, group_by='total'):
+    """
+    Add up the totals of the source files
+
+    :param file_totals: Iterable of tuples of (source file name, totals)
+    :param group_by: 'file', 'directory' or 'total'
+    :return: Tuple of (dictionary of group name => totals, overall totals)
+    """
+    groups = {}
+    overall = dict.fromkeys(
+        [kind + suffix for kind in KINDS for suffix in ('', '_hit')], 0)
+    for source_file, totals in file_totals:
+        if group_by == 'file':
+            group = source_file
+        elif group_by == 'directory':
+            group = os.path.dirname(source_file)
+        else:
+            group = None
+        if group is not None:
+            group_totals = groups.setdefault(group, dict.fromkeys(overall, 0))
+            for key, value in totals.items():
+                group_totals[key] += value
+        for key, value in totals.items():
+            overall[key] += value
+    return groups, overall
+
+
+def rate(totals, kind):
+    """
+    Coverage percentage of a kind ('lines', 'functions' or 'branches'),
+    100 if there is nothing to cover
+    """
+    if totals[kind] == 0:
+        return 100.0
+    return 100.0 * totals[kind + '_hit'] / totals[kind]
+
+
+def check_thresholds(totals, thresholds):
+    """
+    Check the totals against the thresholds
+
+    :param totals: Totals to be checked
+    :param thresholds: Dictionary of kind => minimum percentage or None
+    :return: List of failure messages
+    """
+    failures = []
+    for kind in KINDS:
+        if thresholds.get(kind) is not None and \
+                rate(totals, kind) < thresholds[kind]:
+            failures.append("{} coverage {:.1f}% is below {:.1f}%".format(
+                kind, rate(totals, kind), thresholds[kind]))
+    return failures
+
+
+def format_totals(name, totals):
+    return "{}: {}".format(name, ", ".join(
+        "{} {:.1f}% ({}/{})".format(kind, rate(totals, kind),
+                                   totals[kind + '_hit'], totals[kind])
+        for kind in KINDS))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Summarize the coverage of an info file or an "
+                    "intermediate json file and check it against thresholds")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--info', metavar='PATH', help='Info file name')
+    source.add_argument('--json', metavar='PATH',
+                        help='Intermediate json file name')
+    parser.add_argument('--group-by', choices=['total', 'directory', 'file'],
+                        default='total',
+                        help='Report totals per file, per directory or just '
+                             'the overall totals. Defaults to total')
+    parser.add_argument('--format', choices=['text', 'json'], default='text',
+                        help='Output format. Defaults to text')
+    parser.add_argument('--workspace', metavar='PATH', default="",
+                        help='Folder with source files structure, needed '
+                             'with --json and the source branch engine')
+    parser.add_argument('--branch-engine', choices=['source', 'asm'],
+                        default='source',
+                        help='Branch coverage engine used with --json, as '
+                             'in generate_info_file.py. Defaults to source')
+    parser.add_argument('--branch-cache', metavar='PATH',
+                        help='Folder to cache the branch sites of the source '
+                             'files, used with --json and the source branch '
+                             'engine')
+    parser.add_argument('--line-threshold', dest='lines', metavar='PERCENT',
+                        type=float,
+                        help='Exit with error if the overall line coverage '
+                             'is below this percentage')
+    parser.add_argument('--function-threshold', dest='functions',
+                        metavar='PERCENT', type=float,
+                        help='Exit with error if the overall function '
+                             'coverage is below this percentage')
+    parser.add_argument('--branch-threshold', dest='branches',
+                        metavar='PERCENT', type=float,
+                        help='Exit with error if the overall branch coverage '
+                             'is below this percentage')
+    args = parser.parse_args()
+    if args.json and args.branch_engine == 'source' and not args.workspace:
+        parser.error("--workspace is needed by the source branch engine")
+    file_totals = info_totals(args.info) if args.info else \
+        json_totals(args.json, args.workspace, args.branch_engine,
+                    args.branch_cache)
+    groups, overall = summarize(file_totals, args.group_by)
+    failures = check_thresholds(overall, vars(args))
+    if args.format == 'json':
+        print(json.dumps({'groups': groups, 'total': overall,
+                          'failures': failures}, indent=4, sort_keys=True))
+    else:
+        for group in sorted(groups):
+            print(format_totals(group, groups[group]))
+        print(format_totals("Total", overall))
+        for failure in failures:
+            print("Error: " + failure)
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
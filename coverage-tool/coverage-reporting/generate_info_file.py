@@ -5,11 +5,51 @@
 # SPDX-License-Identifier: BSD-3-Clause
 ##############################################################################
 
+import io
 import os
 import sys
 import json
-import re
+import bisect
 import argparse
+import multiprocessing
+
+import asm_branches
+import c_branches
+
+
+def function_execution_count(func_data):
+    """
+    Returns the number of times a function was entered. Intermediate json
+    files produced before the counts were recorded only tell if the
+    function was covered, so 1 or 0 is returned for them.
+
+    :param func_data: Dictionary with the function data in the intermediate
+                      json file
+    """
+    count = func_data.get("count", 0)
+    if func_data["covered"]:
+        # Functions covered from an address other than the entry point
+        # (e.g. inlined) still count as entered once
+        return max(count, 1)
+    return count
+
+
+def line_execution_count(line_data):
+    """
+    Returns the number of times a source code line was executed, i.e. the
+    highest execution count amongst its assembly instructions, added up
+    across the elf files that contain the line.
+
+    :param line_data: Dictionary with the line data in the intermediate json
+                      file
+    """
+    count = 0
+    for addresses in line_data['elf_index'].values():
+        count += max([times_executed for _, times_executed in
+                      addresses.values()] or [0])
+    if line_data['covered']:
+        return max(count, 1)
+    return count
 
 
 def function_coverage(function_tuples, info_file):
@@ -25,7 +65,7 @@ def function_coverage(function_tuples, info_file):
     covered_func = 0
     function_names = []
     function_cov = []
-    for func_name, func_data in function_tuples:
+    for func_name, func_data in sorted(function_tuples):
         function_names.append(
             'FN:{},{}\n'.format(
                 func_data["line_number"],
@@ -33,9 +73,8 @@ def function_coverage(function_tuples, info_file):
         total_func += 1
         if func_data["covered"]:
             covered_func += 1
-            function_cov.append('FNDA:1,{}\n'.format(func_name))
-        else:
-            function_cov.append('FNDA:0,{}\n'.format(func_name))
+        function_cov.append('FNDA:{},{}\n'.format(
+            function_execution_count(func_data), func_name))
     info_file.write("\n".join(function_names))
     info_file.write("\n".join(function_cov))
     info_file.write('FNF:{}\n'.format(total_func))
@@ -53,18 +92,17 @@ def line_coverage(lines_dict, info_file):
     """
     total_lines = 0
     covered_lines = 0
-    for line in lines_dict:
+    for line in sorted(lines_dict, key=int):
         total_lines += 1
         if lines_dict[line]['covered']:
             covered_lines += 1
-            info_file.write('DA:' + line + ',1\n')
-        else:
-            info_file.write('DA:' + line + ',0\n')
+        info_file.write('DA:' + line + ',' +
+                        str(line_execution_count(lines_dict[line])) + '\n')
     info_file.write('LF:' + str(total_lines) + '\n')
     info_file.write('LH:' + str(covered_lines) + '\n')
 
 
-def sanity_check(branch_line, lines_dict, abs_path_file):
+def sanity_check(branch_line, lines_dict, abs_path_file, error_log):
     """
     Check if the 'branch_line' line of the C source corresponds to actual
     branching instructions in the assembly code. Also, check if that
@@ -77,23 +115,19 @@ def sanity_check(branch_line, lines_dict, abs_path_file):
     :param lines_dict: Dictionary of lines with line number as key
                         and its data as value
     :param abs_path_file: File name of the source file
+    :param error_log: Handler to the file for writing errors
     """
-    if str(branch_line) not in lines_dict:
+    line_data = lines_dict.get(str(branch_line))
+    if line_data is None:
         return False
-    found_branching = False
-    for i in lines_dict[str(branch_line)]['elf_index']:
-        for j in lines_dict[str(branch_line)]['elf_index'][i]:
-            string = lines_dict[str(branch_line)]['elf_index'][i][j][0]
-            # these cover all the possible branching instructions
-            if ('\tb' in string or
-                '\tcbnz' in string or
-                '\tcbz' in string or
-                '\ttbnz' in string or
-                    '\ttbz' in string):
-                # '\tbl' in string or  # already covered by '\tb'
-                # '\tblr' in string or  # already covered by '\tb'
-                # '\tbr' in string or  # already covered by '\tb'
-                found_branching = True
+    if 'branch_instructions' in line_data:
+        # Computed by the intermediate layer at disassembly time
+        found_branching = line_data['branch_instructions'] > 0
+    else:
+        found_branching = any(
+            asm_branches.is_branch(opcode)
+            for addresses in line_data['elf_index'].values()
+            for opcode, _ in addresses.values())
     if not found_branching:
         error_log.write(
             '\nSomething possibly wrong:\n\tFile ' +
@@ -105,306 +139,258 @@ def sanity_check(branch_line, lines_dict, abs_path_file):
     return True
 
 
-def manage_if_branching(branch_line, lines_dict, info_file, abs_path_file):
+def covered_in_span(span, covered_lines):
     """
-    Takes care of branch coverage, branch_line is the source code
-    line in which the 'if' statement is located the function produces
-    branch coverage info based on C source code and json file content
+    Check if any line in a line span is covered
 
-    :param branch_line: Source code line with the 'if' instruction
-    :param lines_dict: Dictionary of lines with line number as key
-                        and its data as value
-    :param info_file: Handler to for file writing coverage
-    :param abs_path_file: File name of the source file
+    :param span: Line span as [first line, last line] or None
+    :param covered_lines: Sorted list of the covered line numbers
     """
-    total_branch_local = 0
-    covered_branch_local = 0
-
-    if not sanity_check(branch_line, lines_dict, abs_path_file):
-        return(total_branch_local, covered_branch_local)
-    total_branch_local += 2
-    current_line = branch_line  # used to read lines one by one
-    # check for multiline if-condition and update current_line accordingly
-    parenthesis_count = 0
-    while True:
-        end_of_condition = False
-        for char in lines[current_line]:
-            if char == ')':
-                parenthesis_count -= 1
-                if parenthesis_count == 0:
-                    end_of_condition = True
-            elif char == '(':
-                parenthesis_count += 1
-        if end_of_condition:
-            break
-        current_line += 1
-    # first branch
-    # simple case: 'if' statements with no braces
-    if '{' not in lines[current_line] and '{' not in lines[current_line + 1]:
-
-        if (str(current_line + 1) in lines_dict and
-                lines_dict[str(current_line + 1)]['covered']):
-            info_file.write('BRDA:' + str(branch_line) + ',0,' + '0,' + '1\n')
-            covered_branch_local += 1
-        else:
-            info_file.write('BRDA:' + str(branch_line) + ',0,' + '0,' + '0\n')
-        current_line += 1
+    if span is None:
+        return False
+    i = bisect.bisect_left(covered_lines, span[0])
+    return i < len(covered_lines) and covered_lines[i] <= span[1]
 
-    # more complex case: '{' after the 'if' statement
-    else:
-        if '{' in lines[current_line]:
-            current_line += 1
-        else:
-            current_line += 2
-
-        # we need to check whether at least one line in the block is covered
-        found_covered_line = False
-
-        # this is a simpler version of a stack used to check when a code block
-        # ends at the moment, it just checks for '{' and '}', doesn't take into
-        # account the presence of commented braces
-        brace_counter = 1
-        while True:
-            end_of_block = False
-            for char in lines[current_line]:
-                if char == '}':
-                    brace_counter -= 1
-                    if brace_counter == 0:
-                        end_of_block = True
-                elif char == '{':
-                    brace_counter += 1
-            if end_of_block:
-                break
-            if (str(current_line) in lines_dict and
-                    lines_dict[str(current_line)]['covered']):
-                found_covered_line = True
-
-            current_line += 1
-
-        if found_covered_line:
-            info_file.write('BRDA:' + str(branch_line) + ',0,' + '0,' + '1\n')
-            covered_branch_local += 1
-        else:
-            info_file.write('BRDA:' + str(branch_line) + ',0,' + '0,' + '0\n')
-
-    # second branch (if present). If not present, second branch is covered by
-    # default
-    current_line -= 1
-    candidate_else_line = current_line
-    while 'else' not in lines[current_line] and candidate_else_line + \
-            2 >= current_line:
-        current_line += 1
-        if current_line == len(lines):
-            break
-
-    # no 'else': branch covered by default
-    if current_line == candidate_else_line + 3:
-        info_file.write('BRDA:' + str(branch_line) + ',0,' + '1,' + '1\n')
-        covered_branch_local += 1
-        return(total_branch_local, covered_branch_local)
-
-    # 'else' found: check if opening braces are present
-    if '{' not in lines[current_line - 1] and '{' not in lines[current_line]:
-        if str(current_line + 1) in lines_dict:
-            if lines_dict[str(current_line + 1)]['covered']:
-                info_file.write(
-                    'BRDA:' +
-                    str(branch_line) +
-                    ',0,' +
-                    '1,' +
-                    '1\n')
-                covered_branch_local += 1
-            else:
-                info_file.write(
-                    'BRDA:' +
-                    str(branch_line) +
-                    ',0,' +
-                    '1,' +
-                    '0\n')
-        else:
-            info_file.write('BRDA:' + str(branch_line) + ',0,' + '1,' + '0\n')
 
-    else:
-        if '{' in lines[current_line]:
-            current_line += 1
-        else:
-            current_line += 2
-        found_covered_line = False
-        while '}' not in lines[current_line]:
-            if (str(current_line) in lines_dict and
-                    lines_dict[str(current_line)]['covered']):
-                found_covered_line = True
-                break
-            current_line += 1
-        if found_covered_line:
-            info_file.write('BRDA:' + str(branch_line) + ',0,' + '1,' + '1\n')
-            covered_branch_local += 1
-        else:
-            info_file.write('BRDA:' + str(branch_line) + ',0,' + '1,' + '0\n')
+def branch_taken(span, condition, covered_lines):
+    """
+    Check if a branch of an 'if' statement is covered
 
-    return(total_branch_local, covered_branch_local)
+    :param span: Line span of the branch as [first line, last line] or None
+    :param condition: Line span of the condition of the 'if'
+    :param covered_lines: Sorted list of the covered line numbers
+    :return: True or False, or None if it cannot be told from the line
+            coverage because the branch shares a line with the condition
+    """
+    if span is not None and span[0] <= condition[1]:
+        return None
+    return covered_in_span(span, covered_lines)
 
 
-def manage_switch_branching(switch_line, lines_dict, info_file, abs_path_file):
+def branch_coverage(abs_path_file, info_file, lines_dict, error_log,
+                    branch_cache=None):
     """
-    Takes care of branch coverage, branch_line is the source code
-    line in which the 'switch' statement is located the function produces
-    branch coverage info based on C source code and json file content
+    Produces branch coverage information from the 'if' and 'switch'
+    statements of the C source file, see 'c_branches'. The first branch of an
+    'if' is covered if any line of its body is covered and the second one if
+    any line of the 'else' body is covered (or by default if there is no
+    'else'). A branch whose body starts on a line of the condition, e.g.
+    'if (x) return;', is reported as '-' (unknown) as the line is executed
+    whether the branch is taken or not. Every 'case' of a 'switch' is
+    covered if any of its lines is covered.
 
-    :param switch_line: Source code line with the 'switch' instruction
-    :param lines_dict: Dictionary of lines with line number as key
-                        and its data as value
-    :param info_file: Handler to for file writing coverage
     :param abs_path_file: File name of the source file
+    :param info_file: Handler to for file writing coverage
+    :param lines_dict: Dictionary of lines with line number as key
+                       and its data as value
+    :param error_log: Handler to the file for writing errors
+    :param branch_cache: Optional folder to cache the branch sites of the
+                         source files by content hash
     """
-
-    total_branch_local = 0
-    covered_branch_local = 0
-
-    if not sanity_check(switch_line, lines_dict, abs_path_file):
-        return(total_branch_local, covered_branch_local)
-
-    current_line = switch_line  # used to read lines one by one
-    branch_counter = 0          # used to count the number of switch branches
-    brace_counter = 0
-
-    # parse the switch-case line by line, checking if every 'case' is covered
-    # the switch-case ends with a '}'
-    while True:
-        if '{' in lines[current_line]:
-            brace_counter += 1
-        if '}' in lines[current_line]:
-            brace_counter -= 1
-        if brace_counter == 0:
-            return(total_branch_local, covered_branch_local)
-        if 'case' in lines[current_line] or 'default' in lines[current_line]:
-            covered = False
-            total_branch_local += 1
-            inner_brace = 0
-            current_line += 1
-            while (('case' not in lines[current_line]
-                   and 'default' not in lines[current_line]) or
-                   inner_brace > 0):
-                if (str(current_line) in lines_dict and
-                        lines_dict[str(current_line)]['covered']):
-                    covered = True
-                if '{' in lines[current_line]:
-                    inner_brace += 1
-                    brace_counter += 1
-                if '}' in lines[current_line]:
-                    inner_brace -= 1
-                    brace_counter -= 1
-                if brace_counter == 0:
-                    break
-                current_line += 1
-            if covered:
-                info_file.write(
-                    'BRDA:' +
-                    str(switch_line) +
-                    ',0,' +
-                    str(branch_counter) +
-                    ',1\n')
-                covered_branch_local += 1
-            else:
-                info_file.write(
-                    'BRDA:' +
-                    str(switch_line) +
-                    ',0,' +
-                    str(branch_counter) +
-                    ',0\n')
-            if brace_counter == 0:
-                return(total_branch_local, covered_branch_local)
-            branch_counter += 1
+    total_branch = 0
+    covered_branch = 0
+    sites = c_branches.cached_branch_sites(abs_path_file, branch_cache)
+    covered_lines = sorted(int(line) for line in lines_dict
+                           if lines_dict[line]['covered'])
+    for site in sites:
+        if not sanity_check(site["line"], lines_dict, abs_path_file,
+                            error_log):
+            continue
+        if site["type"] == "if":
+            branches = [branch_taken(site["then"], site["condition"],
+                                     covered_lines),
+                        site["else"] is None or
+                        branch_taken(site["else"], site["condition"],
+                                     covered_lines)]
         else:
-            current_line += 1
+            branches = [covered_in_span(case, covered_lines)
+                        for case in site["cases"]]
+        for branch, covered in enumerate(branches):
+            info_file.write('BRDA:{},0,{},{}\n'.format(
+                site["line"], branch,
+                '-' if covered is None else 1 if covered else 0))
+            total_branch += 1
+            if covered:
+                covered_branch += 1
 
-    return(total_branch_local, covered_branch_local)
+    info_file.write('BRF:' + str(total_branch) + '\n')
+    info_file.write('BRH:' + str(covered_branch) + '\n')
 
 
-def branch_coverage(abs_path_file, info_file, lines_dict):
+def asm_branch_coverage(lines_dict, info_file, counts):
     """
-    Produces branch coverage information, using the functions
-    'manage_if_branching' and 'manage_switch_branching'
+    Produces branch coverage information from the conditional branch
+    instructions of the assembly code, see 'asm_branches'
 
-    :param abs_path_file: File name of the source file
-    :param info_file: Handler to for file writing coverage
     :param lines_dict: Dictionary of lines with line number as key
                        and its data as value
+    :param info_file: Handler to for file writing coverage
+    :param counts: Execution counts of every address of every elf file
     """
     total_branch = 0
     covered_branch = 0
-
-    # branch coverage: if statements
-    branching_lines = []
-
-    # regex: find all the lines starting with 'if' or 'else if'
-    # (possibly preceded by whitespaces/tabs)
-    pattern = re.compile(r"^\s+if|^\s+} else if|^\s+else if")
-    for i, line in enumerate(open(abs_path_file)):
-        for match in re.finditer(pattern, line):
-            branching_lines.append(i + 1)
-    while branching_lines:
-        t = manage_if_branching(branching_lines.pop(0), lines_dict,
-                                info_file, abs_path_file)
-        total_branch += t[0]
-        covered_branch += t[1]
-
-    # branch coverage: switch statements
-    switch_lines = []
-
-    # regex: find all the lines starting with 'switch'
-    # (possibly preceded by whitespaces/tabs)
-    pattern = re.compile(r"^\s+switch")
-    for i, line in enumerate(open(abs_path_file)):
-        for match in re.finditer(pattern, line):
-            switch_lines.append(i + 1)
-    while switch_lines:
-        t = manage_switch_branching(switch_lines.pop(0), lines_dict,
-                                    info_file, abs_path_file)
-        total_branch += t[0]
-        covered_branch += t[1]
-
+    for line, block, branch, taken in asm_branches.branch_records(
+            lines_dict, counts):
+        total_branch += 1
+        if taken:
+            covered_branch += 1
+        info_file.write('BRDA:{},{},{},{}\n'.format(
+            line, block, branch, '-' if taken is None else taken))
     info_file.write('BRF:' + str(total_branch) + '\n')
     info_file.write('BRH:' + str(covered_branch) + '\n')
 
 
-parser = argparse.ArgumentParser(
-    description="Script to convert intermediate json file to LCOV info file")
-parser.add_argument('--workspace', metavar='PATH',
-                    help='Folder with source files structure',
-                    required=True)
-parser.add_argument('--json', metavar='PATH',
-                    help='Intermediate json file name',
-                    required=True)
-parser.add_argument('--info', metavar='PATH',
-                    help='Output info file name',
-                    default="coverage.info")
-args = parser.parse_args()
-with open(args.json) as json_file:
-    json_data = json.load(json_file)
-info_file = open(args.info, "w+")
-error_log = open("error_log.txt", "w+")
-file_list = json_data['source_files'].keys()
-
-for relative_path in file_list:
-    abs_path_file = os.path.join(args.workspace, relative_path)
-    if not os.path.exists(abs_path_file):
-        continue
-    source = open(abs_path_file)
-    lines = source.readlines()
+def source_file_coverage(relative_path, source_data, workspace, info_file,
+                         error_log, branch_engine='source', counts=None,
+                         branch_cache=None):
+    """
+    Writes the info file record of a source file
+
+    :param relative_path: Source file name in the intermediate json
+    :param source_data: Dictionary with the functions and lines of the
+                        source file
+    :param workspace: Folder with source files structure
+    :param info_file: Handler to for file writing coverage
+    :param error_log: Handler to the file for writing errors
+    :param branch_engine: 'source' or 'asm', see 'generate_info'
+    :param counts: Execution counts of every address of every elf file,
+                   needed by the 'asm' branch engine
+    :param branch_cache: Optional folder to cache the branch sites of the
+                         source files, used by the 'source' branch engine
+    :return: False if the source file was skipped, True otherwise
+    """
+    abs_path_file = os.path.join(workspace, relative_path)
+    if branch_engine == 'source' and not os.path.exists(abs_path_file):
+        return False
     info_file.write('TN:\n')
     info_file.write('SF:' + os.path.abspath(abs_path_file) + '\n')
-    lines = [-1] + lines  # shifting the lines indexes to the right
-    function_coverage(
-        json_data['source_files'][relative_path]['functions'].items(),
-        info_file)
-    branch_coverage(abs_path_file, info_file,
-                    json_data['source_files'][relative_path]['lines'])
-    line_coverage(json_data['source_files'][relative_path]['lines'],
-                  info_file)
+    function_coverage(source_data['functions'].items(), info_file)
+    if branch_engine == 'asm':
+        asm_branch_coverage(source_data['lines'], info_file, counts)
+    else:
+        branch_coverage(abs_path_file, info_file, source_data['lines'],
+                        error_log, branch_cache)
+    line_coverage(source_data['lines'], info_file)
     info_file.write('end_of_record\n\n')
-    source.close()
+    return True
+
+
+# Execution counts for the 'asm' branch engine in the worker processes
+worker_counts = None
 
-json_file.close()
-info_file.close()
-error_log.close()
+
+def init_worker(counts):
+    """
+    Initializes a worker process of 'generate_info'
+
+    :param counts: Execution counts of every address of every elf file
+    """
+    global worker_counts
+    worker_counts = counts
+
+
+def source_file_block(task):
+    """
+    Builds the info file record of a source file in a worker process
+
+    :param task: Tuple of (source file name in the intermediate json, source
+                 file data, workspace, branch engine, branch cache folder)
+    :return: Tuple with the info file record and the error log text
+    """
+    relative_path, source_data, workspace, branch_engine, branch_cache = task
+    info_file = io.StringIO()
+    error_log = io.StringIO()
+    source_file_coverage(relative_path, source_data, workspace, info_file,
+                         error_log, branch_engine, worker_counts,
+                         branch_cache)
+    return info_file.getvalue(), error_log.getvalue()
+
+
+def generate_info(json_data, workspace, info_file, error_log,
+                  branch_engine='source', jobs=1, branch_cache=None):
+    """
+    Converts the intermediate json data into LCOV info file records
+
+    :param json_data: Intermediate json data, either loaded from a file or
+                      produced in memory by the intermediate layer
+    :param workspace: Folder with source files structure
+    :param info_file: Handler to for file writing coverage
+    :param error_log: Handler to the file for writing errors
+    :param branch_engine: Branch coverage from the C source code statements
+                          ('source') or from the conditional branch
+                          instructions in the assembly code ('asm')
+    :param jobs: Number of processes building the source file records. The
+                 records are written in the same order regardless of it.
+    :param branch_cache: Optional folder to cache the branch sites of the
+                         source files by content hash
+    """
+    source_files = json_data['source_files']
+    counts = None
+    if branch_engine == 'asm':
+        counts = asm_branches.address_counts(source_files)
+    if jobs <= 1:
+        for relative_path in sorted(source_files):
+            source_file_coverage(relative_path, source_files[relative_path],
+                                 workspace, info_file, error_log,
+                                 branch_engine, counts, branch_cache)
+        return
+    tasks = ((relative_path, source_files[relative_path], workspace,
+              branch_engine, branch_cache)
+             for relative_path in sorted(source_files))
+    with multiprocessing.Pool(jobs, initializer=init_worker,
+                              initargs=(counts,)) as pool:
+        for info_block, error_block in pool.imap(source_file_block, tasks,
+                                                 chunksize=8):
+            info_file.write(info_block)
+            error_log.write(error_block)
+
+
+def add_arguments(parser):
+    """
+    Adds the options shared by the scripts that produce info files
+
+    :param parser: Argument parser
+    """
+    parser.add_argument('--info', metavar='PATH',
+                        help='Output info file name',
+                        default="coverage.info")
+    parser.add_argument('--branch-engine', choices=['source', 'asm'],
+                        default='source',
+                        help='Branch coverage from the C source code '
+                             'statements (source) or from the conditional '
+                             'branch instructions in the assembly code '
+                             '(asm), the latter does not need the source '
+                             'files. Defaults to source')
+    parser.add_argument('--error-log', metavar='PATH',
+                        help='Error log file name',
+                        default="error_log.txt")
+    parser.add_argument('--jobs', metavar='N', type=int, default=1,
+                        help='Number of processes building the info file '
+                             'records of the source files. Defaults to 1')
+    parser.add_argument('--branch-cache', metavar='PATH',
+                        help='Optional folder to cache the branch sites of '
+                             'the source files by content hash across runs')
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Script to convert intermediate json file to LCOV info "
+                    "file")
+    parser.add_argument('--workspace', metavar='PATH',
+                        help='Folder with source files structure',
+                        required=True)
+    parser.add_argument('--json', metavar='PATH',
+                        help='Intermediate json file name',
+                        required=True)
+    add_arguments(parser)
+    args = parser.parse_args()
+    with open(args.json) as json_file:
+        json_data = json.load(json_file)
+    with open(args.info, "w+") as info_file, \
+            open(args.error_log, "w+") as error_log:
+        generate_info(json_data, args.workspace, info_file, error_log,
+                      args.branch_engine, args.jobs, args.branch_cache)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+# !/usr/bin/env python
+###############################################################################
+# Copyright (c) 2020, ARM Limited and Contributors. All rights reserved.
+#
+# SPDX-License-Identifier: BSD-3-Clause
+###############################################################################
+
+###############################################################################
+# FILE: hot_paths.py
+#
+# DESCRIPTION: Lists the functions and source code lines with the highest
+#              number of executed instructions for every elf file in an
+#              intermediate json file.
+#
+###############################################################################
+
+import sys
+import json
+import argparse
+
+
+def get_elf_names(json_data):
+    """
+    Get the elf names indexed by the elf index used in the intermediate json
+
+    :param json_data: Intermediate json data
+    :return: Dictionary with the elf index (as string) as key and the elf
+            name as value
+    """
+    elf_map = json_data['configuration'].get('elf_map', {})
+    return {str(index): name for name, index in elf_map.items()}
+
+
+def hot_paths(json_data, top=10):
+    """
+    Rank the functions and source code lines by executed instructions
+
+    :param json_data: Intermediate json data
+    :param top: Number of functions and lines to be reported per elf file
+    :return: Dictionary with the elf name as key and a dictionary with the
+            'functions' and 'lines' lists as value. Each list holds tuples
+            of (executed instructions, source file, function name or line
+            number) sorted by executed instructions
+    """
+    functions = {}
+    lines = {}
+    for source_file, source_data in json_data['source_files'].items():
+        for func_name, func_data in source_data['functions'].items():
+            executed = func_data.get('executed_instructions', {})
+            for elf_index, count in executed.items():
+                if count > 0:
+                    functions.setdefault(str(elf_index), []).append(
+                        (count, source_file, func_name))
+        for line, line_data in source_data['lines'].items():
+            for elf_index, addresses in line_data['elf_index'].items():
+                count = sum(times_executed for _, times_executed in
+                            addresses.values())
+                if count > 0:
+                    lines.setdefault(str(elf_index), []).append(
+                        (count, source_file, int(line)))
+    elf_names = get_elf_names(json_data)
+    report = {}
+    for elf_index in sorted(set(functions) | set(lines), key=int):
+        elf_name = elf_names.get(elf_index, elf_index)
+        report[elf_name] = {
+            'functions': sorted(functions.get(elf_index, []),
+                                reverse=True)[:top],
+            'lines': sorted(lines.get(elf_index, []), reverse=True)[:top]}
+    return report
+
+
+def print_report(report, out=sys.stdout):
+    """
+    Writes the hot path report as text
+
+    :param report: Report as returned by 'hot_paths'
+    :param out: Handler to the file to write the report into
+    """
+    for elf_name, elf_report in report.items():
+        out.write("{}\n".format(elf_name))
+        out.write("  Functions by executed instructions:\n")
+        for count, source_file, func_name in elf_report['functions']:
+            out.write("    {:>12}  {} ({})\n".format(count, func_name,
+                                                     source_file))
+        out.write("  Lines by executed instructions:\n")
+        for count, source_file, line in elf_report['lines']:
+            out.write("    {:>12}  {}:{}\n".format(count, source_file, line))
+        out.write("\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Report the hottest functions and source lines per elf "
+                    "file from an intermediate json file")
+    parser.add_argument('--json', metavar='PATH',
+                        help='Intermediate json file name',
+                        required=True)
+    parser.add_argument('--top', type=int, default=10,
+                        help='Number of functions and lines to be reported '
+                             'per elf file. Defaults to 10')
+    parser.add_argument('--output-json', metavar='PATH',
+                        help='Optional file to write the report as json')
+    args = parser.parse_args()
+    with open(args.json) as json_file:
+        json_data = json.load(json_file)
+    report = hot_paths(json_data, args.top)
+    print_report(report)
+    if args.output_json:
+        with open(args.output_json, 'w') as f:
+            json.dump(report, f, indent=4)
+
+
+if __name__ == '__main__':
+    main()
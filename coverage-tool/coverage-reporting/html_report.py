@@ -0,0 +1,307 @@
+# !/usr/bin/env python
+###############################################################################
+# Copyright (c) 2020, ARM Limited and Contributors. All rights reserved.
+#
+# SPDX-License-Identifier: BSD-3-Clause
+###############################################################################
+
+###############################################################################
+# FILE: html_report.py
+#
+# DESCRIPTION: Generates the HTML code coverage report from an info file or
+#              an intermediate json file. The pages are rendered in a process
+#              pool and pages whose inputs did not change since the previous
+#              report are not rendered again.
+#
+###############################################################################
+
+import os
+import json
+import html
+import hashlib
+import argparse
+import concurrent.futures
+
+import lcov_info
+
+# Part of the page digests, to be increased whenever the pages layout changes
+RENDERER_VERSION = 1
+MANIFEST = ".manifest.json"
+CSS_FILE = "report.css"
+CSS = """body { font-family: sans-serif; margin: 1em; }
+table { border-collapse: collapse; }
+th, td { padding: 2px 8px; text-align: left; }
+th { background: #dde; }
+td.number { text-align: right; }
+.high { background: #aea; }
+.medium { background: #ee8; }
+.low { background: #eaa; }
+pre { margin: 0; }
+table.source td { padding: 0 6px; font-family: monospace; white-space: pre; }
+tr.hit td.count, tr.hit td.code { background: #cfc; }
+tr.miss td.count, tr.miss td.code { background: #fcc; }
+td.branches { color: #666; }
+"""
+
+
+def rate_class(hit, found):
+    if found == 0:
+        return ""
+    rate = 100.0 * hit / found
+    return "high" if rate >= 90 else "medium" if rate >= 75 else "low"
+
+
+def totals_cells(totals):
+    """
+    HTML table cells for the lines, functions and branches totals
+    """
+    cells = []
+    for kind in ('lines', 'functions', 'branches'):
+        hit = totals[kind + '_hit']
+        found = totals[kind]
+        rate = "{:.1f}%".format(100.0 * hit / found) if found else "-"
+        cells.append('<td class="number {}">{}</td>'
+                     '<td class="number">{} / {}</td>'.format(
+                         rate_class(hit, found), rate, hit, found))
+    return "".join(cells)
+
+
+def add_totals(totals, other):
+    for key, value in other.items():
+        totals[key] = totals.get(key, 0) + value
+
+
+def page_header(title, css_link, totals):
+    return ("<!DOCTYPE html>\n<html><head><meta charset=\"utf-8\">"
+            "<title>{0}</title><link rel=\"stylesheet\" href=\"{1}\">"
+            "</head><body><h2>{0}</h2><table><tr><th>Lines</th><th></th>"
+            "<th>Functions</th><th></th><th>Branches</th><th></th></tr>"
+            "<tr>{2}</tr></table><br>\n").format(
+                html.escape(title), css_link, totals_cells(totals))
+
+
+def render_index(title, css_link, totals, entries):
+    """
+    Render a page with a table of entries (directories or files)
+
+    :param entries: List of (name, link, totals)
+    """
+    out = [page_header(title, css_link, totals),
+           "<table><tr><th>Name</th><th>Lines</th><th></th>"
+           "<th>Functions</th><th></th><th>Branches</th><th></th></tr>\n"]
+    for name, link, entry_totals in entries:
+        out.append('<tr><td><a href="{}">{}</a></td>{}</tr>\n'.format(
+            html.escape(link), html.escape(name),
+            totals_cells(entry_totals)))
+    out.append("</table></body></html>\n")
+    return "".join(out)
+
+
+def render_source(title, css_link, page_data, source_lines):
+    """
+    Render the page of a source file annotated with the execution counts
+    """
+    record = page_data['record']
+    out = [page_header(title, css_link, page_data['totals']),
+           "<table><tr><th>Function</th><th>Line</th><th>Hits</th></tr>\n"]
+    for name, number in sorted(record['functions'].items(),
+                               key=lambda f: (f[1], f[0])):
+        out.append('<tr><td><a href="#L{1}">{0}</a></td>'
+                   '<td class="number">{1}</td>'
+                   '<td class="number">{2}</td></tr>\n'.format(
+                       html.escape(name), number,
+                       record['function_hits'].get(name, 0)))
+    out.append('</table><br>\n<table class="source">\n')
+    lines = {int(number): count for number, count in record['lines']}
+    branches = {}
+    for number, _, _, taken in record['branches']:
+        branches.setdefault(number, []).append(
+            '#' if taken is None else '+' if taken else '-')
+    last = max([len(source_lines)] + list(lines))
+    for number in range(1, last + 1):
+        code = source_lines[number - 1] if number <= len(source_lines) \
+            else ""
+        if number in lines:
+            css_class = "hit" if lines[number] > 0 else "miss"
+            count = str(lines[number])
+        else:
+            css_class = count = ""
+        out.append('<tr id="L{0}" class="{1}"><td class="number">{0}</td>'
+                   '<td class="branches">{2}</td>'
+                   '<td class="count number">{3}</td>'
+                   '<td class="code">{4}</td></tr>\n'.format(
+                       number, css_class,
+                       "[" + " ".join(branches[number]) + "]"
+                       if number in branches else "",
+                       count, html.escape(code.rstrip('\n'))))
+    out.append("</table></body></html>\n")
+    return "".join(out)
+
+
+def render_page(task):
+    """
+    Render a page in a worker process, unless its digest matches the one of
+    the previous report
+
+    :param task: Tuple of (page kind: 'source' or 'index', output folder,
+                 page path relative to the output folder, page data,
+                 previous digest of the page or None)
+    :return: Tuple of (page path, digest, True if rendered)
+    """
+    kind, output_dir, page, page_data, previous = task
+    digest = hashlib.sha256(json.dumps(
+        [RENDERER_VERSION, kind, page, page_data],
+        sort_keys=True).encode())
+    source_lines = []
+    if kind == 'source':
+        try:
+            with open(page_data['source_file'], 'rb') as f:
+                content = f.read()
+            digest.update(content)
+            source_lines = content.decode('utf8', errors='replace') \
+                .splitlines()
+        except IOError:
+            pass
+    digest = digest.hexdigest()
+    page_file = os.path.join(output_dir, page)
+    if digest == previous and os.path.exists(page_file):
+        return page, digest, False
+    css_link = os.path.relpath(os.path.join(output_dir, CSS_FILE),
+                               os.path.dirname(page_file))
+    if kind == 'source':
+        text = render_source(page_data['title'], css_link, page_data,
+                             source_lines)
+    else:
+        text = render_index(page_data['title'], css_link,
+                            page_data['totals'], page_data['entries'])
+    os.makedirs(os.path.dirname(page_file), exist_ok=True)
+    with open(page_file, 'w') as f:
+        f.write(text)
+    return page, digest, True
+
+
+def report_tasks(records, output_dir, manifest):
+    """
+    Build the rendering tasks of all the pages of the report
+
+    :return: List of tasks, see 'render_page'
+    """
+    directories = {}
+    for source_file in records:
+        directories.setdefault(os.path.dirname(source_file), []).append(
+            source_file)
+    # The directories are shown relative to the parent of their common path
+    prefix = os.path.dirname(os.path.commonpath(list(directories))) \
+        if directories else ""
+    tasks = []
+    report_totals = {}
+    directory_entries = []
+    for directory in sorted(directories):
+        directory_name = os.path.relpath(directory, prefix) if prefix \
+            else directory.lstrip('/')
+        directory_totals = {}
+        file_entries = []
+        for source_file in sorted(directories[directory]):
+            record = records[source_file]
+            totals = lcov_info.record_totals(record)
+            add_totals(directory_totals, totals)
+            name = os.path.basename(source_file)
+            page = os.path.join(directory_name, name + ".html")
+            page_data = {
+                'title': source_file,
+                'source_file': source_file,
+                'totals': totals,
+                'record': {
+                    'functions': record['functions'],
+                    'function_hits': record['function_hits'],
+                    'lines': sorted(record['lines'].items()),
+                    'branches': sorted(
+                        list(key) + [taken] for key, taken in
+                        record['branches'].items())}}
+            tasks.append(('source', output_dir, page, page_data,
+                          manifest.get(page)))
+            file_entries.append((name, name + ".html", totals))
+        page = os.path.join(directory_name, "index.html")
+        tasks.append(('index', output_dir, page,
+                      {'title': directory_name, 'totals': directory_totals,
+                       'entries': file_entries}, manifest.get(page)))
+        add_totals(report_totals, directory_totals)
+        directory_entries.append((directory_name, page, directory_totals))
+    tasks.append(('index', output_dir, "index.html",
+                  {'title': "Code coverage report", 'totals': report_totals,
+                   'entries': directory_entries}, manifest.get("index.html")))
+    return tasks
+
+
+def html_report(records, output_dir, jobs=1):
+    """
+    Generate the HTML report
+
+    :param records: Dictionary with the source file name as key and its
+                    record as value
+    :param output_dir: Report folder
+    :param jobs: Number of processes rendering pages
+    :return: Tuple of (number of pages, number of pages rendered)
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    manifest_file = os.path.join(output_dir, MANIFEST)
+    try:
+        with open(manifest_file) as f:
+            manifest = json.load(f)
+    except (IOError, ValueError):
+        manifest = {}
+    with open(os.path.join(output_dir, CSS_FILE), 'w') as f:
+        f.write(CSS)
+    tasks = report_tasks(records, output_dir, manifest)
+    new_manifest = {}
+    rendered = 0
+    if jobs > 1:
+        with concurrent.futures.ProcessPoolExecutor(jobs) as executor:
+            results = list(executor.map(render_page, tasks, chunksize=16))
+    else:
+        results = [render_page(task) for task in tasks]
+    for page, digest, was_rendered in results:
+        new_manifest[page] = digest
+        rendered += was_rendered
+    # Remove the pages of source files no longer in the report
+    for page in set(manifest) - set(new_manifest):
+        try:
+            os.remove(os.path.join(output_dir, page))
+        except OSError:
+            pass
+    with open(manifest_file, 'w') as f:
+        json.dump(new_manifest, f, indent=1, sort_keys=True)
+    return len(tasks), rendered
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Generate the HTML code coverage report from an info "
+                    "file or an intermediate json file")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--info', metavar='PATH', help='Info file name')
+    source.add_argument('--json', metavar='PATH',
+                        help='Intermediate json file name')
+    parser.add_argument('--workspace', metavar='PATH', default="",
+                        help='Folder with source files structure, needed '
+                             'with --json')
+    parser.add_argument('--branch-engine', choices=['source', 'asm'],
+                        default='source',
+                        help='Branch engine used with --json, see '
+                             'generate_info_file.py. Defaults to source')
+    parser.add_argument('--output-directory', metavar='PATH',
+                        required=True, help='Report folder')
+    parser.add_argument('--jobs', metavar='N', type=int,
+                        default=os.cpu_count() or 1,
+                        help='Number of processes rendering pages. Defaults '
+                             'to the number of CPUs')
+    args = parser.parse_args()
+    records = lcov_info.load_records(args.info, args.json, args.workspace,
+                                     args.branch_engine, args.jobs)
+    pages, rendered = html_report(records, args.output_directory, args.jobs)
+    print("Report at '{}': {} pages, {} rendered".format(
+        args.output_directory, pages, rendered))
+
+
+if __name__ == '__main__':
+    main()
@@ -23,9 +23,14 @@ import json
 from argparse import RawTextHelpFormatter
 import logging
 import time
+import hashlib
+
+import asm_branches
 
 __version__ = "6.0"
 
+logger = logging.getLogger(__name__)
+
 # Static map that defines the elf file source type in the intermediate json
 ELF_MAP = {
     "bl1": 0,
@@ -61,16 +66,23 @@ def os_command(command, show_command=False):
     return out.decode("utf8")
 
 
-def load_stats_from_traces(trace_globs):
+def load_stats_from_traces(trace_globs, trace_index=None):
     """
     Function to process and consolidate statistics from trace files
 
     :param trace_globs: List of trace file patterns
+    :param trace_index: Optional dictionary with the trace file name as key
+        and its bit position in the trace bitsets as value. Trace files not
+        in the dictionary are added to it.
     :return: Dictionary with stats from trace files i.e.
-        {mem address in decimal}=(times executed, inst size)
+        {mem address in decimal}=(times executed, inst size, bitset of the
+        trace files that executed the address)
     """
     stats = {}
     stat_size = {}
+    stat_traces = {}
+    if trace_index is None:
+        trace_index = {}
 
     # Make a list of unique trace files
     trace_files = []
@@ -81,7 +93,10 @@ def load_stats_from_traces(trace_globs):
     if not trace_files:
         raise Exception("No trace files found for '{}'".format(trace_globs))
     # Load stats from the trace files
-    for trace_file in trace_files:
+    for trace_file in sorted(trace_files):
+        if trace_file not in trace_index:
+            trace_index[trace_file] = len(trace_index)
+        trace_bit = 1 << trace_index[trace_file]
         try:
             with open(trace_file, 'r') as f:
                 for line in f:
@@ -92,13 +107,16 @@ def load_stats_from_traces(trace_globs):
                     stat_size[address] = size
                     if address in stats:
                         stats[address] += stat
+                        stat_traces[address] |= trace_bit
                     else:
                         stats[address] = stat
+                        stat_traces[address] = trace_bit
         except Exception as ex:
             logger.error("@Loading stats from trace files:{}".format(ex))
-    # Merge the two dicts
+    # Merge the dicts
     for address in stats:
-        stats[address] = (stats[address], stat_size[address])
+        stats[address] = (stats[address], stat_size[address],
+                          stat_traces[address])
     return stats
 
 
@@ -235,6 +253,22 @@ def apply_functions_exclude(elf_config, functions):
     return incl, excl
 
 
+def elf_build_id(elf_filename):
+    """
+    Identify the build of an elf file, so elf files with the same name from
+    different builds (e.g. platforms) are not mixed when merging
+    intermediate layers
+
+    :param elf_filename: Elf binary file name
+    :return: Hexadecimal sha256 of the elf file content
+    """
+    digest = hashlib.sha256()
+    with open(elf_filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
 def remove_workspace(path, workspace):
     """
     Get the relative path to a given workspace
@@ -276,6 +310,20 @@ def get_function_line_numbers(source_file):
     return fln
 
 
+def function_entry(covered, line_number):
+    """
+    Create the intermediate layer record for a function
+
+    :param covered: True if any instruction of the function was executed
+    :param line_number: Line number of the function within its source file
+    :return: Dictionary with the coverage data of the function, 'count' holds
+            the times the function was entered and 'executed_instructions'
+            the number of instructions executed per elf index
+    """
+    return {"covered": covered, "line_number": line_number, "count": 0,
+            "executed_instructions": {}}
+
+
 class FunctionLineNumbers(object):
 
     def __init__(self, workspace):
@@ -304,8 +352,15 @@ class PostProcessCC(object):
         self.local_workspace = local_workspace
         self.elfs = self.config['elfs']
         # Dictionary with stats from trace files {address}=(times executed,
-        # inst size)
+        # inst size, bitset of trace files)
         self.traces_stats = {}
+        # Dictionary of trace file names against their bit position in the
+        # trace bitsets
+        self.trace_index = {}
+        # Bitsets of the trace files that executed a function (or a line)
+        # {(source file location, function name or line number)}=>bitset
+        self.function_traces = {}
+        self.line_traces = {}
         # Dictionary of unique assembly line memory address against source
         # file location
         # {assembly address} = (opcode, source file location, line number in
@@ -313,35 +368,49 @@ class PostProcessCC(object):
         self.asm_lines = {}
         # Dictionary of {source file location}=>{'lines': {'covered':Boolean,
         # 'elf_index'; {elf index}=>{assembly address}=>(opcode,
-        # times executed),
-        # 'functions': {function name}=>is covered(boolean)}
+        # times executed), 'branch_instructions': number of branch
+        # instructions},
+        # 'functions': {function name}=>{'covered': Boolean, 'line_number',
+        # 'count': times entered, 'executed_instructions': {elf index}=>
+        # number of instructions executed}}
         self.source_files_coverage = {}
         self.functions = []
         # Unique set of elf list of files
         self.elf_map = {}
+        # Dictionary of {elf index}=>build id of the elf file
+        self.elf_builds = {}
         # For elf custom mappings
         self.elf_custom = None
 
-    def process(self):
+    def process(self, write_json=True):
         """
         Public method to process the trace files and dwarf signatures
         using the information contained in the json configuration file.
         This method writes the intermediate json file output linking
         the trace data and c source and assembly code.
+
+        :param write_json: If False the intermediate json file is not written
+        :return: Intermediate layer data
         """
         self.source_files_coverage = {}
         self.asm_lines = {}
+        self.trace_index = {}
+        self.function_traces = {}
+        self.line_traces = {}
+        self.elf_builds = {}
         # Initialize for unknown elf files
         self.elf_custom = ELF_MAP["custom_offset"]
         sources_config = {}
-        print("Generating intermediate json layer '{}'...".format(
-            self.config['parameters']['output_file']))
+        if write_json:
+            print("Generating intermediate json layer '{}'...".format(
+                self.config['parameters']['output_file']))
         for elf in self.elfs:
             # Gather information
             elf_name = elf['name']
             os_command("ls {}".format(elf_name))
             # Trace data
-            self.traces_stats = load_stats_from_traces(elf['traces'])
+            self.traces_stats = load_stats_from_traces(elf['traces'],
+                                                       self.trace_index)
             prefix = self.config['parameters']['workspace'] \
                 if self.config['configuration']['remove_workspace'] else \
                 None
@@ -357,19 +426,40 @@ class PostProcessCC(object):
                   functions_list if not
                   functions_list[f]["sources"]}
             self.process_fn_no_sources(nf)
-            # Write to the intermediate json file
+        self.apply_trace_attribution()
+        # Write to the intermediate json file
         data = {"source_files": self.source_files_coverage,
                 "configuration": {
                     "sources": sources_config,
                     "metadata": "" if 'metadata' not in
                                       self.config['parameters'] else
                     self.config['parameters']['metadata'],
-                    "elf_map": self.elf_map
+                    "elf_map": self.elf_map,
+                    "elf_builds": self.elf_builds,
+                    "trace_files": sorted(self.trace_index,
+                                          key=self.trace_index.get)
                 }
                 }
-        json_data = json.dumps(data, indent=4, sort_keys=True)
-        with open(self.config['parameters']['output_file'], "w") as f:
-            f.write(json_data)
+        if write_json:
+            json_data = json.dumps(data, indent=4, sort_keys=True)
+            with open(self.config['parameters']['output_file'], "w") as f:
+                f.write(json_data)
+        return data
+
+    def apply_trace_attribution(self):
+        """
+        Writes the bitsets of the trace files that executed each function
+        (and each line if 'line_attribution' is enabled in the configuration)
+        as hexadecimal strings in the 'traces' property. Bit n stands for the
+        n-th file in the 'trace_files' list of the configuration.
+        """
+        for (source_file, function_name), traces in \
+                self.function_traces.items():
+            self.source_files_coverage[source_file]["functions"][
+                function_name]["traces"] = format(traces, 'x')
+        for (source_file, line), traces in self.line_traces.items():
+            self.source_files_coverage[source_file]["lines"][line][
+                "traces"] = format(traces, 'x')
 
     def dump_sources(self, elf_filename, function_list, prefix=None):
         """
@@ -397,6 +487,9 @@ class PostProcessCC(object):
                 self.elf_map[elf_name] = self.elf_custom
                 self.elf_custom += 1
         elf_index = self.elf_map[elf_name]
+        self.elf_builds[str(elf_index)] = elf_build_id(elf_filename)
+        line_attribution = self.config['configuration'].get(
+            'line_attribution', False)
         # The function groups have 2 elements:
         # Function's block name, Function's block code
         function_groups = re.findall(
@@ -426,9 +519,17 @@ class PostProcessCC(object):
             if block_function_source_file not in source_files:
                 source_files[block_function_source_file] = {"functions": {},
                                                             "lines": {}}
-            source_files[block_function_source_file]["functions"][
-                block_function_name] = {"covered": False,
-                                        "line_number": fn_line_number}
+            block_functions = source_files[block_function_source_file][
+                "functions"]
+            if block_function_name not in block_functions:
+                block_functions[block_function_name] = function_entry(
+                    False, fn_line_number)
+            # Times the function was entered: executions of its first address
+            entry_address = int(function_list[block_function_name]["start"],
+                                16)
+            block_functions[block_function_name]["count"] += \
+                0 if entry_address not in self.traces_stats else \
+                self.traces_stats[entry_address][0]
             # Now lets check the block code
             # The source code groups have 5 elements:
             # Function for the statements (optional), Source file for the asm
@@ -466,10 +567,11 @@ class PostProcessCC(object):
                         statements_function_name)
                     source_files[statements_source_file]["functions"][
                         statements_function_name] = \
-                        {"covered": False, "line_number": fn_line_number}
+                        function_entry(False, fn_line_number)
                 if ln not in source_files[statements_source_file]["lines"]:
                     source_files[statements_source_file]["lines"][ln] = \
-                        {"covered": False, "elf_index": {}}
+                        {"covered": False, "elf_index": {},
+                         "branch_instructions": 0}
                 source_file_ln = source_files[statements_source_file]["lines"][
                     ln]
                 asm_line_groups = re.findall(
@@ -493,6 +595,23 @@ class PostProcessCC(object):
                             source_file_ln["elf_index"][elf_index]:
                         source_file_ln["elf_index"][elf_index][dec_address] = (
                             opcode, times_executed)
+                        if asm_branches.is_branch(opcode):
+                            source_file_ln["branch_instructions"] += 1
+                        executed = source_files[statements_source_file][
+                            "functions"][statements_function_name][
+                            "executed_instructions"]
+                        executed[elf_index] = \
+                            executed.get(elf_index, 0) + times_executed
+                    if times_executed > 0:
+                        traces = self.traces_stats[dec_address][2]
+                        key = (statements_source_file,
+                               statements_function_name)
+                        self.function_traces[key] = \
+                            self.function_traces.get(key, 0) | traces
+                        if line_attribution:
+                            key = (statements_source_file, ln)
+                            self.line_traces[key] = \
+                                self.line_traces.get(key, 0) | traces
             source_files[block_function_source_file]["functions"][
                 block_function_name]["covered"] |= is_function_block_covered
 
@@ -505,10 +624,14 @@ class PostProcessCC(object):
         """
         if not FUNCTION_LINES_ENABLED:
             return  # No source code at the workspace
-        address_seq = sorted(self.traces_stats.keys())
         for function_name in function_list:
             # Just check if the start address is in the trace logs
-            covered = function_list[function_name]["start"] in address_seq
+            start_address = int(function_list[function_name]["start"], 16)
+            count = 0 if start_address not in self.traces_stats else \
+                self.traces_stats[start_address][0]
+            covered = count > 0
+            traces = 0 if not covered else \
+                self.traces_stats[start_address][2]
             # Find the source file
             files = os_command(("grep --include *.c --include *.s -nrw '{}' {}"
                                 "| cut -d: -f1").format(function_name,
@@ -534,9 +657,13 @@ class PostProcessCC(object):
                 if function_name not in \
                         self.source_files_coverage[source_file]["functions"] or \
                         covered:
+                    entry = function_entry(covered, line_number)
+                    entry["count"] = count
                     self.source_files_coverage[source_file]["functions"][
-                        function_name] = {"covered": covered,
-                                          "line_number": line_number}
+                        function_name] = entry
+                    if traces:
+                        self.function_traces[(source_file, function_name)] = \
+                            traces
             else:
                 logger.warning("Function '{}' not found in sources.".format(
                     function_name))
@@ -553,7 +680,9 @@ Input json configuration file format:
         "remove_workspace": <true if 'workspace' must be from removed from the
                                 path of the source files>,
         "include_assembly": <true to include assembly source code in the
-                            intermediate layer>
+                            intermediate layer>,
+        "line_attribution": <Optional, true to record for every line the
+                            trace files that executed it>
         },
     "parameters":
         {
@@ -601,26 +730,20 @@ SOURCE_PATTERN = (r'(?s)([a-zA-Z0-9_]+)?(?:\(\):\n)?(^/.+?):([0-9]+)'
                   r'(?: \(.+?\))?\n(.+?)(?=\n/|\n$|([a-zA-Z0-9_]+\(\):))')
 
 
-def main():
+def setup_tools(config, local_workspace):
+    """
+    Sets and checks the toolchain binaries from the configuration and
+    enables the function line numbers if ctags is installed and a local
+    workspace is given
+
+    :param config: Json configuration data
+    :param local_workspace: Local workspace folder where source code files
+                            reside
+    """
     global OBJDUMP
     global READELF
     global FUNCTION_LINES_ENABLED
 
-    parser = argparse.ArgumentParser(epilog=json_conf_help,
-                                     formatter_class=RawTextHelpFormatter)
-    parser.add_argument('--config-json', metavar='PATH',
-                        dest="config_json", default='config_file.json',
-                        help='JSON configuration file', required=True)
-    parser.add_argument('--local-workspace', default="",
-                        help=('Local workspace folder where source code files'
-                              ' and folders resides'))
-    args = parser.parse_args()
-    try:
-        with open(args.config_json, 'r') as f:
-            config = json.load(f)
-    except Exception as ex:
-        print("Error at opening and processing JSON: {}".format(ex))
-        return
     # Setting toolchain binary tools variables
     OBJDUMP = config['parameters']['objdump']
     READELF = config['parameters']['readelf']
@@ -628,7 +751,7 @@ def main():
     os_command("{} --version".format(OBJDUMP))
     os_command("{} --version".format(READELF))
 
-    if args.local_workspace != "":
+    if local_workspace != "":
         # Checking ctags installed
         try:
             os_command("ctags --version")
@@ -639,6 +762,25 @@ def main():
         else:
             FUNCTION_LINES_ENABLED = True
 
+
+def main():
+    parser = argparse.ArgumentParser(epilog=json_conf_help,
+                                     formatter_class=RawTextHelpFormatter)
+    parser.add_argument('--config-json', metavar='PATH',
+                        dest="config_json", default='config_file.json',
+                        help='JSON configuration file', required=True)
+    parser.add_argument('--local-workspace', default="",
+                        help=('Local workspace folder where source code files'
+                              ' and folders resides'))
+    args = parser.parse_args()
+    try:
+        with open(args.config_json, 'r') as f:
+            config = json.load(f)
+    except Exception as ex:
+        print("Error at opening and processing JSON: {}".format(ex))
+        return
+    setup_tools(config, args.local_workspace)
+
     pp = PostProcessCC(config, args.local_workspace)
     pp.process()
 
@@ -647,7 +789,6 @@ if __name__ == '__main__':
     logging.basicConfig(filename='intermediate_layer.log', level=logging.DEBUG,
                         format=('%(asctime)s %(levelname)s %(name)s '
                                 '%(message)s'))
-    logger = logging.getLogger(__name__)
     start_time = time.time()
     main()
     elapsed_time = time.time() - start_time
@@ -0,0 +1,294 @@
+# !/usr/bin/env python
+###############################################################################
+# Copyright (c) 2020, ARM Limited and Contributors. All rights reserved.
+#
+# SPDX-License-Identifier: BSD-3-Clause
+###############################################################################
+
+###############################################################################
+# FILE: intermediate_merge.py
+#
+# DESCRIPTION: Merges intermediate json files keeping all their detail:
+#              functions, lines, per elf address execution counts and trace
+#              attribution. Any number of files is merged by a pairwise tree
+#              reduction over a process pool. Elf files are matched by name
+#              and build, so the same elf file name from different builds
+#              (e.g. platforms) keeps its own address space.
+#
+###############################################################################
+
+import os
+import sys
+import json
+import argparse
+import multiprocessing
+
+import asm_branches
+
+# First elf index given to elf files not in the static map, see
+# intermediate_layer.ELF_MAP
+ELF_CUSTOM_OFFSET = 100
+
+
+def load_layer(layer):
+    """
+    Get the data of an intermediate layer
+
+    :param layer: Intermediate json file name or its data already loaded
+                  (and normalized, see 'normalize')
+    :return: Intermediate layer data
+    """
+    if isinstance(layer, str):
+        with open(layer) as json_file:
+            return json.load(json_file)
+    return layer
+
+
+def find_elf(elf_map, elf_builds, elf_name, build):
+    """
+    Find an elf file of a layer by name and build
+
+    :param elf_map: Dictionary of {elf name}=>index of the layer. Elf files
+                    with the same name from other builds are named
+                    '<elf name>@<build>'
+    :param elf_builds: Dictionary of {index}=>build id of the layer
+    :param elf_name: Name of the elf file
+    :param build: Build id of the elf file, or None if unknown
+    :return: Index of the elf file or None if not found
+    """
+    for name, index in elf_map.items():
+        if name != elf_name and not name.startswith(elf_name + '@'):
+            continue
+        other_build = elf_builds.get(str(index))
+        if build is None or other_build is None:
+            # Layers produced before the build ids were recorded
+            print("Warning: merging elf file '{}' without build id, it is "
+                  "assumed to be the same build".format(elf_name))
+            return index
+        if build == other_build:
+            return index
+    return None
+
+
+def elf_remap(configuration, other_configuration):
+    """
+    Add the elf files of a layer to the elf map of another one and get the
+    translation of their indexes. Elf files are matched by name and build.
+    An elf file whose name is already used by another build is named
+    '<elf name>@<build>', and an elf file whose index is already used by
+    another elf file gets a new custom index.
+
+    :param configuration: Configuration of the layer to be updated
+    :param other_configuration: Configuration of the layer being merged
+    :return: Dictionary of {old index}=>new index, both as strings
+    """
+    elf_map = configuration.setdefault('elf_map', {})
+    elf_builds = configuration.setdefault('elf_builds', {})
+    other_elf_map = other_configuration.get('elf_map', {})
+    other_builds = other_configuration.get('elf_builds', {})
+    remap = {}
+    for elf_name, other_index in sorted(other_elf_map.items(),
+                                        key=lambda e: e[1]):
+        build = other_builds.get(str(other_index))
+        base_name = elf_name.split('@')[0]
+        index = find_elf(elf_map, elf_builds, base_name, build)
+        if index is None:
+            index = other_index
+            if index in elf_map.values():
+                index = max([ELF_CUSTOM_OFFSET - 1] +
+                            list(elf_map.values())) + 1
+            name = base_name
+            if name in elf_map:
+                name = "{}@{}".format(base_name, build[:12])
+            elf_map[name] = index
+            if build is not None:
+                elf_builds[str(index)] = build
+        remap[str(other_index)] = str(index)
+    return remap
+
+
+def merge_traces(traces, other_traces, shift):
+    """
+    Merge two trace bitsets, see intermediate_layer.apply_trace_attribution
+
+    :param traces: Bitset as hexadecimal string or None
+    :param other_traces: Bitset of the layer being merged or None
+    :param shift: Number of trace files before the ones of the layer being
+                  merged
+    :return: Merged bitset as hexadecimal string or None
+    """
+    if other_traces is None:
+        return traces
+    bits = int(traces or '0', 16) | (int(other_traces, 16) << shift)
+    return format(bits, 'x')
+
+
+def merge_function(function, other, remap, shift):
+    function['covered'] = function['covered'] or other['covered']
+    function['count'] = function.get('count', 0) + other.get('count', 0)
+    executed = function.setdefault('executed_instructions', {})
+    for elf_index, count in other.get('executed_instructions', {}).items():
+        elf_index = remap.get(str(elf_index), str(elf_index))
+        executed[elf_index] = executed.get(elf_index, 0) + count
+    traces = merge_traces(function.get('traces'), other.get('traces'), shift)
+    if traces is not None:
+        function['traces'] = traces
+
+
+def merge_line(line, other, remap, shift):
+    line['covered'] = line['covered'] or other['covered']
+    for elf_index, addresses in other['elf_index'].items():
+        elf_index = remap.get(str(elf_index), str(elf_index))
+        merged_addresses = line['elf_index'].setdefault(elf_index, {})
+        for address, (opcode, times_executed) in addresses.items():
+            address = str(address)
+            if address in merged_addresses:
+                times_executed += merged_addresses[address][1]
+            merged_addresses[address] = [opcode, times_executed]
+    line['branch_instructions'] = len(
+        [address for addresses in line['elf_index'].values()
+         for address, (opcode, _) in addresses.items()
+         if asm_branches.is_branch(opcode)])
+    traces = merge_traces(line.get('traces'), other.get('traces'), shift)
+    if traces is not None:
+        line['traces'] = traces
+
+
+def normalize(data):
+    """
+    Use string keys for the elf indexes and addresses, as in the json file,
+    so data produced in memory by intermediate_layer can be merged too.
+    Json files are already normalized.
+
+    :param data: Intermediate layer data to be updated
+    :return: The updated data
+    """
+    source_files = data.setdefault('source_files', {})
+    for source_data in source_files.values():
+        for function in source_data['functions'].values():
+            function['executed_instructions'] = {
+                str(k): v for k, v in
+                function.get('executed_instructions', {}).items()}
+        for line in source_data['lines'].values():
+            line['elf_index'] = {
+                str(elf_index): {str(address): list(value) for address, value
+                                 in addresses.items()}
+                for elf_index, addresses in line['elf_index'].items()}
+    data['source_files'] = {
+        source_file: dict(source_data,
+                          lines={str(k): v for k, v in
+                                 source_data['lines'].items()})
+        for source_file, source_data in source_files.items()}
+    return data
+
+
+def merge_layers(data, other):
+    """
+    Merge an intermediate layer into another one. Functions and lines are
+    the union of both layers, their execution counts are added up per elf
+    file and address, and the trace files of the merged layer are appended,
+    shifting its trace bitsets. The metadata of the first layer is kept.
+
+    :param data: Normalized intermediate layer data to be updated, see
+                 'normalize'
+    :param other: Normalized intermediate layer data to be merged
+    :return: The updated data
+    """
+    configuration = data.setdefault('configuration', {})
+    other_configuration = other.get('configuration', {})
+    sources = configuration.setdefault('sources', [])
+    for source in other_configuration.get('sources', []):
+        if source not in sources:
+            sources.append(source)
+    remap = elf_remap(configuration, other_configuration)
+    trace_files = configuration.setdefault('trace_files', [])
+    shift = len(trace_files)
+    trace_files.extend(other_configuration.get('trace_files', []))
+    source_files = data.setdefault('source_files', {})
+    for source_file, other_data in other.get('source_files', {}).items():
+        source_data = source_files.setdefault(
+            source_file, {"functions": {}, "lines": {}})
+        for name, function in other_data['functions'].items():
+            if name not in source_data['functions']:
+                source_data['functions'][name] = {
+                    "covered": False,
+                    "line_number": function['line_number'],
+                    "count": 0, "executed_instructions": {}}
+            merge_function(source_data['functions'][name], function, remap,
+                           shift)
+        for line_number, line in other_data['lines'].items():
+            if line_number not in source_data['lines']:
+                source_data['lines'][line_number] = {
+                    "covered": False, "elf_index": {},
+                    "branch_instructions": 0}
+            merge_line(source_data['lines'][line_number], line, remap, shift)
+    return data
+
+
+def merge_pair(pair):
+    """
+    Merge two intermediate layers in a worker process
+
+    :param pair: Tuple of two intermediate layers (file names or data)
+    :return: Merged intermediate layer data
+    """
+    data, other = pair
+    return merge_layers(load_layer(data), load_layer(other))
+
+
+def merge_intermediate(layers, jobs=1):
+    """
+    Merge any number of intermediate layers by pairwise tree reduction.
+    Layers are merged in their order, so the trace files of the result
+    follow the order of the layers.
+
+    :param layers: List of intermediate json file names or their data
+    :param jobs: Number of processes merging pairs of layers
+    :return: Merged intermediate layer data
+    """
+    # Every input is normalized once, the merged layers stay normalized
+    layers = [layer if isinstance(layer, str) else normalize(layer)
+              for layer in layers]
+    if not layers:
+        return {'configuration': {'sources': []}, 'source_files': {}}
+    if len(layers) == 1:
+        return merge_layers({}, load_layer(layers[0]))
+    pool = multiprocessing.Pool(jobs) if jobs > 1 else None
+    try:
+        while len(layers) > 1:
+            pairs = list(zip(layers[0::2], layers[1::2]))
+            merged = pool.map(merge_pair, pairs) if pool else \
+                [merge_pair(pair) for pair in pairs]
+            if len(layers) % 2:
+                merged.append(layers[-1])
+            layers = merged
+    finally:
+        if pool:
+            pool.close()
+            pool.join()
+    return load_layer(layers[0])
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Merge intermediate json files keeping all the coverage "
+                    "detail")
+    parser.add_argument('-j', '--json-file', action='append', required=True,
+                        help='Input intermediate json file to be merged')
+    parser.add_argument('-o', '--output', required=True,
+                        help='Name of the output json (merged) file')
+    parser.add_argument('--jobs', type=int, default=os.cpu_count() or 1,
+                        help='Number of processes merging pairs of files. '
+                             'Defaults to the number of CPUs')
+    args = parser.parse_args()
+    for json_file in args.json_file:
+        if not os.path.isfile(json_file):
+            print('Error: file "' + json_file + '" not found.\n')
+            sys.exit(1)
+    data = merge_intermediate(args.json_file, args.jobs)
+    with open(args.output, 'w') as f:
+        json.dump(data, f, indent=4)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,143 @@
+# !/usr/bin/env python
+###############################################################################
+# Copyright (c) 2020, ARM Limited and Contributors. All rights reserved.
+#
+# SPDX-License-Identifier: BSD-3-Clause
+###############################################################################
+
+###############################################################################
+# FILE: json_stream.py
+#
+# DESCRIPTION: Reads the members of an object of a json file one at a time,
+#              so large intermediate json files (e.g. their 'source_files')
+#              can be processed without loading the whole file.
+#
+###############################################################################
+
+import json
+
+CHUNK_SIZE = 1 << 20
+WHITESPACE = ' \t\n\r'
+
+
+class JsonReader(object):
+    """Buffered reader of a json text that decodes one value at a time. Only
+    the part of the file with the value being decoded is kept in memory.
+    """
+
+    def __init__(self, json_file):
+        self.json_file = json_file
+        self.decoder = json.JSONDecoder()
+        self.buffer = ''
+        self.position = 0
+        self.eof = False
+
+    def fill(self, size=CHUNK_SIZE):
+        """
+        Read more text from the file, dropping the text already decoded
+
+        :return: False if the end of the file was reached
+        """
+        self.buffer = self.buffer[self.position:]
+        self.position = 0
+        chunk = self.json_file.read(max(size, CHUNK_SIZE))
+        if not chunk:
+            self.eof = True
+            return False
+        self.buffer += chunk
+        return True
+
+    def peek(self):
+        """
+        Skip the whitespace
+
+        :return: Next character, or None at the end of the file
+        """
+        while True:
+            while self.position < len(self.buffer) and \
+                    self.buffer[self.position] in WHITESPACE:
+                self.position += 1
+            if self.position < len(self.buffer):
+                return self.buffer[self.position]
+            if not self.fill():
+                return None
+
+    def expect(self, characters):
+        """
+        Consume the next character, that must be one of the given ones
+
+        :return: Character consumed
+        """
+        character = self.peek()
+        if character is None or character not in characters:
+            raise ValueError("Expected one of '{}' at offset {} of the "
+                             "buffer, got {!r}".format(
+                                 characters, self.position, character))
+        self.position += 1
+        return character
+
+    def value(self):
+        """
+        Decode the next json value, reading as much of the file as needed
+
+        :return: Decoded value
+        """
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer,
+                                                     self.position)
+                # A number may go on in the text not read yet
+                if end < len(self.buffer) or self.eof:
+                    self.position = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            # Read at least as much as already buffered, so the retries of
+            # a large value are linear in its size
+            self.fill(len(self.buffer))
+
+    def items(self):
+        """
+        Decode the members of the json object that starts at the current
+        position, one at a time
+
+        :return: Generator of tuples of (name, value)
+        """
+        self.expect('{')
+        if self.peek() == '}':
+            self.position += 1
+            return
+        while True:
+            name = self.value()
+            self.expect(':')
+            yield name, self.value()
+            if self.expect(',}') == '}':
+                return
+
+
+def iter_member_items(json_file, member):
+    """
+    Decode the members of an object that is a member of the top json
+    object, one at a time, e.g. the source files of an intermediate json
+    file. The other members of the top object are decoded and discarded.
+
+    :param json_file: Handler to the json file
+    :param member: Name of the member of the top object
+    :return: Generator of tuples of (name, value)
+    """
+    reader = JsonReader(json_file)
+    reader.expect('{')
+    if reader.peek() == '}':
+        return
+    while True:
+        name = reader.value()
+        reader.expect(':')
+        if name == member and reader.peek() == '{':
+            for item in reader.items():
+                yield item
+        else:
+            reader.value()
+        if reader.expect(',}') == '}':
+            return
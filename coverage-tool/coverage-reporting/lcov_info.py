@@ -0,0 +1,180 @@
+# !/usr/bin/env python
+###############################################################################
+# Copyright (c) 2020, ARM Limited and Contributors. All rights reserved.
+#
+# SPDX-License-Identifier: BSD-3-Clause
+###############################################################################
+
+###############################################################################
+# FILE: lcov_info.py
+#
+# DESCRIPTION: Reads and writes LCOV info files one source file record at a
+#              time and loads the records of an info file or an
+#              intermediate json file.
+#
+###############################################################################
+
+
+import io
+import json
+
+import generate_info_file
+
+
+def new_record():
+    """
+    Create an empty source file record
+
+    :return: Dictionary with 'functions' {name}=>line number,
+            'function_hits' {name}=>times entered, 'lines' {line}=>times
+            executed and 'branches' {(line, block, branch)}=>times taken or
+            None if the branch was never evaluated
+    """
+    return {'functions': {}, 'function_hits': {}, 'lines': {},
+            'branches': {}}
+
+
+def read_records(info_file):
+    """
+    Parse an info file
+
+    :param info_file: Handler to the info file, or any iterable of lines
+    :return: Generator of tuples of (source file name, record), see
+            'new_record'
+    """
+    source_file = None
+    record = new_record()
+    for line in info_file:
+        line = line.strip()
+        tag, _, value = line.partition(':')
+        if tag == 'SF':
+            source_file = value
+        elif tag == 'DA':
+            fields = value.split(',')
+            number = int(fields[0])
+            record['lines'][number] = \
+                record['lines'].get(number, 0) + int(fields[1])
+        elif tag == 'FN':
+            number, _, name = value.partition(',')
+            record['functions'][name] = int(number)
+        elif tag == 'FNDA':
+            count, _, name = value.partition(',')
+            record['function_hits'][name] = \
+                record['function_hits'].get(name, 0) + int(count)
+        elif tag == 'BRDA':
+            number, block, branch, taken = value.split(',')
+            key = (int(number), int(block), int(branch))
+            if taken != '-':
+                taken = int(taken) + (record['branches'].get(key) or 0)
+            elif key in record['branches']:
+                taken = record['branches'][key]
+            else:
+                taken = None
+            record['branches'][key] = taken
+        elif line == 'end_of_record':
+            if source_file is not None:
+                yield source_file, record
+            source_file = None
+            record = new_record()
+
+
+def merge_record(record, other):
+    """
+    Add the counts of a record into another one
+
+    :param record: Record to be updated
+    :param other: Record whose counts are added
+    """
+    record['functions'].update(other['functions'])
+    for name, count in other['function_hits'].items():
+        record['function_hits'][name] = \
+            record['function_hits'].get(name, 0) + count
+    for number, count in other['lines'].items():
+        record['lines'][number] = record['lines'].get(number, 0) + count
+    for key, taken in other['branches'].items():
+        if taken is None:
+            record['branches'].setdefault(key, None)
+        else:
+            record['branches'][key] = (record['branches'].get(key) or 0) + \
+                taken
+
+
+def record_totals(record):
+    """
+    Get the coverage totals of a record
+
+    :param record: Source file record
+    :return: Dictionary with the found/hit counts: 'lines', 'lines_hit',
+            'functions', 'functions_hit', 'branches', 'branches_hit'
+    """
+    return {
+        'lines': len(record['lines']),
+        'lines_hit': len([c for c in record['lines'].values() if c > 0]),
+        'functions': len(record['functions']),
+        'functions_hit': len([name for name in record['functions']
+                              if record['function_hits'].get(name, 0) > 0]),
+        'branches': len(record['branches']),
+        'branches_hit': len([t for t in record['branches'].values() if t])}
+
+
+def write_record(info_file, source_file, record):
+    """
+    Write a source file record in info file format
+
+    :param info_file: Handler to the info file
+    :param source_file: Source file name
+    :param record: Source file record
+    """
+    totals = record_totals(record)
+    info_file.write('TN:\nSF:{}\n'.format(source_file))
+    for name, number in sorted(record['functions'].items(),
+                               key=lambda f: (f[1], f[0])):
+        info_file.write('FN:{},{}\n'.format(number, name))
+    for name in sorted(record['functions']):
+        info_file.write('FNDA:{},{}\n'.format(
+            record['function_hits'].get(name, 0), name))
+    info_file.write('FNF:{}\nFNH:{}\n'.format(totals['functions'],
+                                              totals['functions_hit']))
+    for (number, block, branch), taken in sorted(record['branches'].items()):
+        info_file.write('BRDA:{},{},{},{}\n'.format(
+            number, block, branch, '-' if taken is None else taken))
+    info_file.write('BRF:{}\nBRH:{}\n'.format(totals['branches'],
+                                              totals['branches_hit']))
+    for number, count in sorted(record['lines'].items()):
+        info_file.write('DA:{},{}\n'.format(number, count))
+    info_file.write('LF:{}\nLH:{}\n'.format(totals['lines'],
+                                            totals['lines_hit']))
+    info_file.write('end_of_record\n')
+
+
+def load_records(info=None, json_path=None, workspace="",
+                 branch_engine='source', jobs=1):
+    """
+    Load the coverage records either from an info file or from an
+    intermediate json file
+
+    :param info: Info file name
+    :param json_path: Intermediate json file name, used if no info file
+    :param workspace: Folder with source files structure, for the
+                      intermediate json file
+    :param branch_engine: Branch engine for the intermediate json file
+    :param jobs: Number of processes converting the intermediate json file
+    :return: Dictionary with the source file name as key and its record
+            (see new_record) as value
+    """
+    records = {}
+    if info:
+        with open(info) as info_file:
+            for source_file, record in read_records(info_file):
+                if source_file in records:
+                    merge_record(records[source_file], record)
+                else:
+                    records[source_file] = record
+        return records
+    with open(json_path) as json_file:
+        json_data = json.load(json_file)
+    info_file = io.StringIO()
+    generate_info_file.generate_info(json_data, workspace, info_file,
+                                     io.StringIO(), branch_engine, jobs)
+    info_file.seek(0)
+    return dict(read_records(info_file))
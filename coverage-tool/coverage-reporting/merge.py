@@ -13,20 +13,167 @@
 #              If different .info files contain the same source code duplicated
 #              in different directories, we use the absolute paths of the
 #              first .info file.
+#              The info files are read one record at a time and merged
+#              natively, in parallel chunks, without temporary files.
+#              The json files are merged with all their coverage detail.
 #
 ###############################################################################
 
 
 import os
 import sys
+import json
 import argparse
+import multiprocessing
 from argparse import RawTextHelpFormatter
-import subprocess
-import json
 
+import lcov_info
+import intermediate_merge
+
+
+def translate_source_file(source_file, locations, local_workspace):
+    """
+    Translate a source file path from the test workspace to the local
+    workspace
+
+    :param source_file: Source file path in the info file
+    :param locations: Source locations (folders within the workspace) of the
+                      info file
+    :param local_workspace: Local workspace where source files reside
+    :return: Translated path, unchanged if it is not within any location
+    """
+    for location in locations:
+        if location in source_file:
+            parts = source_file.partition(location)
+            return local_workspace + "/" + location + parts[2]
+    return source_file
+
+
+def merge_chunk(task):
+    """
+    Merge a chunk of info files, reading them one record at a time
+
+    :param task: Tuple of (list of file groups, local workspace or None).
+                 Each file group is a dictionary with the 'info' file name
+                 and its source 'locations'.
+    :return: Dictionary with the source file name as key and the merged
+            record as value
+    """
+    file_groups, local_workspace = task
+    merged = {}
+    for file_group in file_groups:
+        with open(file_group["info"]) as info_file:
+            for source_file, record in lcov_info.read_records(info_file):
+                if local_workspace is not None:
+                    source_file = translate_source_file(
+                        source_file, file_group["locations"], local_workspace)
+                if source_file in merged:
+                    lcov_info.merge_record(merged[source_file], record)
+                else:
+                    merged[source_file] = record
+    return merged
+
+
+def merge_info_files(file_groups, output, local_workspace=None, jobs=1):
+    """
+    Merge info files adding up the DA, FNDA and BRDA counts of every source
+    file. The paths can be translated to a local workspace on the fly.
+
+    :param file_groups: List of file groups, see 'merge_chunk'
+    :param output: Name of the output info (merged) file
+    :param local_workspace: Optional local workspace where source files
+                            reside
+    :param jobs: Number of processes, each one merging a chunk of the files
+    """
+    jobs = max(1, min(jobs, len(file_groups)))
+    chunks = [(file_groups[i::jobs], local_workspace) for i in range(jobs)]
+    if jobs > 1:
+        with multiprocessing.Pool(jobs) as pool:
+            partials = pool.map(merge_chunk, chunks)
+    else:
+        partials = [merge_chunk(chunks[0])]
+    merged = partials[0]
+    for partial in partials[1:]:
+        for source_file, record in partial.items():
+            if source_file in merged:
+                lcov_info.merge_record(merged[source_file], record)
+            else:
+                merged[source_file] = record
+    with open(output, "w") as f:
+        for source_file in sorted(merged):
+            lcov_info.write_record(f, source_file, merged[source_file])
+
+
+def merge_json_files(json_files, output_json, jobs=1):
+    """
+    Merge intermediate json files, see intermediate_merge.py
+
+    :param json_files: List of intermediate json file names
+    :param output_json: Name of the output json (merged) file
+    :param jobs: Number of processes merging pairs of files
+    """
+    json_merged = intermediate_merge.merge_intermediate(json_files, jobs)
+    with open(output_json, 'w') as f:
+        json.dump(json_merged, f)
 
-# Define an argument parser using the argparse library
-parser = argparse.ArgumentParser(epilog="""Example of usage:
+
+def get_file_groups(info_files, json_files):
+    """
+    Check the input files and pair every info file with its json file
+
+    :param info_files: List of info file names
+    :param json_files: List of json file names or None
+    :return: List of file groups, i.e. dictionaries with the 'info' and
+            'json' file names and the source 'locations' from the json file
+    """
+    file_groups = []
+    info_files_to_merge = []
+    # Check if files exist
+    for file_name in info_files:
+        print("Merging '{}'".format(file_name))
+        if not os.path.isfile(file_name):
+            print('Error: file "' + file_name + '" not found.\n')
+            sys.exit(1)
+        if not file_name[-5:] == '.info':
+            print('Error: file "' + file_name +
+                  '" has wrong extension. Expected .info file.\n')
+            sys.exit(1)
+        if file_name in info_files_to_merge:
+            print("Error: Duplicated info file '{}'".format(file_name))
+            sys.exit(1)
+        info_files_to_merge.append(file_name)
+        file_group = {"info": file_name, "locations": [], "json": ""}
+        info_name = os.path.basename(file_name).split(".")[0]
+        if json_files:
+            json_name = [i for i in json_files
+                         if os.path.basename(i).split(".")[0] == info_name]
+            if not json_name:
+                print("Umatched json file name for '{}'".format(file_name))
+                sys.exit(1)
+            json_name = json_name.pop()
+            if not json_name[-5:] == '.json':
+                print('Error: file "' + json_name +
+                      '" has wrong extension. Expected .json file.\n')
+                sys.exit(1)
+            if not os.path.isfile(json_name):
+                print('Error: file "' + json_name + '" not found.\n')
+                sys.exit(1)
+            # Now we have to extract the location folders for each info
+            # this is needed if we want translation to local workspace
+            file_group["json"] = json_name
+            with open(json_name) as json_file:
+                json_data = json.load(json_file)
+            locations = []
+            for source in json_data["configuration"]["sources"]:
+                locations.append(source["LOCATION"])
+            file_group["locations"] = locations
+        file_groups.append(file_group)
+    return file_groups
+
+
+def main():
+    # Define an argument parser using the argparse library
+    parser = argparse.ArgumentParser(epilog="""Example of usage:
 python3 merge.py -a coverage_1.info -a coverage_2.info -o coverage_merge.info \
 -j input_file1.json -j input_file2.json -m merge_file.json
 
@@ -35,7 +182,9 @@ If metadata json files are defined then they must pair with their
 corresponding info file, i.e. have the same name.
 If a local workspace is defined then the paths in the info files will
 be translated from the original test workspace to the local workspace
-to enable the usage of LCOV, but the original files will be kept intact.
+while they are read, the original files are kept intact.
+The files are merged in parallel chunks (see "--jobs"), adding up the
+DA, FNDA and BRDA records of every source file, without LCOV.
 By default, the output file must be a new file.
 To overwrite an existing file, use the "--force" option.
 
@@ -44,137 +193,53 @@ If merging .info files from different projects, LCOV can be exploited directly
 using a command such as "lcov -rc lcov_branch_coverage=1 -a coverage_1.info \
 -a coverage_2.info -o coverage_merge.info."
 """, formatter_class=RawTextHelpFormatter)
-requiredNamed = parser.add_argument_group('required named arguments')
-requiredNamed.add_argument("-a", "--add-file",
-                           help="Input info file to be merged.",
-                           action='append', required=True)
-requiredNamed.add_argument("-o", "--output",
-                           help="Name of the output info (merged) file.",
-                           required=False)
-parser.add_argument("-j", "--json-file", action='append',
-                    help="Input json file to be merged.")
-parser.add_argument("-m", "--output-json",
-                    help="Name of the output json (merged) file.")
-parser.add_argument("--force", dest='force', action='store_true',
-                    help="force overwriting of output file.")
-parser.add_argument("--local-workspace", dest='local_workspace',
-                    help='Local workspace where source files reside.')
-
-options = parser.parse_args(sys.argv[1:])
-# At least two .info files are expected
-if len(options.add_file) < 2:
-    print('Error: too few input files.\n')
-    sys.exit(1)
-# The same number of info and json files expected
-if options.json_file:
-    if len(options.json_file) != len(options.add_file):
-        print('Umatched number of info and json files.\n')
+    requiredNamed = parser.add_argument_group('required named arguments')
+    requiredNamed.add_argument("-a", "--add-file",
+                               help="Input info file to be merged.",
+                               action='append', required=True)
+    requiredNamed.add_argument("-o", "--output",
+                               help="Name of the output info (merged) file.",
+                               required=False)
+    parser.add_argument("-j", "--json-file", action='append',
+                        help="Input json file to be merged.")
+    parser.add_argument("-m", "--output-json",
+                        help="Name of the output json (merged) file.")
+    parser.add_argument("--force", dest='force', action='store_true',
+                        help="force overwriting of output file.")
+    parser.add_argument("--local-workspace", dest='local_workspace',
+                        help='Local workspace where source files reside.')
+    parser.add_argument("--jobs", type=int, default=os.cpu_count() or 1,
+                        help="Number of processes merging chunks of the "
+                             "info files. Defaults to the number of CPUs.")
+
+    options = parser.parse_args(sys.argv[1:])
+    # At least two .info files are expected
+    if len(options.add_file) < 2:
+        print('Error: too few input files.\n')
         sys.exit(1)
-
-file_groups = []
-info_files_to_merge = []
-# Check if files exist
-for file_name in options.add_file:
-    print("Merging '{}'".format(file_name))
-    if not os.path.isfile(file_name):
-        print('Error: file "' + file_name + '" not found.\n')
-        sys.exit(1)
-    if not file_name[-5:] == '.info':
-        print('Error: file "' + file_name +
-              '" has wrong extension. Expected .info file.\n')
-        sys.exit(1)
-    if file_name in info_files_to_merge:
-        print("Error: Duplicated info file '{}'".format(file_name))
-        sys.exit(1)
-    info_files_to_merge.append(file_name)
-    file_group = {"info": file_name, "locations": [], "json": ""}
-    info_name = os.path.basename(file_name).split(".")[0]
+    # The same number of info and json files expected
     if options.json_file:
-        json_name = [i for i in options.json_file
-                     if os.path.basename(i).split(".")[0] == info_name]
-        if not json_name:
-            print("Umatched json file name for '{}'".format(file_name))
-            sys.exit(1)
-        json_name = json_name.pop()
-        if not json_name[-5:] == '.json':
-            print('Error: file "' + json_name +
-                  '" has wrong extension. Expected .json file.\n')
+        if len(options.json_file) != len(options.add_file):
+            print('Umatched number of info and json files.\n')
             sys.exit(1)
-        if not os.path.isfile(json_name):
-            print('Error: file "' + json_name + '" not found.\n')
-            sys.exit(1)
-        # Now we have to extract the location folders for each info
-        # this is needed if we want translation to local workspace
-        file_group["json"] = json_name
-        with open(json_name) as json_file:
-            json_data = json.load(json_file)
-        locations = []
-        for source in json_data["configuration"]["sources"]:
-            locations.append(source["LOCATION"])
-        file_group["locations"] = locations
-    file_groups.append(file_group)
-
-# Check the extension of the output file
-if not options.output[-5:] == '.info':
-    print('Error: file "' + options.output +
-          '" has wrong extension. Expected .info file.\n')
-    sys.exit(1)
-
-if options.local_workspace is not None:
-    # Translation from test to local workspace
-    i = 0
-    while i < len(info_files_to_merge):
-        info_file = open(info_files_to_merge[i], "r")
-        print("Translating workspace for '{}'...".format(
-              info_files_to_merge[i]))
-        info_lines = info_file.readlines()
-        info_file.close()
-        temp_file = 'temporary_' + str(i) + '.info'
-        parts = None
-        with open(temp_file, "w+") as f:
-            for line in info_lines:
-                if "SF" in line:
-                    for location in file_groups[i]["locations"]:
-                        if location in line:
-                            parts = line[3:].partition(location)
-                            line = line.replace(parts[0], options.local_workspace + "/")
-                            break
-                f.write(line)
-        info_files_to_merge[i] = temp_file  # Replace info file to be merged
-        i += 1
-
-# Merge json files
-if len(options.json_file):
-    json_merged_list = []
-    json_merged = {}
-    j = 0
-    while j < len(options.json_file):
-        json_file = options.json_file[j]
-        with open(json_file) as f:
-            data = json.load(f)
-        for source in data['configuration']['sources']:
-            if source not in json_merged_list:
-                json_merged_list.append(source)
-        j += 1
-    json_merged = {'configuration': {'sources': json_merged_list}}
-    with open(options.output_json, 'w') as f:
-        json.dump(json_merged, f)
 
+    file_groups = get_file_groups(options.add_file, options.json_file)
 
-# Exploit LCOV merging capabilities
-# Example of LCOV usage: lcov -rc lcov_branch_coverage=1 -a coverage_1.info \
-# -a coverage_2.info -o coverage_merge.info
-command = ['lcov', '-rc', 'lcov_branch_coverage=1']
+    # Check the extension of the output file
+    if not options.output[-5:] == '.info':
+        print('Error: file "' + options.output +
+              '" has wrong extension. Expected .info file.\n')
+        sys.exit(1)
+
+    # Merge json files
+    if options.json_file:
+        merge_json_files(options.json_file, options.output_json,
+                         options.jobs)
 
-for file_name in info_files_to_merge:
-    command.append('-a')
-    command.append(file_name)
-command.append('-o')
-command.append(options.output)
+    # Merge info files, translating from test to local workspace if needed
+    merge_info_files(file_groups, options.output, options.local_workspace,
+                     options.jobs)
 
-subprocess.call(command)
 
-# Delete the temporary files
-if options.local_workspace is not None:
-    for f in info_files_to_merge:
-        os.remove(f)
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,280 @@
+# !/usr/bin/env python
+###############################################################################
+# Copyright (c) 2020, ARM Limited and Contributors. All rights reserved.
+#
+# SPDX-License-Identifier: BSD-3-Clause
+###############################################################################
+
+###############################################################################
+# FILE: merge_driver.py
+#
+# DESCRIPTION: Merges the info and intermediate json files listed in a merge
+#              input json file and produces the coverage report, all in one
+#              process: the input json file is parsed once, the files are
+#              fetched, merged, the sources optionally cloned and the report
+#              generated. Files are fetched concurrently through a
+#              content-addressed cache, see artifact_fetcher.py.
+#
+###############################################################################
+
+import os
+import sys
+import json
+import shutil
+import argparse
+import concurrent.futures
+from argparse import RawTextHelpFormatter
+
+import merge
+import lcov_info
+import artifact_fetcher
+import html_report
+import clone_sources
+
+HELP_MESSAGE = """
+The script that merges the info data (code coverage) and json metadata
+(intermediate layer) needs as an input a json file with the following
+properties:
+files: array of objects that describe the type of file/project to be
+merged.
+  id: Unique identifier (project) associated to the info and
+      intermediate json files
+  config: Intermediate json file
+      type: Type of storage for the file. (http, file or bundle)
+      origin: Location (url, folder or file within the bundles) of the
+              file
+      compression: Optional, 'tar.xz' if the file is an archive to be
+                   extracted in the project folder
+  info:  Info file
+      type: Type of storage for the file. (http, file or bundle)
+      origin: Location (url, folder or file within the bundles) of the
+              file
+  bundles: Optional array of files (as config and info) to be fetched
+           before the config and info files
+Example:
+{ "files" : [
+                {
+                    "id": "<project 1>",
+                    "config":
+                        {
+                            "type": "http",
+                            "origin": "<URL of json file for project 1>"
+                        },
+                    "info":
+                        {
+                            "type": "http",
+                            "origin": "<URL of info file for project 1>"
+                        }
+                },
+                .
+                .
+                .
+        ]
+}
+"""
+
+
+def find_extracted(extracted, folder, extension):
+    """
+    Find the file with an extension among the files of an archive linked
+    into a project folder, as merge.sh did with 'find'
+
+    :param extracted: Folder where the archive was extracted
+    :param folder: Project folder where the extracted files were linked
+    :param extension: Extension of the file, e.g. 'info' or 'json'
+    :return: Absolute path of the file in the project folder
+    """
+    found = []
+    for root, _, files in os.walk(extracted):
+        found.extend(os.path.relpath(os.path.join(root, name), extracted)
+                     for name in files if name.endswith('.' + extension))
+    if len(found) != 1:
+        print("Error: expected one .{} file in the archive extracted into "
+              "'{}', found {}.... Aborting.".format(
+                  extension, folder, ", ".join(sorted(found)) or "none"))
+        sys.exit(1)
+    return os.path.abspath(os.path.join(folder, found[0]))
+
+
+def fetch_file(file_object, folder, cache, extension=None):
+    """
+    Get (download/copy) a file defined in the input json file through the
+    artifact cache
+
+    :param file_object: Dictionary with the 'type', 'origin' and optional
+                        'compression' of the file
+    :param folder: Project folder where to save the file
+    :param cache: ArtifactCache object
+    :param extension: Extension of the file expected in a compressed
+                      archive, e.g. 'info' or 'json'. None for bundles.
+    :return: Absolute path of the fetched file (of the file extracted with
+            the extension if it was compressed)
+    """
+    file_type = file_object['type']
+    origin = file_object['origin']
+    # Same filename as the project folder
+    file_name = os.path.join(folder, "{}.{}".format(
+        os.path.basename(folder),
+        extension or os.path.basename(origin).rsplit('.', 1)[-1]))
+    if file_type == 'http':
+        digest = cache.fetch_url(origin)
+    elif file_type == 'bundle':
+        # The file was unbundled before
+        file_name = os.path.join(folder, origin)
+        if not os.path.isfile(file_name):
+            print("Error: bundled file '{}' not found in '{}'.... "
+                  "Aborting.".format(origin, folder))
+            sys.exit(1)
+        return os.path.abspath(file_name)
+    elif file_type == 'file':
+        if origin.startswith('http'):
+            print("{} looks like 'http' rather than 'file' please "
+                  "check...".format(origin))
+            sys.exit(1)
+        digest = cache.fetch_path(origin)
+    else:
+        print("Error unsupported file type:{}.... Aborting.".format(
+            file_type))
+        sys.exit(1)
+    if file_object.get('compression') == 'tar.xz':
+        extracted = cache.extract(digest)
+        artifact_fetcher.link_tree(extracted, folder)
+        if extension is None:
+            return os.path.abspath(folder)
+        return find_extracted(extracted, folder, extension)
+    artifact_fetcher.link_file(cache.blob_path(digest), file_name)
+    return os.path.abspath(file_name)
+
+
+def fetch_project(project, input_folder, cache):
+    """
+    Get the bundles, the json file and the info file of a project
+
+    :return: Tuple of (info file, json file)
+    """
+    folder = os.path.join(input_folder, project['id'])
+    print("Geting files from project '{}' into '{}'...".format(
+        project['id'], input_folder))
+    os.makedirs(folder, exist_ok=True)
+    for bundle in project.get('bundles', []):
+        fetch_file(bundle, folder, cache)
+    config_file = fetch_file(project['config'], folder, cache, 'json')
+    info_file = fetch_file(project['info'], folder, cache, 'info')
+    return info_file, config_file
+
+
+def fetch_files(manifest, input_folder, cache_dir, fetch_jobs=8):
+    """
+    Get (download/copy) the info and json files of all the projects, in a
+    thread pool. Only the files that changed since they were cached are
+    downloaded or copied again.
+
+    :param manifest: Data of the input json file
+    :param input_folder: Folder to put the files to be merged, one folder
+                         per project
+    :param cache_dir: Folder of the artifact cache
+    :param fetch_jobs: Number of projects fetched at the same time
+    :return: List of tuples of (info file, json file), in the order of the
+            projects
+    """
+    shutil.rmtree(input_folder, ignore_errors=True)
+    os.makedirs(input_folder)
+    cache = artifact_fetcher.ArtifactCache(cache_dir)
+    with concurrent.futures.ThreadPoolExecutor(fetch_jobs) as executor:
+        return list(executor.map(
+            lambda project: fetch_project(project, input_folder, cache),
+            manifest['files']))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Merge info and intermediate json files and generate "
+                    "the coverage report", epilog=HELP_MESSAGE,
+        formatter_class=RawTextHelpFormatter)
+    parser.add_argument('-j', dest='merge_input_json_file', required=True,
+                        help='Input json file (info and intermediate json '
+                             'files to be merged).')
+    parser.add_argument('-l', dest='report_folder', default='./lcov_folder',
+                        help='Folder for branch coverage report. Defaults '
+                             'to ./lcov_folder.')
+    parser.add_argument('-i', dest='input_folder', default='./input_folder',
+                        help='Folder to copy/download info and json files. '
+                             'Defaults to ./input_folder.')
+    parser.add_argument('-w', dest='local_workspace',
+                        help='Local workspace folder for source files.')
+    parser.add_argument('-o', dest='output_coverage_file',
+                        default='./coverage_merge.info',
+                        help='Name of the merged info file. Defaults to '
+                             './coverage_merge.info')
+    parser.add_argument('-m', dest='output_json_file',
+                        default='./merge_output.json',
+                        help='Name of the merged metadata json file. '
+                             'Defaults to ./merge_output.json')
+    parser.add_argument('-c', dest='clone_sources', action='store_true',
+                        help='If it is set, sources from merged json files '
+                             'will be cloned/copied to local workspace '
+                             'folder.')
+    parser.add_argument('--cache-dir', default='./artifact_cache',
+                        help='Folder to cache the fetched files, so only '
+                             'the ones that changed are fetched again. '
+                             'Defaults to ./artifact_cache.')
+    parser.add_argument('--fetch-jobs', type=int, default=8,
+                        help='Number of projects whose files are fetched '
+                             '(and of sources cloned) at the same time. '
+                             'Defaults to 8.')
+    parser.add_argument('--mirror-dir',
+                        help='Folder for mirrors of the git sources, shared '
+                             'by all the merges. If set, only the commits '
+                             'needed are fetched and the sources are '
+                             'checked out as worktrees of the mirrors.')
+    parser.add_argument('--sparse', action='store_true',
+                        help='With -c, only check out the files of the git '
+                             'sources that are in the merged json file.')
+    parser.add_argument('--jobs', type=int, default=os.cpu_count() or 1,
+                        help='Number of processes merging files and '
+                             'rendering the report. Defaults to the number '
+                             'of CPUs.')
+    args = parser.parse_args()
+    local_workspace = None
+    if args.local_workspace:
+        if not os.path.isdir(args.local_workspace):
+            print("Local workspace folder '{}' not found".format(
+                args.local_workspace))
+            sys.exit(1)
+        local_workspace = os.path.abspath(args.local_workspace)
+    if local_workspace is None and args.clone_sources:
+        print("Need to define a local workspace folder to clone/copy "
+              "sources!")
+        sys.exit(1)
+    input_folder = os.path.abspath(args.input_folder)
+    output_coverage_file = os.path.abspath(args.output_coverage_file)
+    output_json_file = os.path.abspath(args.output_json_file)
+    with open(args.merge_input_json_file) as f:
+        manifest = json.load(f)
+
+    files = fetch_files(manifest, input_folder, args.cache_dir,
+                        args.fetch_jobs)
+    info_files = [info_file for info_file, _ in files]
+    json_files = [json_file for _, json_file in files]
+    file_groups = merge.get_file_groups(info_files, json_files)
+    merge.merge_json_files(json_files, output_json_file, args.jobs)
+    merge.merge_info_files(file_groups, output_coverage_file,
+                           local_workspace, args.jobs)
+    if args.clone_sources:
+        try:
+            r = clone_sources.CloneSources(output_json_file)
+            r.clone_repo(local_workspace, jobs=args.fetch_jobs,
+                         mirror_dir=args.mirror_dir, sparse=args.sparse,
+                         cache_dir=args.cache_dir)
+        except Exception as ex:
+            print(ex)
+    # Generate branch coverage report
+    records = lcov_info.load_records(info=output_coverage_file)
+    pages, rendered = html_report.html_report(
+        records, os.path.abspath(args.report_folder), args.jobs)
+    print("Report at '{}': {} pages, {} rendered".format(
+        args.report_folder, pages, rendered))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+# !/usr/bin/env python
+###############################################################################
+# Copyright (c) 2020, ARM Limited and Contributors. All rights reserved.
+#
+# SPDX-License-Identifier: BSD-3-Clause
+###############################################################################
+
+###############################################################################
+# FILE: minimize_traces.py
+#
+# DESCRIPTION: Selects the smallest subset of trace files (test runs) that
+#              preserves the total coverage recorded in an intermediate json
+#              file, using the trace file bitsets of the functions (and lines
+#              if recorded).
+#
+###############################################################################
+
+import sys
+import json
+import argparse
+
+
+def bits(bitset):
+    """
+    Get the positions of the bits set in a bitset
+
+    :param bitset: Bitset as an integer
+    :return: Generator of bit positions
+    """
+    position = 0
+    while bitset:
+        if bitset & 1:
+            yield position
+        bitset >>= 1
+        position += 1
+
+
+def coverage_by_trace(json_data, use_lines=False):
+    """
+    Invert the trace bitsets of the intermediate json file
+
+    :param json_data: Intermediate json data
+    :param use_lines: If True the lines with trace bitsets are also part of
+                      the coverage to be preserved
+    :return: List with the set of covered items (functions and lines) for
+            every trace file, indexed by the trace file bit position
+    """
+    trace_files = json_data['configuration'].get('trace_files', [])
+    covered = [set() for _ in trace_files]
+    for source_file, source_data in json_data['source_files'].items():
+        items = [(("function", name), data) for name, data in
+                 source_data['functions'].items()]
+        if use_lines:
+            items.extend((("line", line), data) for line, data in
+                         source_data['lines'].items())
+        for item, data in items:
+            if 'traces' not in data:
+                continue
+            for position in bits(int(data['traces'], 16)):
+                covered[position].add((source_file,) + item)
+    return covered
+
+
+def greedy_set_cover(covered):
+    """
+    Greedy approximation to the minimum set cover: repeatedly pick the trace
+    that covers most of the not yet covered items
+
+    :param covered: List with the set of covered items of every trace
+    :return: List of the indexes of the selected traces in selection order
+            and the number of new items each of them covers
+    """
+    pending = set().union(*covered) if covered else set()
+    selection = []
+    while pending:
+        best = max(range(len(covered)),
+                   key=lambda i: (len(covered[i] & pending), -i))
+        new_items = covered[best] & pending
+        selection.append((best, len(new_items)))
+        pending -= new_items
+    return selection
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Select the smallest subset of trace files that "
+                    "preserves the coverage of an intermediate json file")
+    parser.add_argument('--json', metavar='PATH',
+                        help='Intermediate json file name',
+                        required=True)
+    parser.add_argument('--lines', action='store_true',
+                        help='Preserve line coverage as well (needs '
+                             '"line_attribution" in the configuration)')
+    parser.add_argument('--output-json', metavar='PATH',
+                        help='Optional file to write the selected trace '
+                             'files as a json list')
+    args = parser.parse_args()
+    with open(args.json) as json_file:
+        json_data = json.load(json_file)
+    trace_files = json_data['configuration'].get('trace_files', [])
+    if not trace_files:
+        print("Error: '{}' has no trace file attribution".format(args.json))
+        sys.exit(1)
+    covered = coverage_by_trace(json_data, args.lines)
+    selection = greedy_set_cover(covered)
+    total = sum(new_items for _, new_items in selection)
+    print("{} out of {} trace files preserve the coverage of {} "
+          "items:".format(len(selection), len(trace_files), total))
+    for index, new_items in selection:
+        print("  {} (+{})".format(trace_files[index], new_items))
+    if args.output_json:
+        with open(args.output_json, 'w') as f:
+            json.dump([trace_files[index] for index, _ in selection], f,
+                      indent=4)
+
+
+if __name__ == '__main__':
+    main()
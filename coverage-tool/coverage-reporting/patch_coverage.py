@@ -0,0 +1,314 @@
+# !/usr/bin/env python
+###############################################################################
+# Copyright (c) 2020, ARM Limited and Contributors. All rights reserved.
+#
+# SPDX-License-Identifier: BSD-3-Clause
+###############################################################################
+
+###############################################################################
+# FILE: patch_coverage.py
+#
+# DESCRIPTION: Reports the coverage of the lines changed by a git diff range
+#              using one or more intermediate json files or trace files, i.e.
+#              whether every changed line is covered and which trace sets hit
+#              it. The lines of an intermediate json file are indexed in a
+#              SQLite file by (source file, line) the first time, so later
+#              queries only read the lines of the changed files.
+#
+###############################################################################
+
+import os
+import re
+import sys
+import json
+import sqlite3
+import argparse
+import subprocess
+
+import intermediate_layer
+
+HUNK_PATTERN = re.compile(r"^@@ -[0-9,]+ \+([0-9]+)(?:,([0-9]+))? @@")
+
+INDEX_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS lines (
+    source_file TEXT NOT NULL,
+    basename TEXT NOT NULL,
+    line INTEGER NOT NULL,
+    covered INTEGER NOT NULL,
+    traces TEXT
+);
+CREATE INDEX IF NOT EXISTS lines_basename ON lines (basename);
+"""
+
+
+def changed_lines(repo, diff_range):
+    """
+    Get the lines added or modified by a git diff range
+
+    :param repo: Path to the git repository
+    :param diff_range: Range of commits as accepted by 'git diff'
+    :return: Dictionary with the changed file path (relative to the
+            repository) as key and the sorted list of changed line numbers
+            (in the new version of the file) as value
+    """
+    # Explicit prefixes, whatever diff.noprefix or diff.mnemonicPrefix say
+    out = subprocess.check_output(
+        ['git', '-C', repo, 'diff', '--unified=0', '--no-color',
+         '--no-ext-diff', '--src-prefix=a/', '--dst-prefix=b/',
+         diff_range]).decode('utf8', errors='replace')
+    changes = {}
+    current = None
+    for line in out.split('\n'):
+        if line.startswith('+++ '):
+            path = line[4:]
+            current = None if path == '/dev/null' else \
+                path.rstrip('\t')[len('b/'):]
+            if current is not None:
+                changes.setdefault(current, [])
+            continue
+        match = HUNK_PATTERN.match(line)
+        if match and current is not None:
+            start = int(match.group(1))
+            count = 1 if match.group(2) is None else int(match.group(2))
+            changes[current].extend(range(start, start + count))
+    return {path: sorted(lines) for path, lines in changes.items() if lines}
+
+
+def match_source_files(source_files, paths):
+    """
+    Pair the changed file paths with the source files of an intermediate
+    layer. The source files are relative to the workspace (or absolute) so
+    a source file matches a changed path if it ends with it.
+
+    :param source_files: Source file names in the intermediate layer
+    :param paths: Changed file paths relative to the git repository
+    :return: Dictionary with the source file name as key and the changed
+            path as value
+    """
+    by_basename = {}
+    for path in paths:
+        by_basename.setdefault(os.path.basename(path), []).append(path)
+    matches = {}
+    for source_file in source_files:
+        for path in by_basename.get(os.path.basename(source_file), []):
+            if source_file == path or source_file.endswith('/' + path):
+                matches[source_file] = path
+                break
+    return matches
+
+
+def add_line(index, key, covered, traces, name, trace_files):
+    """
+    Add the trace sets that hit a line to the coverage index
+
+    :param index: Coverage index, see 'build_index'
+    :param key: Tuple of (changed path, line number)
+    :param covered: True if the line was executed
+    :param traces: Hexadecimal bitset of the trace files that hit the line,
+                   or None if the layer has no line attribution
+    :param name: Name of the trace set
+    :param trace_files: Trace files of the trace set, by bit position
+    """
+    hit_by = index.setdefault(key, set())
+    if not covered:
+        return
+    if traces is not None:
+        traces = int(traces, 16)
+        hit_by.update("{}:{}".format(name, trace_file) for
+                      position, trace_file in enumerate(trace_files)
+                      if traces >> position & 1)
+    else:
+        hit_by.add(name)
+
+
+def build_index(json_data, name, paths, index=None):
+    """
+    Add the lines of the changed files in an intermediate layer to an index
+    keyed by (source file, line)
+
+    :param json_data: Intermediate json data
+    :param name: Name of the trace set of the intermediate layer
+    :param paths: Changed file paths relative to the git repository
+    :param index: Optional index to be updated
+    :return: Dictionary with (changed path, line number) as key and the set
+            of trace sets that hit the line as value (an empty set for lines
+            with code that were not executed)
+    """
+    if index is None:
+        index = {}
+    trace_files = json_data['configuration'].get('trace_files', [])
+    source_files = json_data['source_files']
+    for source_file, path in match_source_files(source_files, paths).items():
+        for line, line_data in source_files[source_file]['lines'].items():
+            add_line(index, (path, int(line)), line_data['covered'],
+                     line_data.get('traces'), name, trace_files)
+    return index
+
+
+def open_line_index(json_name, index_name=None):
+    """
+    Open the line index of an intermediate json file, (re)building it if
+    the json file changed since it was built. Only building the index loads
+    the json file.
+
+    :param json_name: Intermediate json file name
+    :param index_name: Index file name. Defaults to the json file name with
+                       '.lines.sqlite' appended
+    :return: SQLite connection to the index
+    """
+    if index_name is None:
+        index_name = json_name + '.lines.sqlite'
+    stat = os.stat(json_name)
+    signature = "{}:{}".format(stat.st_size, stat.st_mtime_ns)
+    connection = sqlite3.connect(index_name)
+    connection.executescript(INDEX_SCHEMA)
+    row = connection.execute(
+        "SELECT value FROM meta WHERE key = 'signature'").fetchone()
+    if row is not None and row[0] == signature:
+        return connection
+    with open(json_name) as json_file:
+        json_data = json.load(json_file)
+    with connection:
+        connection.execute("DELETE FROM lines")
+        connection.execute("DELETE FROM meta")
+        for source_file, source_data in json_data['source_files'].items():
+            connection.executemany(
+                "INSERT INTO lines VALUES (?, ?, ?, ?, ?)",
+                [(source_file, os.path.basename(source_file), int(line),
+                  1 if line_data['covered'] else 0, line_data.get('traces'))
+                 for line, line_data in source_data['lines'].items()])
+        connection.executemany(
+            "INSERT INTO meta VALUES (?, ?)",
+            [('signature', signature),
+             ('trace_files', json.dumps(
+                 json_data['configuration'].get('trace_files', [])))])
+    return connection
+
+
+def query_index(connection, name, paths, index=None):
+    """
+    Add the lines of the changed files in a line index to the coverage
+    index, see 'build_index'
+
+    :param connection: Line index, see 'open_line_index'
+    :param name: Name of the trace set of the intermediate layer
+    :param paths: Changed file paths relative to the git repository
+    :param index: Optional index to be updated
+    :return: Coverage index
+    """
+    if index is None:
+        index = {}
+    trace_files = json.loads(connection.execute(
+        "SELECT value FROM meta WHERE key = 'trace_files'").fetchone()[0])
+    rows = {}
+    for basename in set(os.path.basename(path) for path in paths):
+        for row in connection.execute(
+                "SELECT source_file, line, covered, traces FROM lines "
+                "WHERE basename = ?", (basename,)):
+            rows.setdefault(row[0], []).append(row[1:])
+    for source_file, path in match_source_files(rows, paths).items():
+        for line, covered, traces in rows[source_file]:
+            add_line(index, (path, line), covered, traces, name, trace_files)
+    return index
+
+
+def patch_coverage(changes, index):
+    """
+    Join the changed lines with the coverage index
+
+    :param changes: Changed lines as returned by 'changed_lines'
+    :param index: Coverage index as returned by 'build_index'
+    :return: List of dictionaries with 'file', 'line', 'covered' and
+            'hit_by' for every changed line with code
+    """
+    report = []
+    for path in sorted(changes):
+        for line in changes[path]:
+            if (path, line) not in index:
+                continue  # No code generated for the line
+            hit_by = sorted(index[(path, line)])
+            report.append({'file': path, 'line': line,
+                           'covered': bool(hit_by), 'hit_by': hit_by})
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Report the coverage of the lines changed by a git "
+                    "diff range")
+    parser.add_argument('--range', dest='diff_range', required=True,
+                        help='Git diff range, e.g. HEAD~1..HEAD')
+    parser.add_argument('--repo', metavar='PATH', default='.',
+                        help='Git repository of the sources. Defaults to '
+                             'current folder')
+    parser.add_argument('--json', metavar='PATH', action='append',
+                        default=[],
+                        help='Intermediate json file, can be repeated. Each '
+                             'file is a trace set')
+    parser.add_argument('--config-json', metavar='PATH', action='append',
+                        default=[],
+                        help='JSON configuration file of the trace files, '
+                             'see intermediate_layer.py, can be repeated. '
+                             'Each file is a trace set')
+    parser.add_argument('--local-workspace', metavar='PATH', default="",
+                        help='Local workspace folder of the sources, for '
+                             '--config-json')
+    parser.add_argument('--index-dir', metavar='PATH',
+                        help='Folder for the line indexes of the '
+                             'intermediate json files. Defaults to the '
+                             'folder of each json file')
+    parser.add_argument('--format', choices=['text', 'json'], default='text',
+                        help='Output format. Defaults to text')
+    parser.add_argument('--fail-under', metavar='PERCENT', type=float,
+                        help='Exit with error if the patch coverage is '
+                             'below this percentage')
+    args = parser.parse_args()
+    if not args.json and not args.config_json:
+        parser.error("at least one --json or --config-json is required")
+    changes = changed_lines(args.repo, args.diff_range)
+    index = {}
+    for json_name in args.json:
+        index_name = None
+        if args.index_dir:
+            os.makedirs(args.index_dir, exist_ok=True)
+            index_name = os.path.join(
+                args.index_dir, os.path.basename(json_name) + '.lines.sqlite')
+        connection = open_line_index(json_name, index_name)
+        try:
+            query_index(connection, os.path.basename(json_name), changes,
+                        index)
+        finally:
+            connection.close()
+    for config_name in args.config_json:
+        # The intermediate layer of the trace files is built in memory
+        with open(config_name) as config_file:
+            config = json.load(config_file)
+        intermediate_layer.setup_tools(config, args.local_workspace)
+        json_data = intermediate_layer.PostProcessCC(
+            config, args.local_workspace).process(write_json=False)
+        build_index(json_data, os.path.basename(config_name), changes, index)
+    report = patch_coverage(changes, index)
+    covered = len([r for r in report if r['covered']])
+    percent = 100.0 * covered / len(report) if report else 100.0
+    if args.format == 'json':
+        print(json.dumps({'lines': report, 'covered': covered,
+                          'total': len(report), 'percent': percent},
+                         indent=4))
+    else:
+        for r in report:
+            print("{}:{}: {}{}".format(
+                r['file'], r['line'],
+                'covered' if r['covered'] else 'NOT covered',
+                ' by ' + ', '.join(r['hit_by']) if r['hit_by'] else ''))
+        print("Patch coverage: {}/{} lines ({:.1f}%)".format(
+            covered, len(report), percent))
+    if args.fail_under is not None and percent < args.fail_under:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
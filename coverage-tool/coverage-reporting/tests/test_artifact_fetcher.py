@@ -0,0 +1,234 @@
+# !/usr/bin/env python
+###############################################################################
+# Copyright (c) 2020, ARM Limited and Contributors. All rights reserved.
+#
+# SPDX-License-Identifier: BSD-3-Clause
+###############################################################################
+
+###############################################################################
+# FILE: test_artifact_fetcher.py
+#
+# DESCRIPTION: Tests of the artifact cache against a local http server:
+#              download, revalidation with the ETag, reuse of the cached
+#              files and extraction of compressed archives.
+#              Run from the coverage-reporting folder:
+#              python3 -m unittest discover tests
+#
+###############################################################################
+
+import io
+import os
+import sys
+import shutil
+import hashlib
+import tarfile
+import tempfile
+import threading
+import unittest
+import http.server
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+import artifact_fetcher  # noqa: E402
+
+
+def tar_xz(files):
+    """
+    :param files: Dictionary of member name => content (bytes)
+    :return: Content of a tar.xz archive with the files
+    """
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode='w:xz') as archive:
+        for name, content in sorted(files.items()):
+            info = tarfile.TarInfo(name)
+            info.size = len(content)
+            archive.addfile(info, io.BytesIO(content))
+    return buffer.getvalue()
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    """Serves the files of the server with an ETag, answering 304 if the
+    ETag of the request matches"""
+
+    def do_GET(self):
+        content = self.server.files.get(self.path)
+        if content is None:
+            self.send_error(404)
+            return
+        etag = '"{}"'.format(hashlib.sha256(content).hexdigest())
+        if self.headers.get('If-None-Match') == etag:
+            self.server.requests.append((self.path, 304))
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+        self.server.requests.append((self.path, 200))
+        self.send_response(200)
+        self.send_header('ETag', etag)
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestArtifactCache(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = http.server.HTTPServer(('127.0.0.1', 0), Handler)
+        cls.server.files = {}
+        cls.server.requests = []
+        cls.thread = threading.Thread(target=cls.server.serve_forever)
+        cls.thread.daemon = True
+        cls.thread.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        self.server.files.clear()
+        del self.server.requests[:]
+        self.cache_dir = tempfile.mkdtemp()
+        self.cache = artifact_fetcher.ArtifactCache(self.cache_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def url(self, path):
+        return "http://127.0.0.1:{}{}".format(self.server.server_port, path)
+
+    def read_blob(self, digest):
+        with open(self.cache.blob_path(digest), 'rb') as f:
+            return f.read()
+
+    def test_fetch_and_revalidate(self):
+        self.server.files['/a.info'] = b"SF:a.c\nend_of_record\n"
+        digest = self.cache.fetch_url(self.url('/a.info'))
+        self.assertEqual(self.read_blob(digest), b"SF:a.c\nend_of_record\n")
+        # Revalidated with the ETag, not downloaded again
+        self.assertEqual(self.cache.fetch_url(self.url('/a.info')), digest)
+        self.assertEqual(self.server.requests,
+                         [('/a.info', 200), ('/a.info', 304)])
+
+    def test_index_reused_by_new_cache(self):
+        self.server.files['/a.json'] = b"{}"
+        digest = self.cache.fetch_url(self.url('/a.json'))
+        cache = artifact_fetcher.ArtifactCache(self.cache_dir)
+        self.assertEqual(cache.fetch_url(self.url('/a.json')), digest)
+        self.assertEqual(self.server.requests[-1], ('/a.json', 304))
+
+    def test_changed_file_downloaded_again(self):
+        self.server.files['/a.info'] = b"old"
+        old = self.cache.fetch_url(self.url('/a.info'))
+        self.server.files['/a.info'] = b"new"
+        new = self.cache.fetch_url(self.url('/a.info'))
+        self.assertNotEqual(old, new)
+        self.assertEqual(self.read_blob(new), b"new")
+        self.assertEqual(self.server.requests,
+                         [('/a.info', 200), ('/a.info', 200)])
+
+    def test_checksum(self):
+        content = b"content"
+        checksum = hashlib.sha256(content).hexdigest()
+        self.server.files['/f'] = content
+        self.assertEqual(self.cache.fetch_url(self.url('/f'), checksum),
+                         checksum)
+        # Already cached, not even revalidated
+        self.assertEqual(self.cache.fetch_url(self.url('/f'), checksum),
+                         checksum)
+        self.assertEqual(len(self.server.requests), 1)
+        self.server.files['/g'] = b"other"
+        with self.assertRaises(Exception):
+            self.cache.fetch_url(self.url('/g'), checksum="0" * 64)
+
+    def test_checksum_not_trusted_from_revalidation(self):
+        self.server.files['/s.tar.gz'] = b"old"
+        old = self.cache.fetch_url(self.url('/s.tar.gz'))
+        # Downloaded again without conditional headers, not answered 304
+        with self.assertRaises(Exception):
+            self.cache.fetch_url(self.url('/s.tar.gz'),
+                                 hashlib.sha256(b"new").hexdigest())
+        self.assertEqual(self.server.requests,
+                         [('/s.tar.gz', 200), ('/s.tar.gz', 200)])
+        self.server.files['/s.tar.gz'] = b"new"
+        new = self.cache.fetch_url(self.url('/s.tar.gz'),
+                                   hashlib.sha256(b"new").hexdigest())
+        self.assertNotEqual(old, new)
+        self.assertEqual(self.read_blob(new), b"new")
+
+    def test_hashing_reader(self):
+        reader = artifact_fetcher.HashingReader(io.BytesIO(b"content"))
+        self.assertEqual(reader.read(3), b"con")
+        self.assertEqual(reader.hexdigest(),
+                         hashlib.sha256(b"content").hexdigest())
+
+    def test_fetch_path(self):
+        source = os.path.join(self.cache_dir, "local.info")
+        with open(source, 'wb') as f:
+            f.write(b"local")
+        digest = self.cache.fetch_path(source)
+        self.assertEqual(self.cache.fetch_path(source), digest)
+        self.assertEqual(self.read_blob(digest), b"local")
+
+    def test_compressed_artifact(self):
+        files = {'p/p.info': b"SF:a.c\nend_of_record\n", 'p/p.json': b"{}"}
+        self.server.files['/p.tar.xz'] = tar_xz(files)
+        digest = self.cache.fetch_url(self.url('/p.tar.xz'))
+        folder = self.cache.extract(digest)
+        for name, content in files.items():
+            with open(os.path.join(folder, name), 'rb') as f:
+                self.assertEqual(f.read(), content)
+        # Revalidated and extracted only once
+        self.assertEqual(self.cache.fetch_url(self.url('/p.tar.xz')), digest)
+        marker = os.path.join(folder, "marker")
+        open(marker, 'w').close()
+        self.assertEqual(self.cache.extract(digest), folder)
+        self.assertTrue(os.path.isfile(marker))
+        self.assertEqual(self.server.requests,
+                         [('/p.tar.xz', 200), ('/p.tar.xz', 304)])
+        # Linked into a project folder
+        project = os.path.join(self.cache_dir, "project")
+        artifact_fetcher.link_tree(folder, project)
+        self.assertTrue(os.path.isfile(os.path.join(project, 'p/p.json')))
+
+    def test_unsafe_archive_rejected(self):
+        self.server.files['/bad.tar.xz'] = tar_xz({'../evil': b"evil"})
+        digest = self.cache.fetch_url(self.url('/bad.tar.xz'))
+        with self.assertRaises(Exception):
+            self.cache.extract(digest)
+        self.assertFalse(os.path.isdir(os.path.join(
+            self.cache.extracted_dir, digest)))
+        self.assertFalse(os.path.exists(os.path.join(
+            self.cache.extracted_dir, 'evil')))
+
+    def test_absolute_member_not_extracted_outside(self):
+        outside = os.path.join(self.cache_dir, "outside", "evil")
+        self.server.files['/abs.tar.xz'] = tar_xz({outside: b"evil"})
+        digest = self.cache.fetch_url(self.url('/abs.tar.xz'))
+        try:
+            # Either rejected or extracted within the folder
+            self.cache.extract(digest)
+        except Exception:
+            pass
+        self.assertFalse(os.path.exists(outside))
+
+    def test_safe_members(self):
+        buffer = io.BytesIO()
+        with tarfile.open(fileobj=buffer, mode='w') as archive:
+            info = tarfile.TarInfo('link')
+            info.type = tarfile.SYMTYPE
+            info.linkname = '/etc/passwd'
+            archive.addfile(info)
+        buffer.seek(0)
+        with tarfile.open(fileobj=buffer, mode='r|*') as archive:
+            with self.assertRaises(Exception):
+                list(artifact_fetcher.safe_members(archive))
+
+
+if __name__ == '__main__':
+    unittest.main()
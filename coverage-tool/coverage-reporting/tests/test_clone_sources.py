@@ -0,0 +1,201 @@
+# !/usr/bin/env python
+###############################################################################
+# Copyright (c) 2020, ARM Limited and Contributors. All rights reserved.
+#
+# SPDX-License-Identifier: BSD-3-Clause
+###############################################################################
+
+###############################################################################
+# FILE: test_clone_sources.py
+#
+# DESCRIPTION: Tests of the git mirrors of clone_sources.py against local
+#              bare repositories: first mirror clone, commits already
+#              fetched and full and sparse worktrees.
+#              Run from the coverage-reporting folder:
+#              python3 -m unittest discover tests
+#
+###############################################################################
+
+import io
+import os
+import sys
+import json
+import shutil
+import hashlib
+import tarfile
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+import clone_sources  # noqa: E402
+import artifact_fetcher  # noqa: E402
+from clone_sources import call_git  # noqa: E402
+
+
+def commit_files(work, files, message):
+    """
+    Write files in a repository and commit them
+
+    :param work: Folder of the repository
+    :param files: Dictionary of file path => content
+    :param message: Commit message
+    :return: Commit id
+    """
+    for path, content in files.items():
+        os.makedirs(os.path.dirname(os.path.join(work, path)), exist_ok=True)
+        with open(os.path.join(work, path), 'w') as f:
+            f.write(content)
+    call_git(["add", "-A"], work)
+    call_git(["-c", "user.name=test", "-c", "user.email=test@example.com",
+              "commit", "-q", "-m", message], work)
+    return call_git(["rev-parse", "HEAD"], work)
+
+
+class TestMirrorCache(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        work = os.path.join(self.folder, "work")
+        call_git(["init", "-q", work])
+        self.first = commit_files(work, {"src/a.c": "a1\n", "src/b.c": "b1\n",
+                                         "README": "readme\n"}, "first")
+        self.second = commit_files(work, {"src/a.c": "a2\n"}, "second")
+        self.branch = call_git(["rev-parse", "--abbrev-ref", "HEAD"], work)
+        self.remote = os.path.join(self.folder, "remote.git")
+        call_git(["clone", "-q", "--bare", work, self.remote])
+        self.url = "file://" + self.remote
+        self.mirrors = clone_sources.MirrorCache(
+            os.path.join(self.folder, "mirrors"))
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def checkout(self, name, commit, paths=None, refspec=""):
+        output_loc = os.path.join(self.folder, name)
+        self.mirrors.worktree(self.url, commit, refspec, output_loc, paths)
+        return output_loc
+
+    def read(self, output_loc, path):
+        with open(os.path.join(output_loc, path)) as f:
+            return f.read()
+
+    def test_first_clone(self):
+        output_loc = self.checkout("ws1", self.second)
+        self.assertTrue(os.path.isdir(self.mirrors.mirror_path(self.url)))
+        self.assertEqual(call_git(["rev-parse", "HEAD"], output_loc),
+                         self.second)
+        self.assertEqual(self.read(output_loc, "src/a.c"), "a2\n")
+        self.assertEqual(self.read(output_loc, "src/b.c"), "b1\n")
+
+    def test_older_commit(self):
+        self.checkout("ws1", self.second)
+        output_loc = self.checkout("ws2", self.first)
+        self.assertEqual(self.read(output_loc, "src/a.c"), "a1\n")
+
+    def test_commit_already_fetched(self):
+        self.checkout("ws1", self.second)
+        # Not fetched again: it would fail without the remote
+        shutil.move(self.remote, self.remote + ".moved")
+        output_loc = self.checkout("ws2", self.second)
+        self.assertEqual(self.read(output_loc, "src/a.c"), "a2\n")
+        # Both worktrees share the mirror
+        worktrees = call_git(["worktree", "list"],
+                             self.mirrors.mirror_path(self.url))
+        self.assertIn(os.path.join(self.folder, "ws1"), worktrees)
+        self.assertIn(os.path.join(self.folder, "ws2"), worktrees)
+
+    def test_removed_worktree_checked_out_again(self):
+        output_loc = self.checkout("ws1", self.second)
+        shutil.rmtree(output_loc)
+        output_loc = self.checkout("ws1", self.second)
+        self.assertEqual(self.read(output_loc, "src/a.c"), "a2\n")
+
+    def test_refspec_without_commit(self):
+        output_loc = self.checkout("ws1", "", refspec=self.branch)
+        self.assertEqual(call_git(["rev-parse", "HEAD"], output_loc),
+                         self.second)
+
+    def test_sparse_worktree(self):
+        output_loc = self.checkout("ws1", self.second, paths=["src/a.c"])
+        self.assertEqual(self.read(output_loc, "src/a.c"), "a2\n")
+        self.assertFalse(os.path.exists(os.path.join(output_loc, "src/b.c")))
+        self.assertFalse(os.path.exists(os.path.join(output_loc, "README")))
+        # A full worktree of the same mirror is not affected
+        output_loc = self.checkout("ws2", self.second)
+        self.assertTrue(os.path.isfile(os.path.join(output_loc, "src/b.c")))
+
+    def test_sparse_paths(self):
+        json_data = {"source_files": {"tf-a/src/a.c": {}, "tf-a/README": {},
+                                      "other/c.c": {}}}
+        self.assertEqual(clone_sources.sparse_paths(json_data, "tf-a"),
+                         ["README", "src/a.c"])
+        self.assertEqual(clone_sources.sparse_paths(json_data, "/tf-a/"),
+                         ["README", "src/a.c"])
+
+    def test_sparse_paths_absolute(self):
+        json_data = {"source_files": {"/home/ws/tf-a/src/a.c": {},
+                                      "/home/ws/other/c.c": {}}}
+        self.assertEqual(clone_sources.sparse_paths(json_data, "tf-a"),
+                         ["src/a.c"])
+        # Full checkout rather than an empty one
+        self.assertIsNone(clone_sources.sparse_paths(json_data, "tf-m"))
+
+
+class TestHttpSource(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.archive = os.path.join(self.folder, "src.tar.gz")
+        with tarfile.open(self.archive, 'w:gz') as tar_file:
+            info = tarfile.TarInfo("src/a.c")
+            info.size = 3
+            tar_file.addfile(info, io.BytesIO(b"a1\n"))
+        self.source = {"type": "http", "URL": "file://" + self.archive,
+                       "LOCATION": "ext", "COMPRESSION": "tar.gz"}
+        self.json_file = os.path.join(self.folder, "config.json")
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def clone(self, workspace, cache=None):
+        with open(self.json_file, 'w') as f:
+            json.dump({"configuration": {"sources": [self.source]}}, f)
+        clone = clone_sources.CloneSources(self.json_file)
+        clone.clone_source(self.source, os.path.join(self.folder, workspace),
+                           cache=cache)
+        return os.path.join(self.folder, workspace, "ext", "src", "a.c")
+
+    def test_workspace_edits_do_not_modify_cache(self):
+        cache = artifact_fetcher.ArtifactCache(
+            os.path.join(self.folder, "cache"))
+        source_file = self.clone("ws1", cache)
+        with open(source_file, 'a') as f:
+            f.write("edited\n")
+        with open(self.clone("ws2", cache)) as f:
+            self.assertEqual(f.read(), "a1\n")
+
+    def test_without_cache(self):
+        with open(self.clone("ws1")) as f:
+            self.assertEqual(f.read(), "a1\n")
+
+    def test_checksum(self):
+        with open(self.archive, 'rb') as f:
+            checksum = hashlib.sha256(f.read()).hexdigest()
+        cache = artifact_fetcher.ArtifactCache(
+            os.path.join(self.folder, "cache"))
+        for workspace, source_cache in (("ws1", None), ("ws2", cache)):
+            self.source["CHECKSUM"] = checksum
+            with open(self.clone(workspace, source_cache)) as f:
+                self.assertEqual(f.read(), "a1\n")
+            self.source["CHECKSUM"] = "0" * 64
+            with self.assertRaises(Exception):
+                self.clone(workspace + "-bad", source_cache)
+            # Nothing extracted into the workspace
+            self.assertEqual(os.listdir(os.path.join(
+                self.folder, workspace + "-bad", "ext")), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,443 @@
+#!/usr/bin/env python3
+
+__copyright__ = """
+/*
+ * Copyright (c) 2020, Arm Limited. All rights reserved.
+ *
+ * SPDX-License-Identifier: BSD-3-Clause
+ *
+ */
+ """
+
+""" async_metrics_server.py:
+
+    Asyncio version of the broker component (quality_metrics_server.py),
+    for many concurrent uploaders. It has the same API: POST /auth to get
+    an authorization token and POST / with the 'Authorization: JWT <token>'
+    header to push the data, or POST /batch to push newline-delimited
+    documents. The requests are parsed and validated in a
+    thread pool, off the event loop, and the valid data is placed in an
+    asyncio FIFO per database, from which it is written to the database in
+    batches (converted in a thread pool too).
+
+"""
+
+from aiohttp import web
+from pprint import pformat
+from db_manager import dbManager
+from data_validator import DataValidator
+from logging.handlers import RotatingFileHandler
+
+import hmac
+import json
+import time
+import asyncio
+import logging
+import argparse
+import datetime
+import functools
+import concurrent.futures
+
+import jwt
+
+import constants
+import credentials
+
+username_table = {u.username: u for u in credentials.users}
+userid_table = {u.id: u for u in credentials.users}
+
+JWT_ALGORITHM = 'HS256'
+JWT_LEEWAY = 10
+JWT_AUTH_HEADER_PREFIX = 'JWT'
+
+
+def authenticate(username, password):
+    user = username_table.get(username, None)
+    if user and hmac.compare_digest(
+            user.password.encode('utf-8'),
+            password.encode('utf-8')):
+        return user
+
+
+def identity(payload):
+    user_id = payload['identity']
+    return userid_table.get(user_id, None)
+
+
+def encode_token(user):
+    """
+        Generate an access token, as Flask-JWT does
+
+        :param: user: Authenticated user
+        :return: Token string
+    """
+    iat = datetime.datetime.utcnow()
+    payload = {'exp': iat + datetime.timedelta(
+                   days=constants.JWT_EXPIRATION_DAYS),
+               'iat': iat,
+               'nbf': iat,
+               'identity': user.id}
+    token = jwt.encode(payload, credentials.SECRET_KEY,
+                       algorithm=JWT_ALGORITHM)
+    # PyJWT 1.x returns bytes
+    if isinstance(token, bytes):
+        token = token.decode('utf-8')
+    return token
+
+
+def jwt_error(error, description, status_code=401):
+    """
+        Error response in the format of Flask-JWT
+    """
+    return web.json_response(
+        {"status_code": status_code, "error": error,
+         "description": description}, status=status_code,
+        headers={"WWW-Authenticate": 'JWT realm="Login Required"'})
+
+
+def jwt_required(handler):
+    """
+        Decorator of the handlers that need a valid token in the
+        Authorization header
+    """
+    @functools.wraps(handler)
+    async def wrapper(request):
+        auth_header = request.headers.get('Authorization')
+        if not auth_header:
+            return jwt_error('Authorization Required',
+                             'Request does not contain an access token')
+        parts = auth_header.split()
+        if parts[0].lower() != JWT_AUTH_HEADER_PREFIX.lower():
+            return jwt_error('Invalid JWT header',
+                             'Unsupported authorization type')
+        if len(parts) != 2:
+            return jwt_error('Invalid JWT header',
+                             'Token missing or contains spaces')
+        try:
+            payload = jwt.decode(parts[1], credentials.SECRET_KEY,
+                                 algorithms=[JWT_ALGORITHM],
+                                 leeway=JWT_LEEWAY)
+        except jwt.InvalidTokenError as e:
+            return jwt_error('Invalid token', str(e))
+        if identity(payload) is None:
+            return jwt_error('Invalid JWT', 'User does not exist')
+        return await handler(request)
+    return wrapper
+
+
+def setup_logging(logger):
+    # Same rollover policy as the Flask server log
+    file_handler = RotatingFileHandler(
+        "./async_server.log",
+        maxBytes=1024 * 1024 * 1024 * 5,
+        backupCount=5)
+    file_handler.setFormatter(
+        logging.Formatter(
+            '[%(asctime)s][PID:%(process)d][%(levelname)s]'
+            '[%(lineno)s][%(name)s.%(funcName)s()] %(message)s'))
+    file_handler.setLevel(logging.INFO)
+    logger.addHandler(file_handler)
+    logger.setLevel(logging.INFO)
+
+
+def parse_and_validate(body):
+    """
+        Parse and validate a request body (run in the validation thread
+        pool)
+
+        :param: body: Request body (bytes)
+        :return: Tuple of (data or None, validation info, error code)
+    """
+    try:
+        data = json.loads(body)
+    except ValueError:
+        return None, 'Failed to decode JSON object', 400
+    try:
+        validation, err_code = DataValidator.validate_request_sanity(data)
+    except (KeyError, TypeError):
+        return None, 'Invalid schema - metrics or api version missing\n', 401
+    return data, validation, err_code
+
+
+class AsyncDbWriter(object):
+    """asyncio front end of the database manager. It keeps an asyncio FIFO
+    per database, with the same size and timeout as the dbManager ones, and
+    writer_threads tasks per database that write the queued data in batches
+    with dbManager.write_db_batch in a thread pool. Each thread of the pool
+    uses its own database clients, see dbManager.get_db_client.
+    """
+
+    def __init__(self, dbm):
+        self.dbm = dbm
+        self.write_queues = {}
+        self.tasks = []
+        self.executor = None
+
+    async def store(self, data):
+        """
+            Places data in the FIFO of its database. If the FIFO is still
+            full after queue_timeout seconds the data is rejected with error
+            code 503, so the client can retry later.
+
+            :param: data: Data to be placed in FIFO
+            :return: Validation info and error code
+        """
+        metrics = data['metadata']['metrics']
+        write_queue = self.write_queues.get(
+            self.dbm.get_db_client_name(metrics))
+        if write_queue is None:
+            self.dbm.app.logger.error("Invalid metrics %s" % (metrics))
+            return "Invalid metrics %s" % metrics, 400
+        try:
+            # Items of the FIFOs are lists of data, see store_many
+            await asyncio.wait_for(write_queue.put([data]),
+                                   timeout=self.dbm.queue_timeout)
+        except asyncio.TimeoutError:
+            validation = "** Database busy, retry later. ** "
+            self.dbm.app.logger.error(pformat({"error_code": 503,
+                                               "info": validation,
+                                               "metrics": metrics}))
+            return validation, 503
+        return 'OK', 204
+
+    async def store_many(self, data_list):
+        """
+            Places a list of data in the FIFOs of their databases, as one
+            item per database, see dbManager.store_many
+
+            :param: data_list: List of data to be placed in FIFOs
+            :return: List of validation info and error code, one per data
+        """
+        results = [('OK', 204)] * len(data_list)
+        groups = {}
+        for index, data in enumerate(data_list):
+            metrics = data['metadata']['metrics']
+            client_name = self.dbm.get_db_client_name(metrics)
+            if client_name not in self.write_queues:
+                self.dbm.app.logger.error("Invalid metrics %s" % (metrics))
+                results[index] = ("Invalid metrics %s" % metrics, 400)
+                continue
+            groups.setdefault(client_name, []).append(index)
+
+        async def put(client_name, indexes):
+            try:
+                await asyncio.wait_for(
+                    self.write_queues[client_name].put(
+                        [data_list[index] for index in indexes]),
+                    timeout=self.dbm.queue_timeout)
+            except asyncio.TimeoutError:
+                validation = "** Database busy, retry later. ** "
+                self.dbm.app.logger.error(pformat({"error_code": 503,
+                                                   "info": validation,
+                                                   "database": client_name}))
+                for index in indexes:
+                    results[index] = (validation, 503)
+
+        await asyncio.gather(*[put(client_name, indexes)
+                               for client_name, indexes in groups.items()])
+        return results
+
+    async def get_batch(self, write_queue):
+        """
+            Wait for data in a write FIFO, then take items until there are
+            batch_size data, waiting at most batch_wait_ms for more items to
+            come
+
+            :param: write_queue: FIFO of a database
+            :return: List of FIFO items (lists of data)
+        """
+        batch = [await write_queue.get()]
+        deadline = time.monotonic() + self.dbm.batch_wait_ms / 1000.0
+        while sum(len(item) for item in batch) < self.dbm.batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining > 0:
+                    batch.append(await asyncio.wait_for(write_queue.get(),
+                                                        timeout=remaining))
+                else:
+                    batch.append(write_queue.get_nowait())
+            except (asyncio.TimeoutError, asyncio.QueueEmpty):
+                break
+        return batch
+
+    async def write_db_loop(self, write_queue):
+        loop = asyncio.get_event_loop()
+        while True:
+            batch = await self.get_batch(write_queue)
+            try:
+                # Conversion and write block, keep them off the event loop
+                await loop.run_in_executor(
+                    self.executor, self.dbm.write_db_batch,
+                    [data for item in batch for data in item])
+            except Exception as e:
+                self.dbm.app.logger.error(
+                    "** DB Writer Task Failed. ** \n%s" % e)
+            finally:
+                for _ in batch:
+                    write_queue.task_done()
+
+    def start(self):
+        """
+            Create the FIFOs and spawn writer_threads writer tasks per
+            database, in the running event loop
+        """
+        client_names = list(self.dbm.databases)
+        self.executor = concurrent.futures.ThreadPoolExecutor(
+            self.dbm.writer_threads * len(client_names))
+        for client_name in client_names:
+            write_queue = asyncio.Queue(maxsize=self.dbm.queue_buff_sz)
+            self.write_queues[client_name] = write_queue
+            for _ in range(self.dbm.writer_threads):
+                self.tasks.append(asyncio.ensure_future(
+                    self.write_db_loop(write_queue)))
+        return self
+
+    async def stop(self):
+        """
+            Write the data still queued and stop the writer tasks
+        """
+        self.dbm.app.logger.info("** Shutting Down Database Writer **")
+        for write_queue in self.write_queues.values():
+            await write_queue.join()
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.executor.shutdown()
+
+
+# ----------------------- API Methods -------------------------------------- #
+
+async def auth(request):
+    """
+        Authenticate a user and return an access token, as the /auth
+        endpoint of Flask-JWT
+    """
+    try:
+        data = await request.json()
+        username = data.get('username')
+        password = data.get('password')
+    except (ValueError, AttributeError):
+        username = password = None
+    user = None
+    if username and password:
+        user = authenticate(username, password)
+    if user is None:
+        return jwt_error('Bad Request', 'Invalid credentials')
+    return web.json_response({"access_token": encode_token(user)})
+
+
+@jwt_required
+async def add_db_entry(request):
+    """
+        Store received data to database if validation is okay
+
+        :return: validation information and error code
+    """
+    app = request.app
+    body = await request.read()
+    data, validation, err_code = await asyncio.get_event_loop(
+    ).run_in_executor(app['validation_executor'], parse_and_validate, body)
+    if validation == "OK":
+        app.logger.info("<<<<VALIDATION OK>>>>")
+        validation, err_code = await app['db_writer'].store(data)
+    else:
+        app.logger.error("<<<<VALIDATION NOT OK>>>>")
+        app.logger.error(pformat({"data": validation, "error_code": err_code}))
+    headers = None
+    if err_code == 503:
+        # Database busy, tell the client when to retry
+        headers = {"Retry-After": str(constants.RETRY_AFTER)}
+    return web.json_response({"data": validation, "error_code": err_code},
+                             status=err_code, headers=headers)
+
+
+@jwt_required
+async def add_db_entries(request):
+    """
+        Store the valid documents of a newline-delimited JSON request body,
+        optionally gzip compressed, to database
+
+        :return: validation information and error code of each document
+    """
+    app = request.app
+    # aiohttp already decompressed a gzip body, up to client_max_size bytes
+    body = await request.read()
+    try:
+        documents = await asyncio.get_event_loop().run_in_executor(
+            app['validation_executor'], DataValidator.validate_batch, body)
+    except ValueError as e:
+        app.logger.error(str(e))
+        return web.json_response({"data": str(e), "error_code": 400},
+                                 status=400)
+    results = [(validation, err_code)
+               for _, validation, err_code in documents]
+    valid = [index for index, (data, _, _) in enumerate(documents)
+             if data is not None]
+    app.logger.info("<<<<BATCH: %d of %d documents VALID>>>>" %
+                    (len(valid), len(documents)))
+    # Queue all the valid documents at once
+    for index, result in zip(valid, await app['db_writer'].store_many(
+            [documents[index][0] for index in valid])):
+        results[index] = result
+    headers = None
+    if any(err_code == 503 for _, err_code in results):
+        # Database busy, tell the client when to retry the rejected ones
+        headers = {"Retry-After": str(constants.RETRY_AFTER)}
+    return web.json_response(
+        {"data": [{"data": validation, "error_code": err_code}
+                  for validation, err_code in results],
+         "error_code": 200}, headers=headers)
+
+
+async def home(request):
+    return web.json_response({"type": "INFO", "data": "Quality Metrics"})
+
+
+async def on_startup(app):
+    app['db_writer'].start()
+
+
+async def on_cleanup(app):
+    await app['db_writer'].stop()
+    app['validation_executor'].shutdown()
+
+
+def create_app(validation_threads=constants.VALIDATION_THREADS):
+    """
+        Create the asyncio broker application
+
+        :param: validation_threads: Threads parsing and validating requests
+        :return: aiohttp application
+    """
+    logger = logging.getLogger(__name__)
+    setup_logging(logger)
+    app = web.Application(logger=logger,
+                          client_max_size=constants.MAX_REQUEST_SIZE)
+    app['validation_executor'] = concurrent.futures.ThreadPoolExecutor(
+        validation_threads)
+    app['db_writer'] = AsyncDbWriter(dbManager(app=app))
+    app.on_startup.append(on_startup)
+    app.on_cleanup.append(on_cleanup)
+    app.router.add_post('/auth', auth)
+    app.router.add_post('/', add_db_entry)
+    app.router.add_post('/batch', add_db_entries)
+    app.router.add_get('/', home)
+    DataValidator.start_watcher()
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Asyncio quality metrics broker")
+    parser.add_argument('--host', default=constants.LISTEN_ALL_IPS)
+    parser.add_argument('--port', type=int, default=5000)
+    parser.add_argument('--validation-threads', type=int,
+                        default=constants.VALIDATION_THREADS,
+                        help='Threads parsing and validating the requests')
+    args = parser.parse_args()
+    web.run_app(create_app(args.validation_threads), host=args.host,
+                port=args.port)
+
+
+if __name__ == '__main__':
+    main()
@@ -21,9 +21,31 @@ HOST = "<Host Public IP Address>"
 PORT = "8086"
 BUFF_SIZE = 10
 POLL_DELAY = 0.1
+# Maximum number of queued payloads written together, time (ms) the writer
+# waits for more payloads once it got one, and maximum number of points per
+# InfluxDB write request
+BATCH_SIZE = 100
+BATCH_WAIT_MS = 50
+WRITE_BATCH_SIZE = 5000
+# Writer threads per database, time (s) a request waits for room in the
+# queue of its database before being rejected, and time (s) the client is
+# asked to wait before retrying a rejected request
+WRITER_THREADS = 2
+QUEUE_TIMEOUT = 5
+RETRY_AFTER = 30
 
 LISTEN_ALL_IPS = "0.0.0.0"
 
+# Threads parsing and validating the requests of the asyncio server
+# (async_metrics_server.py), and maximum request size (bytes) of both
+# servers and of the decompressed /batch requests
+VALIDATION_THREADS = 4
+MAX_REQUEST_SIZE = 256 * 1024 * 1024
+
+# Folder of the metrics schemas and how often (s) it is checked for changes
+SCHEMAS_FOLDER = "metrics-schemas"
+SCHEMA_RELOAD_INTERVAL = 5
+
 VALID_METRICS = [
     'tfm_image_size',
     'tfa_code_churn',
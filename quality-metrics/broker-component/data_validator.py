@@ -18,17 +18,91 @@ __copyright__ = """
 
 """
 
+import os
+import re
 import sys
+import glob
 import json
-import os.path
+import time
+import zlib
+import threading
 import constants
 import jsonschema
-from jsonschema import validate
+import schema_compiler
+
+SCHEMA_PATTERN = re.compile(r'^(?P<metrics>.+)_schema_(?P<version>[0-9_]+)'
+                            r'\.json$')
 
 
 class DataValidator:
+    # (metrics, api version) => (schema file, mtime, validator, compiled
+    # validation function or None if the schema could not be compiled)
+    schemas = {}
+    lock = threading.Lock()
+    loaded = False
+
     @staticmethod
-    def validate_request_sanity(data_dict):
+    def schema_filename(metrics, api_version):
+        return os.path.join(constants.SCHEMAS_FOLDER, metrics + '_schema_' +
+                            api_version.replace(".", "_") + '.json')
+
+    @classmethod
+    def load_schemas(cls):
+        """
+            Build the validators of all the schemas, reloading only the
+            schema files whose modification time changed since they were
+            loaded and forgetting the ones removed
+        """
+        with cls.lock:
+            found = {}
+            for filename in glob.glob(os.path.join(
+                    constants.SCHEMAS_FOLDER, '*_schema_*.json')):
+                match = SCHEMA_PATTERN.match(os.path.basename(filename))
+                if not match:
+                    continue
+                key = (match.group('metrics'),
+                       match.group('version').replace("_", "."))
+                try:
+                    mtime = os.stat(filename).st_mtime_ns
+                    entry = cls.schemas.get(key)
+                    if entry is None or entry[1] != mtime:
+                        with open(filename, 'r') as handle:
+                            schema = json.load(handle)
+                        validator_class = jsonschema.validators.validator_for(
+                            schema)
+                        validator_class.check_schema(schema)
+                        try:
+                            compiled = schema_compiler.compile_schema(schema)
+                        except schema_compiler.UnsupportedSchema:
+                            compiled = None
+                        entry = (filename, mtime, validator_class(schema),
+                                 compiled)
+                    found[key] = entry
+                except (OSError, ValueError,
+                        jsonschema.exceptions.SchemaError) as e:
+                    sys.stderr.write("Schema %s not loaded: %s\n" %
+                                     (filename, e))
+            cls.schemas = found
+            cls.loaded = True
+
+    @classmethod
+    def start_watcher(cls, interval=constants.SCHEMA_RELOAD_INTERVAL):
+        """
+            Spawn a new thread that reloads the schemas that changed every
+            interval seconds
+        """
+        def watch_loop():
+            while True:
+                time.sleep(interval)
+                cls.load_schemas()
+
+        cls.load_schemas()
+        watcher = threading.Thread(target=watch_loop)
+        watcher.daemon = True
+        watcher.start()
+
+    @classmethod
+    def validate_request_sanity(cls, data_dict):
         """
             Input sanitisation/authentication in the application flow
 
@@ -40,21 +114,96 @@ class DataValidator:
             if data_dict['api_version'] not in constants.SUPPORTED_API_VERSIONS:
                 return 'Incorrect API version', 401
 
-            filename = 'metrics-schemas/' + data_dict['metadata']['metrics'] + '_schema_' + \
-                data_dict['api_version'].replace(".", "_") + '.json'
-            if not os.path.exists(filename):
-                return filename + ' does not exist', 501
+            if not cls.loaded:
+                cls.load_schemas()
+            entry = cls.schemas.get((data_dict['metadata']['metrics'],
+                                     data_dict['api_version']))
+            if entry is None:
+                return cls.schema_filename(
+                    data_dict['metadata']['metrics'],
+                    data_dict['api_version']) + ' does not exist', 501
 
-            try:
-                with open(filename, 'r') as handle:
-                    parsed = json.load(handle)
-                validate(data_dict, parsed)
+            # Fast path, jsonschema is only needed to explain the errors
+            if entry[3] is not None and entry[3](data_dict):
+                sys.stdout.write('Record OK\n')
+                return 'OK', 204
+            ve = jsonschema.exceptions.best_match(
+                entry[2].iter_errors(data_dict))
+            if ve is None:
                 sys.stdout.write('Record OK\n')
                 return 'OK', 204
-            except jsonschema.exceptions.ValidationError as ve:
-                sys.stdout.write('Record ERROR\n')
-                sys.stderr.write(str(ve) + "\n")
-                return 'Incorrect JSON Schema: ' + \
-                    str(ve).split('\n', 1)[0], 400
+            sys.stdout.write('Record ERROR\n')
+            sys.stderr.write(str(ve) + "\n")
+            return 'Incorrect JSON Schema: ' + \
+                str(ve).split('\n', 1)[0], 400
         else:
             return 'Invalid schema - metrics or api version missing\n', 401
+
+    @staticmethod
+    def gunzip(body):
+        """
+            Decompress gzip data, made of one or more gzip members (e.g.
+            concatenated gzip files), up to MAX_REQUEST_SIZE bytes in total
+
+            :param: body: gzip data (bytes)
+            :return: Decompressed data
+            :raises: ValueError if the data is not valid gzip or too large
+        """
+        chunks = []
+        size = 0
+        while True:
+            decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+            try:
+                # One byte over the limit tells a too large body
+                chunk = decompressor.decompress(
+                    body, constants.MAX_REQUEST_SIZE - size + 1)
+            except zlib.error as e:
+                raise ValueError('Invalid gzip data: %s' % e)
+            size += len(chunk)
+            if size > constants.MAX_REQUEST_SIZE:
+                raise ValueError('Decompressed data larger than %d bytes' %
+                                 constants.MAX_REQUEST_SIZE)
+            if not decompressor.eof:
+                raise ValueError('Invalid gzip data: truncated')
+            chunks.append(chunk)
+            # The next member, if any
+            body = decompressor.unused_data
+            if not body:
+                return b''.join(chunks)
+            if not body.startswith(b'\x1f\x8b'):
+                raise ValueError('Invalid gzip data: trailing garbage')
+
+    @classmethod
+    def validate_batch(cls, body, content_encoding=None):
+        """
+            Parse and validate a batch of newline-delimited JSON documents,
+            optionally gzip compressed. Empty lines are ignored.
+
+            :param: body: Request body (bytes)
+            :param: content_encoding: Content-Encoding of the body
+            :return: List of (data or None, validation info, error code),
+                     one per document
+            :raises: ValueError if the body cannot be decoded
+        """
+        if content_encoding == 'gzip':
+            body = cls.gunzip(body)
+        elif content_encoding not in (None, '', 'identity'):
+            raise ValueError('Unsupported Content-Encoding ' +
+                             content_encoding)
+        results = []
+        for line in body.splitlines():
+            if not line.strip():
+                continue
+            try:
+                data = json.loads(line)
+            except ValueError:
+                results.append((None, 'Failed to decode JSON object', 400))
+                continue
+            try:
+                validation, err_code = cls.validate_request_sanity(data)
+            except (KeyError, TypeError):
+                validation, err_code = \
+                    'Invalid schema - metrics or api version missing\n', 401
+            results.append((data if validation == 'OK' else None,
+                            validation, err_code))
+        return results
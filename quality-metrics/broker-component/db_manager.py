@@ -21,7 +21,7 @@ __copyright__ = """
 
 import time
 import threading
-from queue import Queue
+from queue import Queue, Empty, Full
 from pprint import pformat
 from influxdb import InfluxDBClient
 
@@ -37,37 +37,67 @@ class dbManager(object):
                  password=None,
                  buff_size=constants.BUFF_SIZE,
                  poll_delay=constants.POLL_DELAY,
+                 batch_size=constants.BATCH_SIZE,
+                 batch_wait_ms=constants.BATCH_WAIT_MS,
+                 write_batch_size=constants.WRITE_BATCH_SIZE,
+                 writer_threads=constants.WRITER_THREADS,
+                 queue_timeout=constants.QUEUE_TIMEOUT,
                  app=None):
         self.queue_buff_sz = buff_size
         self.poll_delay = poll_delay
+        self.batch_size = batch_size
+        self.batch_wait_ms = batch_wait_ms
+        self.write_batch_size = write_batch_size
+        self.writer_threads = writer_threads
+        self.queue_timeout = queue_timeout
 
         self.db_host = host
         self.db_port = port
         self.db_user = user
         self.db_pass = password
-        self.write_queue = Queue(maxsize=self.queue_buff_sz)
+        # One FIFO per database, so a slow database does not hold up the
+        # others
+        self.write_queues = {}
+        self.db_write_threads = []
         self.stop_threads = False
         self.app = app
+        # Database name per client name. The clients are created per
+        # thread, see get_db_client
+        self.databases = {}
+        self.local = threading.local()
 
         for key in constants.DATABASE_DICT:
-            client = InfluxDBClient(host=self.db_host,
-                                    port=self.db_port,
-                                    username=self.db_user,
-                                    password=self.db_pass,
-                                    database=constants.DATABASE_DICT[key])
-            setattr(self, key.lower() + '_client', client)
+            self.databases[key.lower() + '_client'] = \
+                constants.DATABASE_DICT[key]
+            self.write_queues[key.lower() + '_client'] = Queue(
+                maxsize=self.queue_buff_sz)
 
     def store(self, data):
         """
-            Places data in the FIFO to be broadcast when
-            the database is not busy
+            Places data in the FIFO of its database to be broadcast when
+            the database is not busy. If the FIFO is still full after
+            queue_timeout seconds the data is rejected with error code 503,
+            so the client can retry later.
 
             :param: data: Data to be placed in FIFO
         """
         validation = 'OK'
         err_code = 204
         try:
-            self.write_queue.put(data)
+            metrics = data['metadata']['metrics']
+            write_queue = self.write_queues.get(self.get_db_client_name(
+                metrics))
+            if write_queue is None:
+                self.app.logger.error("Invalid metrics %s" % (metrics))
+                return "Invalid metrics %s" % metrics, 400
+            # Items of the FIFOs are lists of data, see store_many
+            write_queue.put([data], timeout=self.queue_timeout)
+        except Full:
+            validation = "** Database busy, retry later. ** "
+            err_code = 503
+            self.app.logger.error(pformat({"error_code": err_code,
+                                           "info": validation,
+                                           "metrics": metrics}))
         except Exception as e:
             validation = "** Write to Queue Failed. ** "
             err_code = 402
@@ -76,17 +106,73 @@ class dbManager(object):
                                            "info": validation, "exception": e}))
         return validation, err_code
 
-    def get_db_client(self, metrics):
+    def store_many(self, data_list):
+        """
+            Places a list of data in the FIFOs of their databases, as one
+            item per database. The data of a database is rejected with
+            error code 503 if its FIFO is still full after queue_timeout
+            seconds.
+
+            :param: data_list: List of data to be placed in FIFOs
+            :return: List of validation info and error code, one per data
+        """
+        results = [('OK', 204)] * len(data_list)
+        groups = {}
+        for index, data in enumerate(data_list):
+            metrics = data['metadata']['metrics']
+            client_name = self.get_db_client_name(metrics)
+            if client_name not in self.write_queues:
+                self.app.logger.error("Invalid metrics %s" % (metrics))
+                results[index] = ("Invalid metrics %s" % metrics, 400)
+                continue
+            groups.setdefault(client_name, []).append(index)
+        for client_name, indexes in groups.items():
+            try:
+                self.write_queues[client_name].put(
+                    [data_list[index] for index in indexes],
+                    timeout=self.queue_timeout)
+            except Full:
+                validation = "** Database busy, retry later. ** "
+                self.app.logger.error(pformat({"error_code": 503,
+                                               "info": validation,
+                                               "database": client_name}))
+                for index in indexes:
+                    results[index] = (validation, 503)
+        return results
+
+    @staticmethod
+    def get_db_client_name(metrics):
         if "stats" in metrics:
-            client = metrics.replace("_stats", "") + "_client"
+            return metrics.replace("_stats", "") + "_client"
         elif "tracking" in metrics:
-            client = metrics.replace("_tracking", "") + "_client"
+            return metrics.replace("_tracking", "") + "_client"
         else:
-            client = metrics + "_client"
-        if hasattr(self, client):
-            return getattr(self, client)
-        else:
-            self.app.logger.error("Invalid metrics %" % (metrics))
+            return metrics + "_client"
+
+    def get_db_client(self, metrics):
+        """
+            Get the database client of the metrics for the calling thread.
+            Every writer thread has its own clients, since the requests
+            session of an InfluxDBClient is not thread safe.
+
+            :param: metrics: Metrics name
+            :return: InfluxDBClient, None if the metrics is not valid
+        """
+        client_name = self.get_db_client_name(metrics)
+        if client_name not in self.databases:
+            self.app.logger.error("Invalid metrics %s" % (metrics))
+            return None
+        clients = getattr(self.local, 'clients', None)
+        if clients is None:
+            clients = self.local.clients = {}
+        if client_name not in clients:
+            clients[client_name] = InfluxDBClient(
+                host=self.db_host,
+                port=self.db_port,
+                username=self.db_user,
+                password=self.db_pass,
+                database=self.databases[client_name])
+        return clients[client_name]
 
     def write_db_direct(self, data):
         """
@@ -114,33 +200,109 @@ class dbManager(object):
                 "%s database not connected.." %
                 data['metadata']['metrics'])
 
+    def write_db_batch(self, batch):
+        """
+            Write a batch of data to the database, with one request per
+            database ( will block if database is busy )
+
+            :param: batch: List of data to be written to database
+        """
+        points = {}
+        for data in batch:
+            metrics = data['metadata']['metrics']
+            db_client = self.get_db_client(metrics)
+            if not db_client:
+                self.app.logger.error(
+                    "%s database not connected.." % metrics)
+                continue
+            try:
+                converted_data = DataConverter.convert_data(data)
+            except Exception as e:
+                self.app.logger.error(
+                    "Converting %s data has FAILED: %s" % (metrics, e))
+                continue
+            # Group the points by database
+            entry = points.setdefault(id(db_client), (db_client, [], set()))
+            entry[1].extend(converted_data)
+            entry[2].add(metrics)
+
+        for db_client, converted_data, metrics in points.values():
+            if db_client.write_points(converted_data,
+                                      batch_size=self.write_batch_size):
+                self.app.logger.info(
+                    "Writing %d points to InfluxDB hosted at %s "
+                    "has been successful for %s!" %
+                    (len(converted_data), self.db_host,
+                     ", ".join(sorted(metrics))))
+            else:
+                self.app.logger.error(
+                    "Writing %d points to InfluxDB hosted at %s "
+                    "has FAILED for %s!" %
+                    (len(converted_data), self.db_host,
+                     ", ".join(sorted(metrics))))
+
+    def get_batch(self, write_queue):
+        """
+            Wait for data in a write FIFO, then take items until there are
+            batch_size data, waiting at most batch_wait_ms for more items to
+            come
+
+            :param: write_queue: FIFO of a database
+            :return: List of FIFO items (lists of data), empty if nothing
+                     came in poll_delay
+        """
+        try:
+            batch = [write_queue.get(timeout=self.poll_delay)]
+        except Empty:
+            return []
+        deadline = time.monotonic() + self.batch_wait_ms / 1000.0
+        while sum(len(item) for item in batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining > 0:
+                    batch.append(write_queue.get(timeout=remaining))
+                else:
+                    batch.append(write_queue.get_nowait())
+            except Empty:
+                break
+        return batch
+
     def start_daemon(self):
         """
-            Spawn a new thread that will consume data in the write FIFO
-            and place it into the databse
+            Spawn writer_threads new threads per database that will consume
+            data in the write FIFO of the database and place it into the
+            databse in batches
         """
 
-        def write_db_loop():
+        def write_db_loop(write_queue):
 
             while True:
                 try:
-                    time.sleep(self.poll_delay)
                     if self.stop_threads:
                         self.app.logger.info(
                             "\n ** Shutting Down Database Writer **")
                         return
-                    elif self.write_queue.qsize() > 0:
-                        dt = self.write_queue.get()
-                        # Write the data to the databse
-                        self.write_db_direct(dt)
-                        self.write_queue.task_done()
+                    # Blocks for up to poll_delay, so stop is noticed
+                    batch = self.get_batch(write_queue)
+                    if batch:
+                        try:
+                            # Write the data to the databse
+                            self.write_db_batch(
+                                [data for item in batch for data in item])
+                        finally:
+                            for _ in batch:
+                                write_queue.task_done()
                 except Exception as e:
                     self.app.logger.error(
                         "** DB Writer Thread Failed. ** \n%s" % e)
 
-        self.db_write_thread = threading.Thread(target=write_db_loop)
-        self.db_write_thread.daemon = True
-        self.db_write_thread.start()
+        for write_queue in self.write_queues.values():
+            for _ in range(self.writer_threads):
+                db_write_thread = threading.Thread(target=write_db_loop,
+                                                   args=(write_queue,))
+                db_write_thread.daemon = True
+                db_write_thread.start()
+                self.db_write_threads.append(db_write_thread)
         return self
 
     def stop(self):
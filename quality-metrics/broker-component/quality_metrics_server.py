@@ -94,9 +94,13 @@ app.debug = True
 app.config['SECRET_KEY'] = credentials.SECRET_KEY
 app.config['JWT_EXPIRATION_DELTA'] = datetime.timedelta(
     days=constants.JWT_EXPIRATION_DAYS)
+# Larger requests are rejected with error code 413, see check_request_size
+app.config['MAX_CONTENT_LENGTH'] = constants.MAX_REQUEST_SIZE
 
 dbm = dbManager(app=app).start_daemon()
 
+DataValidator.start_watcher()
+
 jwt = JWT(app, authenticate, identity)
 
 # ----------------------- Database Methods ----------------------------------#
@@ -114,6 +118,22 @@ def store_to_db(data_dict):
 # ----------------------- FLASK API Methods ---------------------------------- #
 
 
+@app.before_request
+def check_request_size():
+    """
+        Reject the requests larger than MAX_CONTENT_LENGTH before they are
+        read. Werkzeug only checks it when parsing form data.
+
+        :return: validation information and error code if too large
+    """
+    if request.content_length is not None and \
+            request.content_length > app.config['MAX_CONTENT_LENGTH']:
+        validation = "Request larger than %d bytes" % \
+            app.config['MAX_CONTENT_LENGTH']
+        app.logger.error(validation)
+        return jsonify({"data": validation, "error_code": 413}), 413
+
+
 @app.route('/', methods=['POST'])
 @jwt_required()
 def add_db_entry():
@@ -135,9 +155,59 @@ def add_db_entry():
         app.logger.error("<<<<VALIDATION NOT OK>>>>")
         app.logger.error(pformat({"data": validation, "error_code": err_code}))
     info_json = jsonify({"data": validation, "error_code": err_code})
+    if err_code == 503:
+        # Database busy, tell the client when to retry
+        return info_json, err_code, {
+            "Retry-After": str(constants.RETRY_AFTER)}
     return info_json, err_code
 
 
+def batch_response(results):
+    """
+        Response of a batch request
+
+        :param: results: List of validation info and error code, one per
+                         document
+        :return: Response with the status of each document
+    """
+    info_json = jsonify({"data": [{"data": validation, "error_code": err_code}
+                                  for validation, err_code in results],
+                         "error_code": 200})
+    if any(err_code == 503 for _, err_code in results):
+        # Database busy, tell the client when to retry the rejected ones
+        return info_json, 200, {"Retry-After": str(constants.RETRY_AFTER)}
+    return info_json, 200
+
+
+@app.route('/batch', methods=['POST'])
+@jwt_required()
+def add_db_entries():
+    """
+        Store the valid documents of a newline-delimited JSON request body,
+        optionally gzip compressed, to database
+
+        :return: validation information and error code of each document
+    """
+    app.logger.debug("Received Batch (POST)")
+    try:
+        documents = DataValidator.validate_batch(
+            request.get_data(), request.headers.get('Content-Encoding'))
+    except ValueError as e:
+        app.logger.error(str(e))
+        return jsonify({"data": str(e), "error_code": 400}), 400
+    results = [(validation, err_code)
+               for _, validation, err_code in documents]
+    valid = [index for index, (data, _, _) in enumerate(documents)
+             if data is not None]
+    app.logger.info("<<<<BATCH: %d of %d documents VALID>>>>" %
+                    (len(valid), len(documents)))
+    # Queue all the valid documents at once
+    for index, result in zip(valid, dbm.store_many(
+            [documents[index][0] for index in valid])):
+        results[index] = result
+    return batch_response(results)
+
+
 @app.route("/")
 def home():
     info_json = jsonify({"type": "INFO", "data": "Quality Metrics"})
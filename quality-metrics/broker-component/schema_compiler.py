@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+
+__copyright__ = """
+/*
+ * Copyright (c) 2020, Arm Limited. All rights reserved.
+ *
+ * SPDX-License-Identifier: BSD-3-Clause
+ *
+ */
+ """
+
+""" schema_compiler.py:
+
+    JSON schema compiler. Generates a plain Python function that tells if
+    a document is valid against a schema, for the subset of JSON schema used
+    by the metrics schemas (type, properties, required, additionalProperties,
+    patternProperties, minProperties, items, minItems and oneOf). The
+    function does not explain why a document is invalid; jsonschema is
+    still used for the error messages.
+
+"""
+
+import re
+
+# Python expression checking each JSON type, '{}' is the value
+TYPE_CHECKS = {
+    "object": "isinstance({0}, dict)",
+    "array": "isinstance({0}, list)",
+    "string": "isinstance({0}, str)",
+    "number": "(isinstance({0}, (int, float)) and "
+              "not isinstance({0}, bool))",
+    "integer": "((isinstance({0}, int) and not isinstance({0}, bool)) or "
+               "(isinstance({0}, float) and {0}.is_integer()))",
+    "boolean": "isinstance({0}, bool)",
+    "null": "{0} is None"
+}
+
+# Keywords without effect on validation
+IGNORED_KEYWORDS = {"$schema", "$id", "id", "title", "description",
+                    "$comment", "examples", "default"}
+
+
+class UnsupportedSchema(Exception):
+    pass
+
+
+class SchemaCompiler(object):
+    """Generates the source code of the validation functions of a schema.
+    Every (sub)schema is a sequence of statements that return False as soon
+    as the value is not valid.
+    """
+
+    def __init__(self):
+        self.functions = []
+        self.namespace = {}
+        self.counter = 0
+
+    def new_name(self, prefix):
+        self.counter += 1
+        return "{}_{}".format(prefix, self.counter)
+
+    def constant(self, value):
+        """
+            Add a constant to the namespace of the generated code
+
+            :return: Name of the constant
+        """
+        name = self.new_name("_constant")
+        self.namespace[name] = value
+        return name
+
+    def function(self, schema):
+        """
+            Generate a function validating a schema
+
+            :return: Name of the function
+        """
+        name = self.new_name("_validate")
+        lines = ["def {}(value):".format(name)]
+        self.emit(schema, "value", 1, lines)
+        lines.append("    return True")
+        self.functions.append("\n".join(lines))
+        return name
+
+    def emit(self, schema, var, level, lines):
+        """
+            Generate the statements validating a value
+
+            :param: schema: Schema of the value
+            :param: var: Name of the variable holding the value
+            :param: level: Indentation level
+            :param: lines: List of source lines to be extended
+        """
+        indent = "    " * level
+        if schema is True:
+            return
+        if schema is False:
+            lines.append(indent + "return False")
+            return
+        if not isinstance(schema, dict):
+            raise UnsupportedSchema("Invalid schema %r" % (schema,))
+        unsupported = set(schema) - IGNORED_KEYWORDS - {
+            "type", "properties", "required", "additionalProperties",
+            "patternProperties", "minProperties", "items", "minItems",
+            "oneOf"}
+        if unsupported:
+            raise UnsupportedSchema("Unsupported keywords: " +
+                                    ", ".join(sorted(unsupported)))
+
+        if "type" in schema:
+            types = schema["type"]
+            if isinstance(types, str):
+                types = [types]
+            if any(t not in TYPE_CHECKS for t in types):
+                raise UnsupportedSchema("Unsupported type %r" % (types,))
+            lines.append(indent + "if not ({}):".format(" or ".join(
+                TYPE_CHECKS[t].format(var) for t in types)))
+            lines.append(indent + "    return False")
+
+        if "oneOf" in schema:
+            names = [self.function(subschema)
+                     for subschema in schema["oneOf"]]
+            lines.append(indent + "if [{}].count(True) != 1:".format(
+                ", ".join("{}({})".format(name, var) for name in names)))
+            lines.append(indent + "    return False")
+
+        object_keywords = {"properties", "required", "additionalProperties",
+                           "patternProperties", "minProperties"}
+        if object_keywords & set(schema):
+            lines.append(indent + "if isinstance({}, dict):".format(var))
+            self.emit_object(schema, var, level + 1, lines)
+
+        if "items" in schema or "minItems" in schema:
+            lines.append(indent + "if isinstance({}, list):".format(var))
+            self.emit_array(schema, var, level + 1, lines)
+
+    def emit_object(self, schema, var, level, lines):
+        indent = "    " * level
+        lines.append(indent + "pass")
+        if "minProperties" in schema:
+            lines.append(indent + "if len({}) < {}:".format(
+                var, int(schema["minProperties"])))
+            lines.append(indent + "    return False")
+        if schema.get("required"):
+            lines.append(indent + "if {}:".format(" or ".join(
+                "{!r} not in {}".format(key, var)
+                for key in schema["required"])))
+            lines.append(indent + "    return False")
+        for key, subschema in schema.get("properties", {}).items():
+            if subschema is True or subschema == {}:
+                continue
+            item = self.new_name("v")
+            lines.append(indent + "if {!r} in {}:".format(key, var))
+            lines.append(indent + "    {} = {}[{!r}]".format(item, var, key))
+            self.emit(subschema, item, level + 1, lines)
+        patterns = [(self.constant(re.compile(pattern)), subschema)
+                    for pattern, subschema in
+                    schema.get("patternProperties", {}).items()]
+        additional = schema.get("additionalProperties", True)
+        if not patterns and (additional is True or additional == {}):
+            return
+        key = self.new_name("k")
+        item = self.new_name("v")
+        lines.append(indent + "for {}, {} in {}.items():".format(
+            key, item, var))
+        for pattern, subschema in patterns:
+            lines.append(indent + "    if {}.search({}):".format(
+                pattern, key))
+            self.emit(subschema, item, level + 2, lines)
+        if additional is True or additional == {}:
+            return
+        known = self.constant(frozenset(schema.get("properties", {})))
+        condition = "{} not in {}".format(key, known)
+        for pattern, _ in patterns:
+            condition += " and not {}.search({})".format(pattern, key)
+        lines.append(indent + "    if {}:".format(condition))
+        self.emit(additional, item, level + 2, lines)
+
+    def emit_array(self, schema, var, level, lines):
+        indent = "    " * level
+        lines.append(indent + "pass")
+        if "minItems" in schema:
+            lines.append(indent + "if len({}) < {}:".format(
+                var, int(schema["minItems"])))
+            lines.append(indent + "    return False")
+        items = schema.get("items", True)
+        if isinstance(items, list):
+            raise UnsupportedSchema("Unsupported tuple items")
+        if items is True or items == {}:
+            return
+        item = self.new_name("v")
+        lines.append(indent + "for {} in {}:".format(item, var))
+        self.emit(items, item, level + 1, lines)
+
+
+def compile_schema(schema):
+    """
+        Compile a schema into a validation function
+
+        :param: schema: JSON schema
+        :return: Function that takes a document and returns True if it is
+                 valid. The generated source code is in its 'source'
+                 attribute.
+        :raises: UnsupportedSchema if the schema uses keywords out of the
+                 supported subset
+    """
+    compiler = SchemaCompiler()
+    name = compiler.function(schema)
+    source = "\n\n".join(compiler.functions) + "\n"
+    namespace = dict(compiler.namespace)
+    exec(compile(source, "<schema>", "exec"), namespace)
+    function = namespace[name]
+    function.source = source
+    return function
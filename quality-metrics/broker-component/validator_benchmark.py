@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+
+__copyright__ = """
+/*
+ * Copyright (c) 2020, Arm Limited. All rights reserved.
+ *
+ * SPDX-License-Identifier: BSD-3-Clause
+ *
+ */
+ """
+
+""" validator_benchmark.py:
+
+    Benchmark of the validation of a metrics document with many data items:
+    loading the schema and running jsonschema for every request (as the
+    broker used to do), a preloaded jsonschema validator, the compiled
+    validation function used by DataValidator and the whole
+    DataValidator.validate_request_sanity request path.
+
+    Run from the broker-component folder:
+    python3 validator_benchmark.py --metrics tfa_complexity_stats --items 5000
+
+"""
+
+import io
+import re
+import sys
+import json
+import time
+import argparse
+import contextlib
+import jsonschema
+
+import constants
+import schema_compiler
+from data_validator import DataValidator
+
+
+def pattern_key(pattern):
+    """
+        Build a property name matching a patternProperties regular
+        expression, from its literal characters
+
+        :return: Property name, None if no simple one matches
+    """
+    for key in (re.sub(r'[\^$*+?.()|\[\]{}\\]', '', pattern), "key"):
+        if key and re.search(pattern, key):
+            return key
+    return None
+
+
+def sample_instance(schema):
+    """
+        Build a valid instance of a (subset of JSON) schema, with all the
+        properties and two items per array. Of a oneOf, the first
+        alternative is used and the properties only required by the others
+        are left out. Objects with less than minProperties properties get
+        properties matching their patternProperties.
+    """
+    if not isinstance(schema, dict) or not schema:
+        return 0
+    excluded = set()
+    if "oneOf" in schema:
+        first, others = schema["oneOf"][0], schema["oneOf"][1:]
+        for other in others:
+            excluded.update(other.get("required", []))
+        excluded.difference_update(first.get("required", []))
+        excluded.difference_update(schema.get("required", []))
+        schema = dict(schema, **first)
+    kind = schema.get("type")
+    if isinstance(kind, list):
+        kind = kind[0]
+    if kind == "object":
+        instance = {key: sample_instance(value)
+                    for key, value in schema.get("properties", {}).items()
+                    if key not in excluded}
+        for pattern, value in schema.get("patternProperties", {}).items():
+            if len(instance) >= schema.get("minProperties", 0):
+                break
+            key = pattern_key(pattern)
+            if key is not None:
+                instance[key] = sample_instance(value)
+        return instance
+    if kind == "array":
+        return [sample_instance(schema.get("items", {}))
+                for _ in range(max(2, schema.get("minItems", 0)))]
+    if kind == "string":
+        return "value"
+    if kind in ("number", "integer"):
+        return 1
+    if kind == "boolean":
+        return True
+    return None
+
+
+def measure(function, repeat):
+    """
+        :return: Best time in milliseconds of repeat calls to function
+    """
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        elapsed = (time.perf_counter() - start) * 1000
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the validation of metrics documents")
+    parser.add_argument("--metrics", default="tfa_complexity_stats",
+                        choices=constants.VALID_METRICS)
+    parser.add_argument("--api-version", default="1.0")
+    parser.add_argument("--items", type=int, default=5000,
+                        help="Number of data items of the document")
+    parser.add_argument("--repeat", type=int, default=10,
+                        help="Number of runs, the best one is reported")
+    args = parser.parse_args()
+
+    filename = DataValidator.schema_filename(args.metrics, args.api_version)
+    with open(filename) as handle:
+        schema = json.load(handle)
+    document = sample_instance(schema)
+    document["api_version"] = args.api_version
+    document["metadata"]["metrics"] = args.metrics
+    document["data"] = document["data"][:1] * args.items
+
+    def load_and_validate():
+        with open(filename) as handle:
+            jsonschema.validate(document, json.load(handle))
+
+    def validate_request():
+        # The request path prints a line per record
+        with contextlib.redirect_stdout(io.StringIO()):
+            return DataValidator.validate_request_sanity(document)
+
+    validator = jsonschema.validators.validator_for(schema)(schema)
+    compiled = schema_compiler.compile_schema(schema)
+    DataValidator.load_schemas()
+    if not compiled(document) or not validator.is_valid(document):
+        sys.exit("Generated %s document is not valid: %s" % (
+            args.metrics, jsonschema.exceptions.best_match(
+                validator.iter_errors(document))))
+    if validate_request() != ('OK', 204):
+        sys.exit("DataValidator rejected the document: %s" %
+                 (validate_request(),))
+
+    results = [
+        ("load schema + jsonschema.validate", measure(load_and_validate,
+                                                      args.repeat)),
+        ("preloaded jsonschema validator",
+         measure(lambda: validator.is_valid(document), args.repeat)),
+        ("compiled validation function",
+         measure(lambda: compiled(document), args.repeat)),
+        ("DataValidator.validate_request_sanity",
+         measure(validate_request, args.repeat)),
+    ]
+    print("%s, %d data items" % (args.metrics, args.items))
+    for name, elapsed in results:
+        print("%-38s %10.3f ms  x%.1f" % (name, elapsed,
+                                           results[0][1] / elapsed))
+
+
+if __name__ == '__main__':
+    main()
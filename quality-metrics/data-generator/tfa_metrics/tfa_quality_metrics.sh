@@ -178,10 +178,14 @@ write_influxdb_data()
 
   pushd $local_result
 
-  for json_file in *.json; do
-    curl -X POST -H "Content-Type: application/json" -d "$(cat ${json_file})" \
-      "http://${INFLUX_HOST}:5000" -H "${TFA_METRICS_AUTH_TOKEN}"
-  done
+  # Send all the JSON files in one request, one document per line
+  python3 -c 'import json, sys
+for name in sys.argv[1:]:
+    with open(name) as f:
+        print(json.dumps(json.load(f)))' *.json | gzip -c > metrics.ndjson.gz
+  curl -X POST -H "Content-Type: application/x-ndjson" \
+    -H "Content-Encoding: gzip" --data-binary @metrics.ndjson.gz \
+    "http://${INFLUX_HOST}:5000/batch" -H "${TFA_METRICS_AUTH_TOKEN}"
 
   popd
 }